@@ -5,12 +5,44 @@ try:
     import Queue as queue
 except ImportError:
     import queue
+import functools
+import os
 import time
 
+import pandas as pd
+
+from Checkpoint import load_checkpoint, save_checkpoint
 from Events import MarketEvent
 from Events import SignalEvent
 from Events import OrderEvent
 from Events import FillEvent
+from EventBus import EventBus
+from EventJournal import EventJournal, ReplayStrategy
+from Instrumentation import LoopProfiler
+from Performance import periods_per_year
+
+
+class StrategyAccount(object):
+    """
+    One of the strategies run by a Backtest, with its own portfolio, execution
+    handler and events queue. The MarketEvents of the shared data handler are
+    fanned out to all the accounts, the other events stay within their account.
+    """
+
+    def __init__(self, index, name, events, strategy, portfolio, execution_handler):
+        """
+        Parameters:
+        index - Position of the strategy in the list of strategies.
+        name - Name of the account, used in the outputs.
+        events - The Event Queue of the account.
+        strategy, portfolio, execution_handler - The instances of the account.
+        """
+        self.index = index
+        self.name = name
+        self.events = events
+        self.strategy = strategy
+        self.portfolio = portfolio
+        self.execution_handler = execution_handler
 
 
 class Backtest(object):
@@ -21,8 +53,10 @@ class Backtest(object):
 
     def __init__(self, data_dir, symbol_list, initial_capital,
                  heartbeat, start_date, end_date, interval,
-                 data_handler, execution_handler, portfolio, strategy
-                 ):
+                 data_handler, execution_handler, portfolio, strategy,
+                 event_bus=False, instrument=False, strategy_params=None,
+                 checkpoint_path=None, checkpoint_bars=None, checkpoint_seconds=None, resume=False,
+                 journal_path=None, replay_journal=None, stop_condition=None):
         """
         Initialises the backtest
 
@@ -37,7 +71,29 @@ class Backtest(object):
         data_handler - (Class) Handles the market data feed.
         execution_handler - (Class) Handles the orders/fills for trades.
         portfolio - (Class) Keeps track of portfolio current and prior positions.
-        strategy - (Class) Generates signals based on market data.
+        strategy - (Class) Generates signals based on market data, or list of classes to run several
+                   strategies on one pass over the data, each with its own portfolio and execution handler.
+        event_bus - If True, events go through a single-threaded EventBus with
+                    table-driven dispatch instead of the thread-safe queue.
+        instrument - If True, the call counts and latencies of each stage of the loop
+                     are recorded, and exported to 'instrumentation.json' with the results.
+        strategy_params - Dictionary of keyword arguments of the strategy (its defaults if None),
+                          or list of dictionaries (or None) for a list of strategies.
+        checkpoint_path - File in which the state of the backtest is saved, every checkpoint_bars
+                          bars and/or checkpoint_seconds seconds, and when the data is exhausted.
+        checkpoint_bars - Number of bars between two checkpoints (None for no limit).
+        checkpoint_seconds - Number of seconds between two checkpoints (None for no limit).
+        resume - If True and the checkpoint file exists, the backtest resumes from it. If the
+                 checkpointed run had finished, it is extended with the bars added since then.
+        journal_path - If given, every Signal, Order and Fill event is appended to this binary
+                       journal of fixed-width records (see EventJournal).
+        replay_journal - If given, the signals recorded in this journal (by a backtest on the same data
+                         and dates) are replayed instead of calling the strategies (see ReplayStrategy),
+                         to re-evaluate the portfolio or execution handler quickly.
+        stop_condition - If given, function of the running statistics of a portfolio (its
+                         performance attribute, see Performance.RunningPerformance) returning True
+                         to stop the backtest early, e.g. MaxDrawdownStop(0.2). With several
+                         strategies, the backtest stops once it is True for all of them.
         """
 
         self.data_dir = data_dir
@@ -52,15 +108,41 @@ class Backtest(object):
         self.execution_handler_cls = execution_handler
         self.portfolio_cls = portfolio
         self.strategy_cls = strategy
+        if isinstance(strategy, (list, tuple)):
+            self.strategy_classes = list(strategy)
+            params = strategy_params if strategy_params is not None else [None] * len(strategy)
+        else:
+            self.strategy_classes = [strategy]
+            params = [strategy_params]
+        if len(params) != len(self.strategy_classes):
+            raise ValueError("One dictionary of parameters is needed for each strategy.")
+        self.strategy_params = [p if p is not None else {} for p in params]
 
-        self.events = queue.Queue()
+        self.use_event_bus = event_bus
+        self.events = EventBus() if event_bus else queue.Queue()
+        self.market_events = 0
         self.signals = 0
         self.orders = 0
         self.fills = 0
-        self.num_strats = 1
+        self.num_strats = len(self.strategy_classes)
+        self.profiler = LoopProfiler() if instrument else None
+
+        self.journal_path = journal_path
+        self.replay_journal = replay_journal
+        self.stop_condition = stop_condition
+        self.stopped_early = False
+        self.resume = resume and checkpoint_path is not None and os.path.exists(checkpoint_path)
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_bars = checkpoint_bars
+        self.checkpoint_seconds = checkpoint_seconds
+        self._last_checkpoint_bar = 0
+        self._last_checkpoint_time = time.time()
 
         self._generate_trading_instances()
 
+        if self.resume:
+            self._restore_checkpoint()
+
     def _generate_trading_instances(self):
         """
         Generates the trading instance objects from
@@ -69,21 +151,221 @@ class Backtest(object):
 
         print("Creating DataHandler, Strategy, Portfolio and ExecutionHandler")
 
-        # Select data handler if from HistoricCSV file or from Yahoo Finance
-        if self.data_handler_cls.__name__ == 'HistoricCSVDataHandler':
-            self.data_handler = self.data_handler_cls(self.events, self.data_dir, self.symbol_list)
-
-        # TODO --> Implement a better selection mode
-        else:
-            self.data_handler = self.data_handler_cls(self.events, self.symbol_list, self.interval,
-                                                      self.start_date, self.end_date)
+        # Each data handler picks the settings it needs (data directory, or dates and interval)
+        self.data_handler = self.data_handler_cls.from_settings(self.events, self.data_dir, self.symbol_list,
+                                                                self.interval, self.start_date, self.end_date)
 
         # similar, here the strategy class could have different type of strategies (vol clustering, intraday, etc)
-        self.strategy = self.strategy_cls(self.data_handler, self.events)
+        # With several strategies, each one trades its own portfolio through its own events queue
+        self.accounts = []
+        names = [cls.__name__ for cls in self.strategy_classes]
+        for i, (strategy_cls, params) in enumerate(zip(self.strategy_classes, self.strategy_params)):
+            if self.num_strats == 1:
+                events = self.events
+            else:
+                events = EventBus() if self.use_event_bus else queue.Queue()
+            name = names[i] if names.count(names[i]) == 1 else "%s_%d" % (names[i], i)
+            if self.replay_journal is not None:
+                strategy = ReplayStrategy(self.data_handler, events, self.replay_journal, account=i)
+            else:
+                strategy = strategy_cls(self.data_handler, events, **params)
+            portfolio = self.portfolio_cls(self.data_handler, events, self.start_date, self.initial_capital)
+            portfolio.performance.periods = periods_per_year(self.interval)
+            if self.num_strats > 1 and hasattr(portfolio, "equity_path"):
+                # Streaming portfolios write their history while running, one output per strategy
+                root, extension = os.path.splitext(portfolio.equity_path)
+                portfolio.equity_path = "%s_%s%s" % (root, name, extension)
+            execution_handler = self.execution_handler_cls(events)
+            self.accounts.append(StrategyAccount(i, name, events, strategy, portfolio, execution_handler))
+
+        self.journal = EventJournal(self.journal_path, self.data_handler, self.symbol_list, append=self.resume) \
+            if self.journal_path is not None else None
+
+        # Components of the first (or only) strategy
+        self.strategy = self.accounts[0].strategy
+        self.portfolio = self.accounts[0].portfolio
+        self.execution_handler = self.accounts[0].execution_handler
+
+        if self.profiler is not None:
+            self._instrument_handlers()
+
+        if self.use_event_bus:
+            self._subscribe_handlers()
+
+        # Let the data handler bound the bars it keeps, if all the lookbacks are known
+        lookbacks = [getattr(component, "max_lookback", None)
+                     for account in self.accounts for component in (account.strategy, account.portfolio)]
+        if None not in lookbacks:
+            self.data_handler.set_max_lookback(max(lookbacks))
+
+    def _instrument_handlers(self):
+        """
+        Replaces the methods called by the loop with their timed version,
+        on the instances only, so nothing changes when not instrumented.
+        """
+        stages = [(self.data_handler, "update_bars")]
+        for account in self.accounts:
+            stages.extend([(account.strategy, "calculate_signals"),
+                           (account.portfolio, "update_timeindex"),
+                           (account.portfolio, "update_signal"),
+                           (account.execution_handler, "execute_order"),
+                           (account.portfolio, "update_fill")])
+        for component, method in stages:
+            setattr(component, method, self.profiler.wrap(method, getattr(component, method)))
+
+    def _subscribe_handlers(self):
+        """
+        Registers the handlers of each event type on the event buses,
+        in the same order as the dispatch of the queue-based loop.
+        The MarketEvents are fanned out to all the strategies.
+        """
+        self.events.subscribe(MarketEvent, self._count_market_event)
+        if self.journal is not None:
+            self.events.subscribe(MarketEvent, self.journal.on_market_event)
+        for account in self.accounts:
+            self.events.subscribe(MarketEvent, account.strategy.calculate_signals)
+            self.events.subscribe(MarketEvent, account.portfolio.update_timeindex)
+        for account in self.accounts:
+            account.events.subscribe(SignalEvent, self._count_signal)
+            account.events.subscribe(SignalEvent, account.portfolio.update_signal)
+            account.events.subscribe(OrderEvent, self._count_order)
+            account.events.subscribe(OrderEvent, account.execution_handler.execute_order)
+            account.events.subscribe(FillEvent, self._count_fill)
+            account.events.subscribe(FillEvent, account.portfolio.update_fill)
+            if self.journal is not None:
+                record = functools.partial(self.journal.record, account=account.index)
+                for event_cls in (SignalEvent, OrderEvent, FillEvent):
+                    account.events.subscribe(event_cls, record)
+
+    def _count_market_event(self, event):
+        self.market_events += 1
+
+    def _count_signal(self, event):
+        self.signals += 1
+
+    def _count_order(self, event):
+        self.orders += 1
+
+    def _count_fill(self, event):
+        self.fills += 1
+
+    def _event_queues(self):
+        """
+        Returns the queue of the data handler, then the ones of
+        the accounts (if the strategies have their own).
+        """
+        return [self.events] + [account.events for account in self.accounts if account.events is not self.events]
+
+    @staticmethod
+    def _drain_events(events):
+        """
+        Returns the events waiting in the queue, leaving them in it.
+        """
+        pending = []
+        while True:
+            try:
+                pending.append(events.get(False))
+            except queue.Empty:
+                break
+        for event in pending:
+            events.put(event)
+        return pending
+
+    def _save_checkpoint(self):
+        """
+        Saves the state of the backtest: the position of the data handler, the
+        portfolio and strategy states, the pending events and the counters.
+        """
+        state = {
+            "data_handler": self.data_handler.get_state(),
+            "portfolios": [account.portfolio.get_state() for account in self.accounts],
+            "strategies": [account.strategy.get_state() for account in self.accounts],
+            "pending_events": [self._drain_events(events) for events in self._event_queues()],
+            "counters": (self.market_events, self.signals, self.orders, self.fills),
+        }
+        save_checkpoint(self.checkpoint_path, state)
+        if self.journal is not None:
+            self.journal.flush()
+        self._last_checkpoint_bar = self.market_events
+        self._last_checkpoint_time = time.time()
 
-        self.portfolio = self.portfolio_cls(self.data_handler, self.events, self.start_date, self.initial_capital)
+    def _restore_checkpoint(self):
+        """
+        Restores the state of the backtest from the checkpoint file. The
+        checkpoint of a finished run holds the final MarketEvent put by the
+        data handler: it is dropped if new bars have been added since then.
+        """
+        state = load_checkpoint(self.checkpoint_path)
+        if len(state["strategies"]) != len(self.accounts):
+            raise ValueError("The checkpoint was saved with %d strategies." % len(state["strategies"]))
+        finished = not state["data_handler"]["continue_backtest"]
+        self.data_handler.set_state(state["data_handler"])
+        for account, portfolio_state, strategy_state in zip(self.accounts, state["portfolios"], state["strategies"]):
+            account.portfolio.set_state(portfolio_state)
+            account.strategy.set_state(strategy_state)
+        self.market_events, self.signals, self.orders, self.fills = state["counters"]
+        self._last_checkpoint_bar = self.market_events
+        if self.journal is not None:
+            # The events journaled after the checkpoint will be replayed
+            self.journal.truncate_after(self.market_events)
+
+        for events, pending_events in zip(self._event_queues(), state["pending_events"]):
+            if finished and self.data_handler.continue_backtest:
+                pending_events = [event for event in pending_events if not isinstance(event, MarketEvent)]
+            for event in pending_events:
+                events.put(event)
+        print("Resumed from the checkpoint after %s bars" % self.market_events)
 
-        self.execution_handler = self.execution_handler_cls(self.events)
+    def _checkpoint_due(self):
+        """
+        Returns True if a checkpoint must be saved, from the number
+        of bars and the time since the previous one.
+        """
+        if self.checkpoint_path is None or not self.data_handler.continue_backtest:
+            # The checkpoint of a finished run is saved by _update_bars
+            return False
+        if self.checkpoint_bars is not None and self.market_events - self._last_checkpoint_bar >= self.checkpoint_bars:
+            return True
+        return self.checkpoint_seconds is not None and time.time() - self._last_checkpoint_time >= self.checkpoint_seconds
+
+    def _stop_condition_met(self):
+        """
+        Checks the early termination rule on the running statistics of the portfolios.
+        """
+        if self.stop_condition is None:
+            return False
+        self.stopped_early = all(self.stop_condition(account.portfolio.performance) for account in self.accounts)
+        return self.stopped_early
+
+    def _update_bars(self):
+        """
+        Updates the market bars, saving a checkpoint once the data is exhausted
+        (to resume or extend the run later), before the final MarketEvent is handled.
+        """
+        self.data_handler.update_bars()
+        if self.checkpoint_path is not None and not self.data_handler.continue_backtest:
+            self._save_checkpoint()
+
+    def _run_event_bus_backtest(self):
+        """
+        Executes the backtest on the event bus: the outer loop updates the
+        market bars, then the bus dispatches the events until it is empty.
+        """
+        data_handler = self.data_handler
+        event_queues = self._event_queues()
+        while True:
+            # The events pending in a checkpoint are handled before the next bar
+            for events in event_queues:
+                events.dispatch()
+            if self._stop_condition_met():
+                break
+            if self._checkpoint_due():
+                self._save_checkpoint()
+            if not data_handler.continue_backtest:
+                break
+            self._update_bars()
+            if self.heartbeat:
+                time.sleep(self.heartbeat)
 
     def _run_backtest(self):
         """
@@ -96,63 +378,126 @@ class Backtest(object):
         After each outer iteration, the system is put to sleep by the heartbeat time. When receiving live datafeed,
         it is important to get the data at a precise time.
         """
+        if self.use_event_bus:
+            self._run_event_bus_backtest()
+        else:
+            self._run_queue_backtest()
+        if self.journal is not None:
+            self.journal.flush()
+
+    def _run_queue_backtest(self):
+        """
+        Executes the backtest on the thread-safe queue.
+        """
 
         i = 0
         while True:
+            # Handle the events (the ones pending in a checkpoint first), the
+            # MarketEvents being fanned out to the accounts of all the strategies
+            self._handle_events(self.events, self.accounts[0])
+            for account in self.accounts:
+                if account.events is not self.events:
+                    self._handle_events(account.events, account)
+
+            if self._stop_condition_met():
+                break
+            if self._checkpoint_due():
+                self._save_checkpoint()
+
             i += 1
             print(i)
             # Update the market bars
             if self.data_handler.continue_backtest:
-                self.data_handler.update_bars()
+                self._update_bars()
             else:
                 break
 
-            # Handle the events
-            while True:
-                try:
-                    event = self.events.get(False)
-                except queue.Empty:
-                    break
-                else:
-                    if event is not None:
+            if self.heartbeat:
+                time.sleep(self.heartbeat)
+
+    def _handle_events(self, events, account):
+        """
+        Handles the events of a queue until it is empty, the signals,
+        orders and fills being handled by the components of the account.
+        """
+        journal = self.journal
+        while True:
+            try:
+                event = events.get(False)
+            except queue.Empty:
+                break
+            else:
+                if event is not None:
+                    if journal is not None:
                         if isinstance(event, MarketEvent):
-                            self.strategy.calculate_signals(event)
-                            self.portfolio.update_timeindex(event)
+                            journal.on_market_event(event)
+                        else:
+                            journal.record(event, account.index)
 
-                        elif isinstance(event, SignalEvent):
-                            self.signals += 1
-                            self.portfolio.update_signal(event)
+                    if isinstance(event, MarketEvent):
+                        self.market_events += 1
+                        for market_account in self.accounts:
+                            market_account.strategy.calculate_signals(event)
+                            market_account.portfolio.update_timeindex(event)
 
-                        elif isinstance(event, OrderEvent):
-                            self.orders += 1
-                            self.execution_handler.execute_order(event)
+                    elif isinstance(event, SignalEvent):
+                        self.signals += 1
+                        account.portfolio.update_signal(event)
 
-                        elif isinstance(event, FillEvent):
-                            self.fills += 1
-                            self.portfolio.update_fill(event)
+                    elif isinstance(event, OrderEvent):
+                        self.orders += 1
+                        account.execution_handler.execute_order(event)
 
-            time.sleep(self.heartbeat)
+                    elif isinstance(event, FillEvent):
+                        self.fills += 1
+                        account.portfolio.update_fill(event)
 
     def _output_performance(self):
         """
-        Outputs the strategy performance from the backtest.
+        Outputs the strategy performance from the backtest (of each strategy, saving their
+        equity curves in 'equity.csv', or 'equity_<strategy name>.csv' for several strategies).
         """
-        self.portfolio.create_equity_curve_dataframe()
+        all_stats = {}
+        for account in self.accounts:
+            account.portfolio.create_equity_curve_dataframe()
 
-        print("Creating summary stats...")
-        stats = self.portfolio.output_summary_stats()
+            print("Creating summary stats%s..." % ("" if self.num_strats == 1 else " of %s" % account.name))
+            equity_path = "equity.csv" if self.num_strats == 1 else "equity_%s.csv" % account.name
+            stats = account.portfolio.output_summary_stats(equity_path, periods_per_year(self.interval))
+            all_stats[account.name] = dict(stats)
 
-        print("Creating equity curve...")
-        print(self.portfolio.equity_curve.tail(10))
+            print("Creating equity curve...")
+            print(account.portfolio.equity_curve.tail(10))
 
-        pprint.pprint(stats)
+            pprint.pprint(stats)
+
+        if self.num_strats > 1:
+            # Comparison of the strategies run on the same data
+            print(pd.DataFrame(all_stats).T)
         print("Signals: %s" % self.signals)
         print("Orders: %s" % self.orders)
         print("Fills: %s" % self.fills)
+        if self.stopped_early:
+            print("Stopped early by the stop condition after %s bars" % self.market_events)
+
+        if self.profiler is not None:
+            n_events = self.market_events + self.signals + self.orders + self.fills
+            report = self.profiler.report(self.market_events, n_events)
+            print("Bars/sec: %.0f, Events/sec: %.0f" % (report["bars_per_sec"], report["events_per_sec"]))
+            for stage, stats in sorted(report["stages"].items()):
+                print("%-18s calls=%-8d total=%.3fs p50=%.1fus p99=%.1fus"
+                      % (stage, stats["calls"], stats["total_time"], stats["p50"] * 1e6, stats["p99"] * 1e6))
+            self.profiler.export_json("instrumentation.json", self.market_events, n_events)
 
     def simulate_trading(self):
         """
         Simulates the backtest and outputs portfolio performance.
         """
+        if self.profiler is not None:
+            self.profiler.start()
         self._run_backtest()
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self.journal is not None:
+            self.journal.close()
         self._output_performance()
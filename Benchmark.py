@@ -0,0 +1,56 @@
+"""
+Benchmark of the backtest loop, comparing the events/sec of the thread-safe
+queue with the ones of the single-threaded EventBus on the DataDir/AAPL.csv run
+"""
+
+from __future__ import print_function
+
+import contextlib
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from BacktesterLoop import Backtest
+from DataHandler import HistoricCSVDataHandler
+from Execution import SimpleSimulatedExecutionHandler
+from Portfolio import Portfolio
+from Strategies.MAC_Strat import MovingAverageCrossOverStrat
+
+
+def run_loop(event_bus, data_dir, symbol_list):
+    """
+    Runs the event loop of one backtest (without the performance output),
+    returning the number of events handled, the elapsed time, and the
+    holdings for the comparison of both loops.
+    """
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        backtest = Backtest(data_dir, symbol_list, 100000.0, 0.0,
+                            datetime(1990, 1, 1), datetime(2021, 1, 1), "1d",
+                            HistoricCSVDataHandler, SimpleSimulatedExecutionHandler,
+                            Portfolio, MovingAverageCrossOverStrat, event_bus=event_bus)
+        start = time.perf_counter()
+        backtest._run_backtest()
+        elapsed = time.perf_counter() - start
+
+    n_events = backtest.market_events + backtest.signals + backtest.orders + backtest.fills
+    return n_events, elapsed, backtest.portfolio.all_holdings
+
+
+if __name__ == "__main__":
+    data_dir = Path(__file__).resolve().parent / 'DataDir'
+    symbol_list = ['AAPL']
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    results = {}
+    for name, event_bus in [("queue.Queue", False), ("EventBus", True)]:
+        # Best of several runs, to limit the noise of the machine
+        runs = [run_loop(event_bus, data_dir, symbol_list) for _ in range(repeats)]
+        n_events, elapsed, holdings = min(runs, key=lambda run: run[1])
+        results[name] = (n_events, elapsed, holdings)
+        print("%-12s %6d events in %.3fs --> %10.0f events/sec" % (name, n_events, elapsed, n_events / elapsed))
+
+    queue_run, bus_run = results["queue.Queue"], results["EventBus"]
+    print("Speed-up: %.2fx" % (queue_run[1] / bus_run[1]))
+    print("Same holdings: %s" % (queue_run[2] == bus_run[2]))
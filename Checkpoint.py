@@ -0,0 +1,38 @@
+from __future__ import print_function
+
+import os
+import pickle
+import zlib
+
+# Version of the checkpoint format, checked when resuming
+CHECKPOINT_VERSION = 2
+
+
+def save_checkpoint(path, state):
+    """
+    Writes the state of a backtest in a compact binary file (compressed
+    pickle). The file is written next to the previous checkpoint then
+    renamed, so a crash while saving never leaves a truncated checkpoint.
+
+    Parameters:
+    path - Path of the checkpoint file.
+    state - Dictionary of the state of the backtest components.
+    """
+    payload = zlib.compress(pickle.dumps(dict(state, version=CHECKPOINT_VERSION), pickle.HIGHEST_PROTOCOL), 1)
+    temporary_path = "%s.tmp" % path
+    with open(temporary_path, "wb") as checkpoint_file:
+        checkpoint_file.write(payload)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(temporary_path, path)
+
+
+def load_checkpoint(path):
+    """
+    Reads the state of a backtest saved by save_checkpoint.
+    """
+    with open(path, "rb") as checkpoint_file:
+        state = pickle.loads(zlib.decompress(checkpoint_file.read()))
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError("The checkpoint %s was written by another version of the backtester." % path)
+    return state
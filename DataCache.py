@@ -0,0 +1,367 @@
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 2
+CACHE_SUFFIX = ".cache"
+META_FILE = "meta.json"
+
+
+def _cache_dir_for(csv_path):
+    """
+    Returns the directory holding the binary cache of a CSV file,
+    placed next to the source file ('AAPL.csv' --> 'AAPL.csv.cache').
+    """
+    return str(csv_path) + CACHE_SUFFIX
+
+
+def _source_signature(csv_path):
+    """
+    Returns the size and modification time of the source file,
+    used to invalidate the cache when the CSV file is changed.
+    """
+    stat = os.stat(csv_path)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def _read_valid_meta(cache_dir, csv_path, names, dayfirst):
+    """
+    Returns the metadata of the cache if it exists and is still
+    valid for the source file and the requested columns, None otherwise.
+    """
+    try:
+        with open(os.path.join(cache_dir, META_FILE)) as meta_file:
+            meta = json.load(meta_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+    signature = _source_signature(csv_path)
+    if meta.get("version") != CACHE_VERSION or meta.get("names") != list(names) \
+            or meta.get("dayfirst") != dayfirst:
+        return None
+    if any(meta.get(key) != value for key, value in signature.items()):
+        return None
+    return meta
+
+
+def _write_cache(cache_dir, csv_path, names, dayfirst, index, columns):
+    """
+    Writes one .npy file per column (and one for the index) in a temporary
+    directory, then moves it to its final location so that concurrent
+    backtests never see a partially written cache.
+    """
+    parent = os.path.dirname(os.path.abspath(cache_dir))
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp_", dir=parent)
+    try:
+        np.save(os.path.join(tmp_dir, "%s.npy" % names[0]), index)
+        for name in names[1:]:
+            np.save(os.path.join(tmp_dir, "%s.npy" % name), columns[name])
+
+        meta = {"version": CACHE_VERSION, "names": list(names), "dayfirst": dayfirst}
+        meta.update(_source_signature(csv_path))
+        with open(os.path.join(tmp_dir, META_FILE), "w") as meta_file:
+            json.dump(meta, meta_file)
+
+        if os.path.isdir(cache_dir):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        os.rename(tmp_dir, cache_dir)
+    except OSError:
+        # Another process may have created the cache in the meantime,
+        # or the data directory is read-only: the parsed data is still usable
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def read_csv_columns(csv_path, names, use_cache=True, dayfirst=True):
+    """
+    Reads a CSV file of bars into a datetime index and a dictionary of NumPy
+    column arrays. The first time a file is read, the parsed columns (and
+    dates) are saved as .npy files next to it. Later calls open these files
+    memory-mapped, as long as the size and modification time of the CSV file
+    are unchanged.
+
+    Parameters:
+    csv_path - Path to the CSV file.
+    names - Names of the columns, the first one being used as index.
+    use_cache - Whether to read and write the binary cache.
+    dayfirst - Whether the dates are in the dd/mm/yyyy format.
+
+    Returns:
+    index, columns - DatetimeIndex of the bars and dictionary of column arrays.
+    """
+    cache_dir = _cache_dir_for(csv_path)
+
+    if use_cache and _read_valid_meta(cache_dir, csv_path, names, dayfirst) is not None:
+        try:
+            index = np.load(os.path.join(cache_dir, "%s.npy" % names[0]), mmap_mode="r")
+            columns = {name: np.load(os.path.join(cache_dir, "%s.npy" % name), mmap_mode="r")
+                       for name in names[1:]}
+        except (IOError, OSError, ValueError):
+            pass
+        else:
+            return pd.DatetimeIndex(index, name=names[0]), columns
+
+    frame = pd.io.parsers.read_csv(csv_path, header=0, index_col=0, names=names)
+    index = pd.DatetimeIndex(pd.to_datetime(frame.index, dayfirst=dayfirst), name=names[0])
+    columns = {name: np.ascontiguousarray(frame[name].values, dtype=np.float64) for name in names[1:]}
+
+    if use_cache:
+        _write_cache(cache_dir, csv_path, names, dayfirst, index.values, columns)
+    return index, columns
+
+
+def yahoo_fetcher(symbols, start_date, end_date, interval):
+    """
+    Default fetcher of the YahooDownloader, getting all the symbols
+    in one batched (and internally multi-threaded) yfinance request.
+
+    Parameters:
+    symbols - A list of symbol strings.
+    start_date - starting date for the historical data (format: datetime)
+    end_date - final date of the data (format: datetime)
+    interval - 1d, 1wk, 1mo - daily, weekly monthly data
+
+    Returns:
+    A dictionary of DataFrames, in the yfinance format, keyed by symbol.
+    """
+    # Imported here so that the CSV or cache-only runs do not need yfinance
+    import yfinance as yf
+
+    data = yf.download(tickers=list(symbols), start=start_date, end=end_date, interval=interval,
+                       group_by="ticker", auto_adjust=False, threads=True)
+
+    frames = {}
+    for symbol in symbols:
+        if isinstance(data.columns, pd.MultiIndex):
+            if symbol not in data.columns.get_level_values(0):
+                continue
+            frame = data[symbol]
+        else:
+            frame = data
+        frames[symbol] = frame.dropna(how="all")
+    return frames
+
+
+def _parse_bound(date):
+    """
+    Returns a bound of a cached range as a Timestamp, None if unbounded.
+    """
+    if date is None or str(date) == "None":
+        return None
+    return pd.Timestamp(str(date))
+
+
+def _range_covers(cached_start, cached_end, start_date, end_date):
+    """
+    Returns True if the cached [start, end) range contains the requested one.
+    """
+    cached_start, cached_end = _parse_bound(cached_start), _parse_bound(cached_end)
+    start_date, end_date = _parse_bound(start_date), _parse_bound(end_date)
+    if cached_start is not None and (start_date is None or start_date < cached_start):
+        return False
+    if cached_end is not None and (end_date is None or end_date > cached_end):
+        return False
+    return True
+
+
+def _slice_frame(frame, start_date, end_date):
+    """
+    Returns the rows of a frame in the [start_date, end_date) range,
+    which is the range returned by yfinance for these dates.
+    """
+    index = pd.DatetimeIndex(frame.index)
+    selected = np.ones(len(index), dtype=bool)
+    for date, side in ((start_date, "start"), (end_date, "end")):
+        date = _parse_bound(date)
+        if date is None:
+            continue
+        if index.tz is not None and date.tzinfo is None:
+            date = date.tz_localize(index.tz)
+        selected &= (index >= date) if side == "start" else (index < date)
+    return frame[selected]
+
+
+class YahooDownloader(object):
+    """
+    Download layer for the Yahoo Finance data, shared by the YahooDataHandler
+    and the strategy helpers (such as create_lagged_series). The symbols missing
+    from the cache are fetched in a single batched request, and each series is
+    stored in a local content-addressed cache keyed by (symbol, interval, start,
+    end), so that later calls, or later runs, do not hit the network again.
+    The ranges cached for each (symbol, interval) are listed in an index, so a
+    request for a sub-range of a cached series is sliced from it.
+    """
+
+    def __init__(self, cache_dir=None, fetcher=yahoo_fetcher, offline=False):
+        """
+        Initialises the downloader.
+
+        Parameters:
+        cache_dir - Directory of the cache files (defaults to ~/.cache/backtester/yahoo),
+                    an empty string keeps the cache in memory only.
+        fetcher - Function (symbols, start_date, end_date, interval) --> {symbol: DataFrame},
+                  can be replaced by a local stand-in instead of the network.
+        offline - If True, only the cache is used and missing series raise a KeyError.
+        """
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "backtester", "yahoo")
+        self.cache_dir = cache_dir
+        self.fetcher = fetcher
+        self.offline = offline
+        self._memory_cache = {}
+        self._memory_ranges = {}
+
+    @staticmethod
+    def _cache_key(symbol, start_date, end_date, interval):
+        """
+        Returns the content address of a (symbol, interval, start, end) series.
+        """
+        key = "|".join(str(part) for part in (symbol, interval, start_date, end_date))
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _ranges_key(symbol, interval):
+        """
+        Returns the address of the index of the ranges cached for a (symbol, interval).
+        """
+        key = "|".join(str(part) for part in (symbol, interval))
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _cache_path(self, key, extension="pkl"):
+        return os.path.join(self.cache_dir, key[:2], "%s.%s" % (key, extension))
+
+    def _read_cache(self, key):
+        """
+        Returns the cached DataFrame of a key, or None if not cached yet.
+        """
+        if key in self._memory_cache:
+            return self._memory_cache[key]
+        if not self.cache_dir:
+            return None
+        try:
+            frame = pd.read_pickle(self._cache_path(key))
+        except (IOError, OSError, ValueError, EOFError):
+            return None
+        self._memory_cache[key] = frame
+        return frame
+
+    def _write_file(self, path, write):
+        """
+        Writes a cache file next to its final path, then renames it.
+        """
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            tmp_path = "%s.%d.tmp" % (path, os.getpid())
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print("Could not write the Yahoo cache file %s: %s" % (path, e))
+
+    def _write_cache(self, key, frame):
+        self._memory_cache[key] = frame
+        if self.cache_dir:
+            self._write_file(self._cache_path(key), frame.to_pickle)
+
+    def _read_ranges(self, symbol, interval):
+        """
+        Returns the list of the (start, end) ranges cached for a (symbol, interval).
+        """
+        key = self._ranges_key(symbol, interval)
+        if key not in self._memory_ranges:
+            ranges = []
+            if self.cache_dir:
+                try:
+                    with open(self._cache_path(key, "json")) as ranges_file:
+                        ranges = [tuple(bounds) for bounds in json.load(ranges_file)]
+                except (IOError, OSError, ValueError):
+                    pass
+            self._memory_ranges[key] = ranges
+        return self._memory_ranges[key]
+
+    def _add_range(self, symbol, start_date, end_date, interval):
+        """
+        Adds a range to the index of the ranges cached for a (symbol, interval).
+        """
+        ranges = self._read_ranges(symbol, interval)
+        bounds = (str(start_date), str(end_date))
+        if bounds in ranges:
+            return
+        ranges.append(bounds)
+        if self.cache_dir:
+            def write(path):
+                with open(path, "w") as ranges_file:
+                    json.dump(ranges, ranges_file)
+            self._write_file(self._cache_path(self._ranges_key(symbol, interval), "json"), write)
+
+    def _read_covering(self, symbol, start_date, end_date, interval):
+        """
+        Returns the cached DataFrame of the range, sliced from any cached series
+        of the (symbol, interval) containing it, or None if there is none.
+        """
+        frame = self._read_cache(self._cache_key(symbol, start_date, end_date, interval))
+        if frame is not None:
+            return frame
+        for cached_start, cached_end in self._read_ranges(symbol, interval):
+            if _range_covers(cached_start, cached_end, start_date, end_date):
+                frame = self._read_cache(self._cache_key(symbol, cached_start, cached_end, interval))
+                if frame is not None:
+                    return _slice_frame(frame, start_date, end_date)
+        return None
+
+    def download(self, symbols, start_date, end_date, interval):
+        """
+        Returns the historical data of the symbols, fetching the
+        ones missing from the cache in a single request.
+
+        Parameters:
+        symbols - A list of symbol strings.
+        start_date - starting date for the historical data (format: datetime)
+        end_date - final date of the data (format: datetime)
+        interval - 1d, 1wk, 1mo - daily, weekly monthly data
+
+        Returns:
+        A dictionary of DataFrames (copies, in the yfinance format) keyed by symbol.
+        """
+        frames = {}
+        missing = []
+        for symbol in symbols:
+            frame = self._read_covering(symbol, start_date, end_date, interval)
+            if frame is None:
+                missing.append(symbol)
+            else:
+                frames[symbol] = frame
+
+        if missing:
+            if self.offline:
+                raise KeyError("Symbols not available in the offline cache: %s" % ", ".join(missing))
+            fetched = self.fetcher(missing, start_date, end_date, interval)
+            for symbol in missing:
+                frame = fetched.get(symbol)
+                if frame is None or frame.empty:
+                    raise KeyError("No data could be downloaded for the symbol %s" % symbol)
+                self._write_cache(self._cache_key(symbol, start_date, end_date, interval), frame)
+                self._add_range(symbol, start_date, end_date, interval)
+                frames[symbol] = frame
+
+        return {symbol: frames[symbol].copy() for symbol in symbols}
+
+
+_default_downloader = None
+
+
+def get_default_downloader():
+    """
+    Returns the downloader shared by default between the
+    data handler and the strategy helpers of a process.
+    """
+    global _default_downloader
+    if _default_downloader is None:
+        _default_downloader = YahooDownloader()
+    return _default_downloader
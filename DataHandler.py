@@ -1,12 +1,18 @@
 from __future__ import print_function
 
+import asyncio
+import copy
+import heapq
+import json
 import numpy as np
 import os
 import pandas as pd
-import yfinance as yf
+import sqlite3
 
 from abc import ABCMeta, abstractmethod
-from Events import MarketEvent
+from collections import deque
+from DataCache import get_default_downloader, read_csv_columns
+from Events import MARKET_EVENT
 
 
 class DataManagement(object):
@@ -47,10 +53,12 @@ class DataManagement(object):
         raise NotImplementedError("Should implement get_latest_bar_value()")
 
     @abstractmethod
-    def get_latest_bars_values(self, symbol, val_type, N=1):
+    def get_latest_bars_values(self, symbol, val_type, N=1, resolution=None):
         """
         Returns the last N bar values from the
         latest_symbol list, or N-k if less available.
+        The values can be resampled to a lower resolution
+        (1wk, 1mo, etc.) than the one of the data.
         """
         raise NotImplementedError("Should implement get_latest_bars_values()")
 
@@ -63,168 +71,519 @@ class DataManagement(object):
         """
         raise NotImplementedError("Should implement update_bars()")
 
+    def get_latest_cross_section(self, value_type):
+        """
+        Returns the latest value of a field (Open, High, Low, Close, Volume
+        or OI) for all the symbols, as an array in the order of the symbol list.
+        The handlers storing the symbols side by side override it with a
+        single array lookup.
+        """
+        return np.array([self.get_latest_bar_value(symbol, value_type) for symbol in self.symbol_list],
+                        dtype=np.float64)
 
-class YahooDataHandler(DataManagement):
-    """
-    Get data directly from Yahoo Finance website, and provide an interface
-    to obtain the "latest" bar in a manner identical to a live
-    trading interface.
-    """
-
-    def __init__(self, events, symbol_list, interval, start_date, end_date):
+    def get_latest_cross_sections(self, value_type, N=1):
         """
-        Initialize Queries from yahoo finance api to
-        receive historical data transformed to dataframe
+        Returns the last N values of a field for all the symbols, as an
+        (N, symbols) array (or N-k rows if less available). The symbols
+        with a shorter history are padded with NaN at the top.
+        """
+        histories = [self.get_latest_bars_values(symbol, value_type, N) for symbol in self.symbol_list]
+        n_rows = max([len(history) for history in histories] + [0])
+        cross_sections = np.full((n_rows, len(self.symbol_list)), np.nan)
+        for j, history in enumerate(histories):
+            cross_sections[n_rows - len(history):, j] = history
+        return cross_sections
 
-        Parameters:
-        events - The Event Queue.
-        symbol_list - A list of symbol strings.
-        interval - 1d, 1wk, 1mo - daily, weekly monthly data
-        start_date - starting date for the historical data (format: datetime)
-        end_date - final date of the data (format: datetime)
+    def is_latest_bar_stale(self, symbol):
+        """
+        Returns True if the symbol had no new bar at the latest
+        datetime, its values being padded from a previous bar.
+        """
+        raise NotImplementedError("Should implement is_latest_bar_stale()")
 
+    def set_max_lookback(self, N):
+        """
+        Gives the largest number of bars that will be requested by the
+        strategies and the portfolio. The handlers keeping the whole
+        history ignore it, the others can bound their memory with it.
         """
+        pass
 
-        self.events = events
-        self.symbol_list = symbol_list
-        self.interval = interval
-        self.start_date = start_date
-        self.end_date = end_date
-        self.symbol_data = {}
-        self.latest_symbol_data = {}
-        self.continue_backtest = True
-        self._load_data_from_Yahoo_finance()
+    def get_state(self):
+        """
+        Returns the position of the handler in the data (and the latest
+        bars it keeps), to be saved in a checkpoint of the backtest.
+        """
+        raise NotImplementedError("Should implement get_state()")
 
-    def _load_data_from_Yahoo_finance(self):
+    def set_state(self, state):
         """
-        Queries yfinance api to receive historical data in csv file format
+        Moves the handler to the position saved in a checkpoint, so the
+        next update releases the bars following the ones already processed.
+        New bars appended to the data source since the checkpoint are
+        released, to extend a finished backtest.
         """
+        raise NotImplementedError("Should implement set_state()")
 
-        combined_index = None
-        for symbol in self.symbol_list:
+    @classmethod
+    def from_settings(cls, events, data_dir, symbol_list, interval, start_date, end_date):
+        """
+        Creates the data handler from the settings of a Backtest. By default
+        the handler is built like the YahooDataHandler, the handlers reading
+        from a directory or a database override this method.
+        """
+        return cls(events, symbol_list, interval, start_date, end_date)
 
-            # download data from yfinance for symbol. This could be improved as yfinance can download several
-            # symbols at the same time
-            self.symbol_data[symbol] = yf.download(tickers=[symbol], start=self.start_date,
-                                                   end=self.end_date, interval=self.interval)
 
-            # rename columns for consistency
-            self.symbol_data[symbol].rename(columns={'Open': 'open',
-                                                     'High': 'high',
-                                                     'Low': 'low',
-                                                     'Close': 'close',
-                                                     'Adj Close': 'adj_close',
-                                                     'Volume': 'volume'}, inplace=True)
+def align_symbol_data(symbol_data, symbol_list):
+    """
+    Aligns the bars of all symbols on a master timeline, built once as the
+    sorted union of their indexes. Every field is then forward-filled for all
+    symbols in one vectorized gather into a 2D (time x symbol) array. The arrays
+    are column-major, so that the history of one symbol stays contiguous.
+
+    Parameters:
+    symbol_data - Dictionary of DataFrames or (index, column arrays) pairs keyed by symbol.
+    symbol_list - A list of symbol strings, giving the order of the columns.
+
+    Returns:
+    timeline, fields, padded - The master index, a dictionary of the 2D arrays keyed by
+    field, and a 2D boolean array set to True where a symbol has no new bar (the value is
+    padded from its previous bar, or NaN if the symbol has not started yet).
+    """
+    indexes = []
+    columns = []
+    for symbol in symbol_list:
+        data = symbol_data[symbol]
+        if isinstance(data, pd.DataFrame):
+            index, symbol_columns = data.index, {column: data[column].values for column in data.columns}
+        else:
+            index, symbol_columns = data
+        index = pd.Index(index)
+        if not index.is_monotonic_increasing:
+            order = np.argsort(index.values, kind="stable")
+            index = index[order]
+            symbol_columns = {column: np.asarray(values)[order] for column, values in symbol_columns.items()}
+        indexes.append(index)
+        columns.append(symbol_columns)
+
+    timeline = indexes[0]
+    for index in indexes[1:]:
+        timeline = timeline.union(index)
+    if not timeline.is_unique:
+        timeline = timeline.drop_duplicates(keep="last")
+    field_names = list(columns[0])
+
+    # A single symbol already on the timeline is used as it is (no copy)
+    if len(symbol_list) == 1 and len(indexes[0]) == len(timeline):
+        fields = {field: np.asarray(columns[0][field], dtype=np.float64).reshape(-1, 1) for field in field_names}
+        return timeline, fields, np.zeros((len(timeline), 1), dtype=bool)
+
+    # Position of the last bar of each symbol at or before each time of the timeline,
+    # in the concatenation of all the symbol columns (the last element being a NaN)
+    n_total = sum(len(index) for index in indexes)
+    positions = np.empty((len(timeline), len(symbol_list)), dtype=np.int64, order="F")
+    padded = np.empty((len(timeline), len(symbol_list)), dtype=bool, order="F")
+    offset = 0
+    for j, index in enumerate(indexes):
+        last = index.searchsorted(timeline, side="right") - 1
+        started = last >= 0
+        padded[:, j] = ~started | (index.values[np.maximum(last, 0)] != timeline.values)
+        positions[:, j] = np.where(started, last + offset, n_total)
+        offset += len(index)
+
+    fields = {}
+    for field in field_names:
+        flat = np.concatenate([np.asarray(symbol_columns[field], dtype=np.float64) for symbol_columns in columns]
+                              + [np.array([np.nan])])
+        fields[field] = flat[positions]
+    return timeline, fields, padded
+
+
+# Resolutions given in the Yahoo Finance interval format, with the pandas frequency
+# used to group the base bars: calendar periods, or fixed durations (floor)
+CALENDAR_RESOLUTIONS = {"1wk": "W", "1mo": "M", "3mo": "Q", "1y": "Y"}
+FIXED_RESOLUTIONS = {"1m": "1min", "2m": "2min", "5m": "5min", "15m": "15min", "30m": "30min",
+                     "60m": "60min", "90m": "90min", "1h": "1H", "1d": "1D"}
+
+
+class ResampledView(object):
+    """
+    Lower resolution view (weekly, monthly bars, etc.) of the bars of a
+    ColumnarDataHandler, built lazily from the base resolution. The groups of
+    base bars are located once over the whole timeline, and the aggregates of
+    the completed groups are computed with vectorized reductions (reduceat) as
+    the cursor moves forward, so each group is only aggregated once. The last
+    bar of the view is the group in progress, made of the base bars released so far.
+    """
 
-            # rename index as well from 'Date' to 'datetime'
-            self.symbol_data[symbol].index.name = 'datetime'
+    def __init__(self, handler, resolution):
+        """
+        Parameters:
+        handler - The ColumnarDataHandler holding the base bars.
+        resolution - 1wk, 1mo, 1h, etc. (or any pandas frequency).
+        """
+        self.handler = handler
+        self.resolution = resolution
 
-            # create returns column (used for some strategies)
-            self.symbol_data[symbol]['returns'] = self.symbol_data[symbol]["adj_close"].pct_change() * 100.0
+        timeline = pd.DatetimeIndex(handler.bar_datetimes)
+        if resolution in CALENDAR_RESOLUTIONS:
+            groups = timeline.to_period(CALENDAR_RESOLUTIONS[resolution]).asi8
+        else:
+            groups = timeline.floor(FIXED_RESOLUTIONS.get(resolution, resolution)).asi8
+
+        # First and last (excluded) rows of each group of base bars
+        self.starts = np.concatenate([[0], np.flatnonzero(groups[1:] != groups[:-1]) + 1])
+        self.ends = np.concatenate([self.starts[1:], [len(groups)]])
+
+        self.fields = {}
+        self.n_completed = {}
+
+    def _aggregate(self, field, start, stop, offsets):
+        """
+        Aggregates the base rows [start, stop) of a field for all the symbols,
+        the groups beginning at the given offsets from start.
+        """
+        values = self.handler.bar_fields[field][start:stop]
+        # The padded bars repeat the previous bar of the symbol, they are not part of the group
+        fresh = ~self.handler.bar_padded[start:stop]
+        if field == "open":
+            # First fresh bar of each group (the NaN row after the values if there is none)
+            rows = np.where(fresh, np.arange(stop - start)[:, None], stop - start)
+            first = np.minimum.reduceat(rows, offsets, axis=0)
+            values = np.vstack([values, np.full((1, values.shape[1]), np.nan)])
+            return np.take_along_axis(values, first, axis=0)
+        if field == "high":
+            return np.fmax.reduceat(np.where(fresh, values, np.nan), offsets, axis=0)
+        if field == "low":
+            return np.fmin.reduceat(np.where(fresh, values, np.nan), offsets, axis=0)
+
+        # The padded volume and return must not be counted twice
+        if field == "volume":
+            return np.add.reduceat(np.where(fresh, values, 0.0), offsets, axis=0)
+        if field == "returns":
+            growth = np.multiply.reduceat(np.where(fresh, 1.0 + values / 100.0, 1.0), offsets, axis=0)
+            return (growth - 1.0) * 100.0
+        # close, adj_close and other values: last value of the group
+        return values[np.append(offsets[1:], stop - start) - 1]
+
+    def _update_completed(self, field, n_completed):
+        """
+        Aggregates the groups completed since the last call for a field.
+        """
+        if field not in self.fields:
+            self.fields[field] = np.full((len(self.starts), len(self.handler.symbol_list)), np.nan, order="F")
+            self.n_completed[field] = 0
+        done = self.n_completed[field]
+        if n_completed > done:
+            start, stop = self.starts[done], self.ends[n_completed - 1]
+            self.fields[field][done:n_completed] = self._aggregate(field, start, stop,
+                                                                   self.starts[done:n_completed] - start)
+            self.n_completed[field] = n_completed
+
+    def get_latest_values(self, field, j, N):
+        """
+        Returns the last N values of a field for the symbol of column j,
+        the last one being the group in progress.
+        """
+        cursor = self.handler.bar_cursor
+        if cursor == 0:
+            return np.empty(0)
+
+        current = np.searchsorted(self.starts, cursor - 1, side="right") - 1
+        in_progress = self.ends[current] > cursor
+        self._update_completed(field, current if in_progress else current + 1)
+
+        if not in_progress:
+            return self.fields[field][max(0, current + 1 - N):current + 1, j]
+        start = self.starts[current]
+        partial = self._aggregate(field, start, cursor, np.array([0]))[0, j]
+        completed = self.fields[field][max(0, current - N + 1):current, j]
+        return np.append(completed, partial)[-N:]
+
+
+class ColumnarDataHandler(DataManagement):
+    """
+    ColumnarDataHandler is the common base of the handlers for which the whole
+    history is known before the backtest starts (CSV files, Yahoo Finance, etc.).
+    The bars of all symbols are aligned on a master timeline into 2D (time x symbol)
+    NumPy arrays, one per field, with an integer cursor giving the number of bars
+    already released to the system. Updating the bars only advances the cursor, and
+    the latest N values of a field are returned as a zero-copy slice of its column.
+    """
 
-            # Combine the index to pad forward values
-            if combined_index is None:
-                combined_index = self.symbol_data[symbol].index
-            else:
-                combined_index.union(self.symbol_data[symbol].index)
+    def _create_bar_store(self):
+        """
+        Aligns the symbol data (DataFrames or (index, column arrays) pairs)
+        into the 2D arrays of the bar store, and resets the cursor.
+        """
+        timeline, self.bar_fields, self.bar_padded = align_symbol_data(self.symbol_data, self.symbol_list)
+        self.bar_datetimes = list(timeline)
+        self.symbol_positions = {symbol: j for j, symbol in enumerate(self.symbol_list)}
+        self.bar_columns = {
+            symbol: {field: values[:, j] for field, values in self.bar_fields.items()}
+            for j, symbol in enumerate(self.symbol_list)
+        }
+        # The symbol data is not needed anymore once aligned
+        self.symbol_data = {symbol: None for symbol in self.symbol_list}
+        self.bar_cursor = 0
+        self.resampled_views = {}
 
-            # Set the latest symbol_data to None
-            self.latest_symbol_data[symbol] = []
+    def _get_columns(self, symbol):
+        """
+        Returns the dictionary of column arrays for a symbol.
+        """
+        try:
+            return self.bar_columns[symbol]
+        except KeyError:
+            print("That symbol is not available in the historical data set.")
+            raise
 
-        # Reindex the dataframes
-        for symbol in self.symbol_list:
-            self.symbol_data[symbol] = self.symbol_data[symbol].reindex(index=combined_index, method="pad").iterrows()
+    def _check_bars_available(self):
+        """
+        Makes sure at least one bar has been released, as the column
+        arrays already contain the "future" bars.
+        """
+        if self.bar_cursor == 0:
+            raise IndexError("No bar has been updated yet.")
 
-    def _get_new_bar(self, symbol):
+    def _make_bar(self, columns, i):
         """
-        Returns the latest bar from the data feed as a tuple of
-        (symbol, datetime, open, low, high, close, volume, adj_close, etc).
+        Builds a (datetime, pandas Series) bar, similar to the rows
+        given by DataFrame.iterrows(), from the position i.
         """
-        for bar in self.symbol_data[symbol]:
-            yield bar
+        dt = self.bar_datetimes[i]
+        values = {column: array[i] for column, array in columns.items()}
+        return dt, pd.Series(values, name=dt)
 
     def get_latest_bar(self, symbol):
         """
         Returns the last bar from the latest_symbol list.
         """
-
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
-        else:
-            return bars_list[-1]
+        columns = self._get_columns(symbol)
+        self._check_bars_available()
+        return self._make_bar(columns, self.bar_cursor - 1)
 
     def get_latest_bars(self, symbol, N=1):
         """
         Returns the last N bars from the latest_symbol list,
         or N-k if less available.
         """
-
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
-        else:
-            return bars_list[-N:]
+        columns = self._get_columns(symbol)
+        return [self._make_bar(columns, i) for i in range(max(0, self.bar_cursor - N), self.bar_cursor)]
 
     def get_latest_bar_datetime(self, symbol):
         """
         Returns a Python datetime object for the last bar.
         """
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
-        else:
-            return bars_list[-1][0]
+        self._get_columns(symbol)
+        self._check_bars_available()
+        return self.bar_datetimes[self.bar_cursor - 1]
 
     def get_latest_bar_value(self, symbol, value_type):
         """
         Returns one of the Open, High, Low, Close, Volume or OI
-        values from the pandas Bar series object.
+        values from the column arrays.
         """
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
-        else:
-            return getattr(bars_list[-1][1], value_type)
+        columns = self._get_columns(symbol)
+        self._check_bars_available()
+        return columns[value_type][self.bar_cursor - 1]
 
-    def get_latest_bars_values(self, symbol, value_type, N=1):
+    def get_latest_bars_values(self, symbol, value_type, N=1, resolution=None):
         """
         Returns the last N bar values from the
         latest_symbol list, or N-k if less available.
+        The array returned is a read-only view on the column.
+        If a resolution is given (1wk, 1mo, etc.), the values are
+        the ones of the bars resampled to that resolution.
         """
-        try:
-            bars_list = self.get_latest_bars(symbol, N)  # bars_list = bars_list[-N:]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
-        else:
-            return np.array([getattr(bar[1], value_type) for bar in bars_list])
+        columns = self._get_columns(symbol)
+        if resolution is not None and resolution != getattr(self, "interval", None):
+            if resolution not in self.resampled_views:
+                self.resampled_views[resolution] = ResampledView(self, resolution)
+            view = self.resampled_views[resolution]
+            return view.get_latest_values(value_type, self.symbol_positions[symbol], N)
+
+        values = columns[value_type][max(0, self.bar_cursor - N):self.bar_cursor]
+        values.flags.writeable = False
+        return values
+
+    def get_history_values(self, value_type):
+        """
+        Returns the whole history of a field as a read-only (time x symbol)
+        array, including the bars not released yet. It is meant for the
+        vectorized research tools, not for the event-driven strategies.
+        """
+        values = self.bar_fields[value_type][:]
+        values.flags.writeable = False
+        return values
+
+    def get_latest_cross_section(self, value_type):
+        """
+        Returns the latest value of a field for all the symbols,
+        as a read-only view on the row of the (time x symbol) array.
+        """
+        self._check_bars_available()
+        values = self.bar_fields[value_type][self.bar_cursor - 1]
+        values.flags.writeable = False
+        return values
+
+    def get_latest_cross_sections(self, value_type, N=1):
+        """
+        Returns the last N values of a field for all the symbols, as a
+        read-only (N, symbols) view (or N-k rows if less available).
+        """
+        values = self.bar_fields[value_type][max(0, self.bar_cursor - N):self.bar_cursor]
+        values.flags.writeable = False
+        return values
+
+    def is_latest_bar_stale(self, symbol):
+        """
+        Returns True if the symbol had no new bar at the latest
+        datetime (its values are padded from a previous bar).
+        """
+        self._get_columns(symbol)
+        self._check_bars_available()
+        return self.bar_padded[self.bar_cursor - 1, self.symbol_positions[symbol]]
+
+    @staticmethod
+    def _bar_position(timeline, date):
+        """
+        Returns the position of the first bar of the timeline from the date.
+        """
+        date = pd.Timestamp(date)
+        if timeline.tz is not None and date.tzinfo is None:
+            date = date.tz_localize(timeline.tz)
+        return timeline.searchsorted(date)
+
+    def get_state(self):
+        """
+        Returns the cursor position, as the datetime of the latest bar released.
+        """
+        return {"latest_datetime": self.bar_datetimes[self.bar_cursor - 1] if self.bar_cursor else None,
+                "continue_backtest": self.continue_backtest}
+
+    def set_state(self, state):
+        """
+        Moves the cursor after the latest bar of the checkpoint, which is looked
+        up by datetime, as the data may have been extended since then.
+        """
+        cursor = 0
+        if state["latest_datetime"] is not None:
+            position = self._bar_position(pd.DatetimeIndex(self.bar_datetimes), state["latest_datetime"])
+            if position == len(self.bar_datetimes) or self.bar_datetimes[position] != state["latest_datetime"]:
+                raise ValueError("The latest bar of the checkpoint (%s) is not in the data." % state["latest_datetime"])
+            cursor = position + 1
+        self.bar_cursor = cursor
+        self.continue_backtest = state["continue_backtest"] or cursor < len(self.bar_datetimes)
+        self.resampled_views = {}
+
+    def copy_for_events(self, events, start_date=None, end_date=None):
+        """
+        Returns a handler releasing the same bars from the start on another
+        events queue. The bar arrays are shared, not copied, so that several
+        backtests (e.g. a parameter sweep) run on data loaded only once.
+
+        Parameters:
+        events - The Event Queue object of the new handler.
+        start_date - If given, the first bar released is the first one from this date.
+                     The previous bars are already available, e.g. to warm up the strategies.
+        end_date - If given, the bars from this date (excluded) are removed.
+        """
+        handler = copy.copy(self)
+        handler.events = events
+        handler.continue_backtest = True
+        handler.resampled_views = {}
+
+        timeline = pd.DatetimeIndex(self.bar_datetimes)
+        start = self._bar_position(timeline, start_date) if start_date is not None else 0
+        stop = self._bar_position(timeline, end_date) if end_date is not None else len(timeline)
+        if stop < len(timeline):
+            handler.bar_fields = {field: values[:stop] for field, values in self.bar_fields.items()}
+            handler.bar_padded = self.bar_padded[:stop]
+            handler.bar_datetimes = self.bar_datetimes[:stop]
+            handler.bar_columns = {
+                symbol: {field: values[:, j] for field, values in handler.bar_fields.items()}
+                for j, symbol in enumerate(self.symbol_list)
+            }
+        handler.bar_cursor = min(start, stop)
+        return handler
 
     def update_bars(self):
         """
-        Pushes the latest bar to the latest_symbol_data structure
+        Advances the cursor to release the next bar
         for all symbols in the symbol list.
         """
+        if self.bar_cursor < len(self.bar_datetimes):
+            self.bar_cursor += 1
+        else:
+            self.continue_backtest = False
+        self.events.put(MARKET_EVENT)
+
+
+class YahooDataHandler(ColumnarDataHandler):
+    """
+    Get data directly from Yahoo Finance website, and provide an interface
+    to obtain the "latest" bar in a manner identical to a live
+    trading interface.
+    """
+
+    def __init__(self, events, symbol_list, interval, start_date, end_date, downloader=None):
+        """
+        Initialize Queries from yahoo finance api to
+        receive historical data transformed to dataframe
+
+        Parameters:
+        events - The Event Queue.
+        symbol_list - A list of symbol strings.
+        interval - 1d, 1wk, 1mo - daily, weekly monthly data
+        start_date - starting date for the historical data (format: datetime)
+        end_date - final date of the data (format: datetime)
+        downloader - YahooDownloader used to get (and cache) the data,
+                     defaults to the one shared within the process.
+
+        """
+
+        self.events = events
+        self.symbol_list = symbol_list
+        self.interval = interval
+        self.start_date = start_date
+        self.end_date = end_date
+        self.downloader = downloader if downloader is not None else get_default_downloader()
+        self.symbol_data = {}
+        self.continue_backtest = True
+        self._load_data_from_Yahoo_finance()
+
+    def _load_data_from_Yahoo_finance(self):
+        """
+        Queries yfinance api to receive historical data in csv file format
+        """
+
+        # download data from yfinance (or the cache) for all the symbols at the same time
+        self.symbol_data = self.downloader.download(self.symbol_list, self.start_date,
+                                                    self.end_date, self.interval)
+
         for symbol in self.symbol_list:
-            try:
-                bar = next(self._get_new_bar(symbol))
-            except StopIteration:
-                self.continue_backtest = False
-            else:
-                if bar is not None:
-                    self.latest_symbol_data[symbol].append(bar)
-        self.events.put(MarketEvent())
 
+            # rename columns for consistency
+            self.symbol_data[symbol].rename(columns={'Open': 'open',
+                                                     'High': 'high',
+                                                     'Low': 'low',
+                                                     'Close': 'close',
+                                                     'Adj Close': 'adj_close',
+                                                     'Volume': 'volume'}, inplace=True)
+
+            # rename index as well from 'Date' to 'datetime'
+            self.symbol_data[symbol].index.name = 'datetime'
 
-class HistoricCSVDataHandler(DataManagement):
+            # create returns column (used for some strategies)
+            self.symbol_data[symbol]['returns'] = self.symbol_data[symbol]["adj_close"].pct_change() * 100.0
+
+        # Align the dataframes on the combined index, padding forward values
+        self._create_bar_store()
+
+
+class HistoricCSVDataHandler(ColumnarDataHandler):
     """
     HistoricCSVDataHandler is designed to read CSV files for
     each requested symbol from disk and provide an interface
@@ -232,7 +591,7 @@ class HistoricCSVDataHandler(DataManagement):
     trading interface.
     """
 
-    def __init__(self, events, csv_dir, symbol_list):
+    def __init__(self, events, csv_dir, symbol_list, use_cache=True, dayfirst=True):
 
         """
         Initialises the historic data handler by requesting
@@ -243,305 +602,729 @@ class HistoricCSVDataHandler(DataManagement):
         events - The Event Queue.
         csv_dir - Absolute directory path to the CSV files.
         symbol_list - A list of symbol strings.
+        use_cache - Whether to keep a memory-mapped binary copy of
+                    the parsed CSV files next to them (see DataCache).
+        dayfirst - Whether the dates of the files are in the dd/mm/yyyy format.
         """
 
         self.events = events
         self.csv_dir = csv_dir
         self.symbol_list = symbol_list
+        self.use_cache = use_cache
+        self.dayfirst = dayfirst
 
         self.symbol_data = {}
-        self.latest_symbol_data = {}
         self.continue_backtest = True
         self._data_conversion_from_csv_files()
 
+    @classmethod
+    def from_settings(cls, events, data_dir, symbol_list, interval, start_date, end_date):
+        return cls(events, data_dir, symbol_list)
+
     def _data_conversion_from_csv_files(self):
         """
         Opens the CSV files from the data directory, converting
         them into pandas DataFrames within a symbol dictionary.
         """
 
-        combined_index = None
         for symbol in self.symbol_list:
-            # Load the CSV file with no header information, indexed on date
-            self.symbol_data[symbol] = pd.io.parsers.read_csv(
+            # Load the CSV file (or its binary cache), indexed on date
+            self.symbol_data[symbol] = read_csv_columns(
                 os.path.join(self.csv_dir, "%s.csv" % symbol),
-                header=0, index_col=0,
-                names=["datetime", "open", "high", "low", "close", "adj_close", "volume"]
+                ["datetime", "open", "high", "low", "close", "adj_close", "volume"],
+                use_cache=self.use_cache, dayfirst=self.dayfirst
             )
 
-            # Combine the index to pad forward values
-            if combined_index is None:
-                combined_index = self.symbol_data[symbol].index
-            else:
-                combined_index.union(self.symbol_data[symbol].index)
+        # Align the columns on the combined index, padding forward values
+        self._create_bar_store()
 
-            # Set the latest symbol_data to None
-            self.latest_symbol_data[symbol] = []
 
-        # Reindex the dataframes
-        for symbol in self.symbol_list:
-            self.symbol_data[symbol] = self.symbol_data[symbol].reindex(index=combined_index, method="pad").iterrows()
+class LookbackBuffer(object):
+    """
+    Fixed-capacity ring buffer of the latest bars of a symbol. Each bar is
+    written twice, at its slot and one capacity further, so that the latest
+    N values of a field are always a contiguous slice of the array (stored
+    column-major, one column per field), whatever the position of the head.
+    The bars padded from a previous one (no new bar of the symbol) are flagged.
+    """
 
-    def _get_new_bar(self, symbol):
+    def __init__(self, capacity, n_fields):
         """
-        Returns the latest bar from the data feed as a tuple of
-        (symbol, datetime, open, low, high, close, volume, adj_close).
+        Parameters:
+        capacity - Maximum number of bars kept.
+        n_fields - Number of values of each bar (open, high, low, etc).
         """
-        for bar in self.symbol_data[symbol]:
-            yield bar
+        self.capacity = capacity
+        self.values = np.full((2 * capacity, n_fields), np.nan, order="F")
+        self.datetimes = np.empty(2 * capacity, dtype=object)
+        self.padded = np.zeros(2 * capacity, dtype=bool)
+        self.count = 0
 
-    def get_latest_bar(self, symbol):
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, dt, row, padded=False):
         """
-        Returns the last bar from the latest_symbol list.
+        Adds a bar, overwriting the oldest one once the buffer is full.
+        """
+        slot = self.count % self.capacity
+        self.values[slot] = row
+        self.values[slot + self.capacity] = row
+        self.datetimes[slot] = dt
+        self.datetimes[slot + self.capacity] = dt
+        self.padded[slot] = padded
+        self.padded[slot + self.capacity] = padded
+        self.count += 1
+
+    def latest_slice(self, N):
+        """
+        Returns the slice of the arrays holding the latest N bars,
+        or N-k if less available.
+        """
+        if self.count == 0:
+            return slice(0, 0)
+        end = (self.count - 1) % self.capacity + self.capacity + 1
+        return slice(end - min(N, len(self)), end)
+
+
+class BufferedDataHandler(DataManagement):
+    """
+    BufferedDataHandler is the common base of the handlers receiving their
+    bars one at a time (streamed files, database cursors, live feeds), which
+    cannot keep the whole history. The latest bars of each symbol are stored
+    in a LookbackBuffer, whose capacity is the largest lookback declared by
+    the strategies and the portfolio (see set_max_lookback), so the memory
+    stays flat whatever the length of the run. Every symbol receives a bar at
+    each datetime, padded from its previous bar (NaN before its first one) if
+    it has none, so the lookbacks are the ones of the ColumnarDataHandler.
+    """
+
+    def _create_lookback_buffers(self, columns, max_lookback):
+        """
+        Creates an empty LookbackBuffer for each symbol.
+
+        Parameters:
+        columns - Names of the values of each bar.
+        max_lookback - Number of latest bars kept for each symbol.
+        """
+        self.columns = list(columns)
+        self.column_positions = {column: i for i, column in enumerate(self.columns)}
+        self.max_lookback = max_lookback
+        self.latest_symbol_data = {symbol: LookbackBuffer(max_lookback, len(self.columns))
+                                   for symbol in self.symbol_list}
+        self.latest_datetime = None
+
+    def set_max_lookback(self, N):
         """
+        Resizes the buffers to keep the latest N bars, which can
+        only be done before the first bar has been received.
+        """
+        if any(buffer.count for buffer in self.latest_symbol_data.values()):
+            raise ValueError("The lookback cannot be changed once bars have been received.")
+        self._create_lookback_buffers(self.columns, N)
+
+    def get_state(self):
+        """
+        Returns the datetime of the latest bars received, and
+        the content of the lookback buffers.
+        """
+        buffers = {symbol: (buffer.values, buffer.datetimes, buffer.padded, buffer.count)
+                   for symbol, buffer in self.latest_symbol_data.items()}
+        return {"latest_datetime": self.latest_datetime, "continue_backtest": self.continue_backtest,
+                "max_lookback": self.max_lookback, "buffers": buffers}
+
+    def set_state(self, state):
+        """
+        Restores the lookback buffers, then moves the source of the bars
+        after the latest datetime of the checkpoint.
+        """
+        self._create_lookback_buffers(self.columns, state["max_lookback"])
+        for symbol, (values, datetimes, padded, count) in state["buffers"].items():
+            buffer = self._get_buffer(symbol)
+            buffer.values[:], buffer.datetimes[:], buffer.padded[:], buffer.count = values, datetimes, padded, count
+        self.latest_datetime = state["latest_datetime"]
+        bars_left = self._seek_after(self.latest_datetime) if self.latest_datetime is not None else True
+        self.continue_backtest = state["continue_backtest"] or bars_left
+
+    def _seek_after(self, dt):
+        """
+        Moves the source of the bars after the datetime, returning
+        whether bars are left.
+        """
+        raise NotImplementedError("Should implement _seek_after()")
 
+    def _release_bars(self, dt, bars):
+        """
+        Adds the bars of a datetime, given as (symbol, values) pairs, and pads
+        the symbols with no bar at it with their previous bar (NaN before their
+        first bar), as the reindexing of the ColumnarDataHandler does.
+        """
+        self.latest_datetime = dt
+        rows = dict(bars)
+        for symbol in self.symbol_list:
+            buffer = self.latest_symbol_data[symbol]
+            row = rows.get(symbol)
+            if row is not None:
+                buffer.append(dt, row)
+            elif buffer.count:
+                buffer.append(dt, buffer.values[buffer.latest_slice(1).start].copy(), padded=True)
+            else:
+                buffer.append(dt, np.nan, padded=True)
+
+    def _get_buffer(self, symbol):
         try:
-            bars_list = self.latest_symbol_data[symbol]
+            return self.latest_symbol_data[symbol]
         except KeyError:
             print("That symbol is not available in the historical data set.")
             raise
-        else:
-            return bars_list[-1]
+
+    def _get_latest_slot(self, symbol):
+        """
+        Returns the buffer of a symbol and the slot of its latest bar,
+        None if the symbol has not received a bar yet (e.g. it starts
+        later than the other symbols).
+        """
+        buffer = self._get_buffer(symbol)
+        if self.latest_datetime is None:
+            raise IndexError("No bar has been received yet.")
+        if buffer.count == 0:
+            return buffer, None
+        return buffer, buffer.latest_slice(1).start
+
+    def get_latest_bar(self, symbol):
+        """
+        Returns the last bar from the latest_symbol list, at the latest
+        datetime. The values are the ones of the previous bar of the symbol
+        if it has no bar at this datetime, NaN if it has not started yet.
+        """
+        buffer, slot = self._get_latest_slot(symbol)
+        values = buffer.values[slot] if slot is not None else np.full(len(self.columns), np.nan)
+        return self.latest_datetime, pd.Series(values, index=self.columns, name=self.latest_datetime)
 
     def get_latest_bars(self, symbol, N=1):
         """
         Returns the last N bars from the latest_symbol list,
         or N-k if less available.
         """
-
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
-        else:
-            return bars_list[-N:]
+        buffer = self._get_buffer(symbol)
+        latest = buffer.latest_slice(N)
+        return [(buffer.datetimes[slot], pd.Series(buffer.values[slot], index=self.columns,
+                                                   name=buffer.datetimes[slot]))
+                for slot in range(latest.start, latest.stop)]
 
     def get_latest_bar_datetime(self, symbol):
         """
-        Returns a Python datetime object for the last bar.
+        Returns a Python datetime object for the last bar, which is the
+        latest datetime received for all the symbols (as for the
+        ColumnarDataHandler), whether the symbol has a bar at it or not.
         """
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
-        else:
-            return bars_list[-1][0]
+        self._get_latest_slot(symbol)
+        return self.latest_datetime
 
     def get_latest_bar_value(self, symbol, value_type):
         """
         Returns one of the Open, High, Low, Close, Volume or OI
-        values from the pandas Bar series object.
+        values from the last bar.
         """
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
-        else:
-            return getattr(bars_list[-1][1], value_type)
+        buffer, slot = self._get_latest_slot(symbol)
+        if slot is None:
+            return np.nan
+        return buffer.values[slot, self.column_positions[value_type]]
 
-    def get_latest_bars_values(self, symbol, value_type, N=1):
+    def get_latest_bars_values(self, symbol, value_type, N=1, resolution=None):
         """
         Returns the last N bar values from the
         latest_symbol list, or N-k if less available.
+        The array returned is a read-only contiguous view on the buffer.
         """
-        try:
-            bars_list = self.get_latest_bars(symbol, N)  # bars_list = bars_list[-N:]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
-        else:
-            return np.array([getattr(bar[1], value_type) for bar in bars_list])
+        if resolution is not None:
+            raise ValueError("Resampled values need the whole history of a ColumnarDataHandler.")
+        buffer = self._get_buffer(symbol)
+        values = buffer.values[buffer.latest_slice(N), self.column_positions[value_type]]
+        values.flags.writeable = False
+        return values
 
-    def update_bars(self):
+    def get_latest_cross_section(self, value_type):
         """
-        Pushes the latest bar to the latest_symbol_data structure
-        for all symbols in the symbol list.
+        Returns the latest value of a field for all the symbols,
+        NaN for the symbols which have not received a bar yet.
         """
-        for symbol in self.symbol_list:
-            try:
-                bar = next(self._get_new_bar(symbol))
-            except StopIteration:
-                self.continue_backtest = False
-            else:
-                if bar is not None:
-                    self.latest_symbol_data[symbol].append(bar)
-        self.events.put(MarketEvent())
+        position = self.column_positions[value_type]
+        cross_section = np.full(len(self.symbol_list), np.nan)
+        for j, symbol in enumerate(self.symbol_list):
+            buffer = self.latest_symbol_data[symbol]
+            if buffer.count:
+                cross_section[j] = buffer.values[buffer.latest_slice(1).start, position]
+        return cross_section
+
+    def is_latest_bar_stale(self, symbol):
+        """
+        Returns True if the symbol had no new bar at the latest
+        datetime (its latest bar is padded from a previous one, or
+        it has not started yet).
+        """
+        buffer, slot = self._get_latest_slot(symbol)
+        return slot is None or bool(buffer.padded[slot])
 
 
-'''
-class HistoricMySQLDataHandler(DataManagement):
+class StreamingCSVDataHandler(BufferedDataHandler):
     """
-    HistoricMySQLDataHandler is designed to read a MySQL database for each requested symbol from disk and 
-    provide an interface to obtain the "latest" bar in a manner identical to a live trading interface.
+    StreamingCSVDataHandler reads the CSV files of the symbols in fixed-size
+    chunks instead of loading their whole history before the first bar. The
+    symbol streams are merged by timestamp through a heap-based k-way merge, and
+    only the latest bars needed by the strategies are kept, so the memory stays
+    bounded by the chunk size times the number of symbols.
+    All the bars sharing the same timestamp are released by one update_bars call.
+    Each file must be sorted by date.
     """
 
-    def __init__(self, events, db_host, db_user, db_pass, db_name, symbol_list):
-
+    def __init__(self, events, csv_dir, symbol_list, chunk_size=10000, max_lookback=500, dayfirst=True):
         """
-        Initialises the historic data handler by requesting
-        the location of the database and a list of symbols.
-        It will be assumed that all price data is in a table called 
-        'symbols', where the field 'symbol' is a string in the list.
+        Initialises the streaming data handler.
+
         Parameters:
         events - The Event Queue.
-        db_host - host of the database
-        db_user - database user
-        db_pass - password to access database
-        db_name - database's name
-        symbol_list - A list of symbol stringss
+        csv_dir - Absolute directory path to the CSV files.
+        symbol_list - A list of symbol strings.
+        chunk_size - Number of rows read at a time from each CSV file.
+        max_lookback - Number of latest bars kept for each symbol, until
+                       the strategies declare the lookback they need.
+        dayfirst - Whether the dates of the files are in the dd/mm/yyyy format.
         """
 
         self.events = events
-        self.db_host = db_host
-        self.db_user = db_user
-        self.db_pass = db_pass
-        self.db_name = db_name  
-
+        self.csv_dir = csv_dir
         self.symbol_list = symbol_list
-        self.symbol_data = {}
-        self.latest_symbol_data = {}
-
+        self.chunk_size = chunk_size
+        self.dayfirst = dayfirst
+        self._create_lookback_buffers(["open", "high", "low", "close", "adj_close", "volume"], max_lookback)
         self.continue_backtest = True
-        self._data_conversion_from_database()
 
+        self._bar_stream = heapq.merge(*[self._read_symbol_bars(i, symbol)
+                                         for i, symbol in enumerate(self.symbol_list)])
+        self._next_bar = next(self._bar_stream, None)
+
+    @classmethod
+    def from_settings(cls, events, data_dir, symbol_list, interval, start_date, end_date):
+        return cls(events, data_dir, symbol_list)
+
+    def _seek_after(self, dt):
+        # The files are read again up to the datetime, without processing the bars
+        while self._next_bar is not None and self._next_bar[0] <= dt:
+            self._next_bar = next(self._bar_stream, None)
+        return self._next_bar is not None
+
+    def _read_symbol_bars(self, order, symbol):
+        """
+        Generator of the bars of a symbol, read chunk by chunk, as tuples of
+        (timestamp, symbol order, symbol, values). The symbol order makes the
+        tuples unique for the merge when several symbols share a timestamp.
+        """
+        reader = pd.io.parsers.read_csv(
+            os.path.join(self.csv_dir, "%s.csv" % symbol),
+            header=0, index_col=0, chunksize=self.chunk_size,
+            names=["datetime"] + self.columns
+        )
+        last_timestamp = None
+        for chunk in reader:
+            timestamps = pd.to_datetime(chunk.index, dayfirst=self.dayfirst)
+            if (last_timestamp is not None and timestamps[0] <= last_timestamp) \
+                    or not (timestamps.is_monotonic_increasing and timestamps.is_unique):
+                raise ValueError("The bars of %s.csv are not sorted by unique dates." % symbol)
+            last_timestamp = timestamps[-1]
+
+            values = chunk[self.columns].to_numpy(dtype=np.float64)
+            for timestamp, row in zip(timestamps, values):
+                yield timestamp, order, symbol, row
+
+    def update_bars(self):
+        """
+        Pushes all the bars of the next timestamp to the
+        latest_symbol_data structure. The symbols with no bar
+        at this timestamp are padded with their previous bar.
+        """
+        if self._next_bar is None:
+            self.continue_backtest = False
+        else:
+            timestamp = self._next_bar[0]
+            bars = []
+            while self._next_bar is not None and self._next_bar[0] == timestamp:
+                _, _, symbol, row = self._next_bar
+                bars.append((symbol, row))
+                self._next_bar = next(self._bar_stream, None)
+            self._release_bars(timestamp, bars)
+        self.events.put(MARKET_EVENT)
 
-    def _get_data_from_database(self, symbol, columns):
-        try:
-            connection = MySQLdb.connect(host=self.db_host, user=self.db_user, passwd=self.db_pass, db=self.db_name)
-        except MySQLdb.Error as e:  
-            print("Error:%d:%s" % (e.args[0], e.args[1]))
 
-        sql = SELECT {},{},{},{},{},{},{}
-                FROM {}.format(columns[0],
-                                    columns[1],
-                                        columns[2],
-                                            columns[3],
-                                              columns[4],
-                                                columns[5],
-                                                    columns[6],
-                                                        symbol)
+_sqlite_connections = {}
 
-        return pd.read_sql_query(sql, con=connection, index_col="datetime")
 
-    def _data_conversion_from_database(self):
+def get_sqlite_connection(db_path):
+    """
+    Returns the connection to a SQLite database shared (pooled) within the
+    process, so the handlers and loaders reading the same store do not open
+    a new connection for each symbol or each backtest.
+    """
+    db_path = os.path.abspath(str(db_path))
+    if db_path not in _sqlite_connections:
+        _sqlite_connections[db_path] = sqlite3.connect(db_path, check_same_thread=False)
+    return _sqlite_connections[db_path]
+
+
+class HistoricSQLiteDataHandler(BufferedDataHandler):
+    """
+    HistoricSQLiteDataHandler is designed to read the bars of all the requested
+    symbols from one SQLite database, and provide an interface to obtain the
+    "latest" bar in a manner identical to a live trading interface.
+    The bars are stored in a single 'bars' table indexed on (datetime, symbol).
+    The whole symbol list and date range are fetched with one query ordered by
+    datetime, whose rows are streamed with cursor.fetchmany into the lookback
+    buffers, so thousands of symbols can share one consolidated store.
+    """
+
+    BAR_COLUMNS = ["open", "high", "low", "close", "adj_close", "volume"]
+    DEFAULT_DB_NAME = "market_data.db"
+    MAX_QUERY_PARAMETERS = 900
+
+    def __init__(self, events, db_path, symbol_list, start_date=None, end_date=None,
+                 fetch_size=10000, max_lookback=500):
         """
-        Opens the database files, converting them into 
-        pandas DataFrames within a symbol dictionary.
-        For this handler it will be assumed that the data is
-        assumed to be stored in a database with similar columns 
-        as the pandas dataframes. Thus, the format will be respected.
+        Initialises the SQLite data handler and starts the query.
+
+        Parameters:
+        events - The Event Queue.
+        db_path - Path to the SQLite database file.
+        symbol_list - A list of symbol strings.
+        start_date - starting date of the bars (format: datetime), None for no bound
+        end_date - final date of the bars (format: datetime), None for no bound
+        fetch_size - Number of rows fetched at a time from the cursor.
+        max_lookback - Number of latest bars kept for each symbol, until
+                       the strategies declare the lookback they need.
         """
 
-        combined_index = None
-        columns = ["datetime","open","high","low","close","volume","adj_close"]
+        self.events = events
+        self.db_path = db_path
+        self.symbol_list = symbol_list
+        self.start_date = start_date
+        self.end_date = end_date
+        self.fetch_size = fetch_size
+        self._create_lookback_buffers(self.BAR_COLUMNS, max_lookback)
+        self.continue_backtest = True
+
+        self.connection = get_sqlite_connection(db_path)
+        self._rows = self._fetch_rows()
+        self._next_row = next(self._rows, None)
 
-        for symbol in self.symbol_list:
-            self.symbol_data[symbol] = self._get_data_from_database(symbol, columns)
+    @classmethod
+    def from_settings(cls, events, data_dir, symbol_list, interval, start_date, end_date):
+        db_path = str(data_dir)
+        if os.path.isdir(db_path):
+            db_path = os.path.join(db_path, cls.DEFAULT_DB_NAME)
+        return cls(events, db_path, symbol_list, start_date, end_date)
 
+    @classmethod
+    def create_table(cls, db_path):
+        """
+        Creates the bars table and its index if they do not exist.
+        """
+        connection = get_sqlite_connection(db_path)
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS bars (symbol TEXT NOT NULL, datetime TEXT NOT NULL, "
+                "open REAL, high REAL, low REAL, close REAL, adj_close REAL, volume REAL, "
+                "PRIMARY KEY (symbol, datetime))"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS bars_datetime_symbol ON bars (datetime, symbol)")
+
+    @classmethod
+    def import_csv_files(cls, db_path, csv_dir, symbol_list, dayfirst=True):
+        """
+        Loads the CSV files of the symbols (in the HistoricCSVDataHandler
+        format) into the bars table, replacing existing bars.
+        """
+        cls.create_table(db_path)
+        connection = get_sqlite_connection(db_path)
+        for symbol in symbol_list:
+            index, columns = read_csv_columns(os.path.join(str(csv_dir), "%s.csv" % symbol),
+                                              ["datetime"] + cls.BAR_COLUMNS, use_cache=False, dayfirst=dayfirst)
+            datetimes = index.strftime("%Y-%m-%d %H:%M:%S")
+            rows = zip([symbol] * len(index), datetimes, *[columns[column].tolist() for column in cls.BAR_COLUMNS])
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _fetch_rows(self, after=None):
+        """
+        Generator of the (datetime, symbol, values...) rows of the backtest,
+        running one indexed query for the whole symbol list and date range
+        (only the rows after a datetime, if given).
+        """
+        cursor = self.connection.cursor()
+        parameters = []
+        if len(self.symbol_list) <= self.MAX_QUERY_PARAMETERS:
+            where = ["symbol IN (%s)" % ", ".join("?" * len(self.symbol_list))]
+            parameters.extend(self.symbol_list)
+        else:
+            # Too many symbols for the query parameters, they are joined from a temporary table
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS backtest_symbols (symbol TEXT PRIMARY KEY)")
+            cursor.execute("DELETE FROM backtest_symbols")
+            cursor.executemany("INSERT OR IGNORE INTO backtest_symbols VALUES (?)",
+                               [(symbol,) for symbol in self.symbol_list])
+            where = ["symbol IN (SELECT symbol FROM backtest_symbols)"]
+        if self.start_date is not None:
+            where.append("datetime >= ?")
+            parameters.append(pd.Timestamp(self.start_date).strftime("%Y-%m-%d %H:%M:%S"))
+        if self.end_date is not None:
+            where.append("datetime <= ?")
+            parameters.append(pd.Timestamp(self.end_date).strftime("%Y-%m-%d %H:%M:%S"))
+        if after is not None:
+            where.append("datetime > ?")
+            parameters.append(pd.Timestamp(after).strftime("%Y-%m-%d %H:%M:%S"))
+
+        cursor.execute(
+            "SELECT datetime, symbol, %s FROM bars WHERE %s ORDER BY datetime, symbol"
+            % (", ".join(self.BAR_COLUMNS), " AND ".join(where)),
+            parameters
+        )
+        try:
+            while True:
+                rows = cursor.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
+
+    def _seek_after(self, dt):
+        self._rows = self._fetch_rows(after=dt)
+        self._next_row = next(self._rows, None)
+        return self._next_row is not None
 
-            # Combine the index to pad forward values
-            if combined_index is None:
-                combined_index = self.symbol_data[symbol].index
-            else:
-                combined_index.union(self.symbol_data[symbol].index)
+    def update_bars(self):
+        """
+        Pushes all the bars of the next datetime to the
+        latest_symbol_data structure. The symbols with no bar
+        at this datetime are padded with their previous bar.
+        """
+        if self._next_row is None:
+            self.continue_backtest = False
+        else:
+            current = self._next_row[0]
+            bars = []
+            while self._next_row is not None and self._next_row[0] == current:
+                bars.append((self._next_row[1], self._next_row[2:]))
+                self._next_row = next(self._rows, None)
+            self._release_bars(pd.Timestamp(current), bars)
+        self.events.put(MARKET_EVENT)
 
-            # Set the latest symbol_data to None
-            self.latest_symbol_data[symbol] = []
 
-        # Reindex the dataframes
-        for symbol in self.symbol_list:
-            self.symbol_data[symbol] = self.symbol_data[symbol].reindex(index=combined_index, method="pad").iterrows()
+class TCPFeedDataHandler(BufferedDataHandler):
+    """
+    TCPFeedDataHandler receives the bars of a live (or paper trading) feed
+    over TCP, as JSON lines of the form
+    {"datetime": "2020-01-02 00:00:00", "bars": {"AAPL": {"open": ..., ...}, ...}},
+    one line per timestamp. The bars are received in the background by an
+    asyncio task, and released by update_bars at the heartbeat of the
+    LiveTradingLoop, so the strategies and the portfolio are unchanged.
+    """
 
-    def _get_new_bar(self, symbol):
+    BAR_COLUMNS = ["open", "high", "low", "close", "adj_close", "volume"]
+
+    def __init__(self, events, address, symbol_list, max_lookback=500):
         """
-        Returns the latest bar from the data feed as a tuple of 
-        (symbol, datetime, open, low, high, close, volume, adj_close).
+        Initialises the feed handler (the connection is opened by connect).
+
+        Parameters:
+        events - The Event Queue.
+        address - (host, port) of the feed.
+        symbol_list - A list of symbol strings.
+        max_lookback - Number of latest bars kept for each symbol, until
+                       the strategies declare the lookback they need.
         """
-        for bar in self.symbol_data[symbol]:
-            yield bar
 
+        self.events = events
+        self.host, self.port = address
+        self.symbol_list = symbol_list
+        self._create_lookback_buffers(self.BAR_COLUMNS, max_lookback)
+        self.continue_backtest = True
 
-    def get_latest_bar(self, symbol):
+        self.bars_received = 0
+        self._received = deque()
+        self._feed_closed = False
+        self._receiver = None
+        self._bar_arrived = None
+
+    @classmethod
+    def from_settings(cls, events, data_dir, symbol_list, interval, start_date, end_date):
+        # The "data directory" of a feed is its (host, port) address
+        return cls(events, data_dir, symbol_list)
+
+    async def connect(self):
         """
-        Returns the last bar from the latest_symbol list.
+        Opens the connection to the feed, and starts receiving the bars.
         """
+        # Created here to belong to the running event loop
+        self._bar_arrived = asyncio.Event()
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        self._receiver = asyncio.ensure_future(self._receive_bars(reader, writer))
 
+    async def _receive_bars(self, reader, writer):
+        """
+        Receives the bars until the feed closes the connection.
+        """
         try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
-        else:
-            return bars_list[-1]
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                bars = [(symbol, [bar[column] for column in self.columns])
+                        for symbol, bar in message["bars"].items() if symbol in self.latest_symbol_data]
+                self._received.append((pd.Timestamp(message["datetime"]), bars))
+                self.bars_received += 1
+                self._bar_arrived.set()
+        finally:
+            self._feed_closed = True
+            self._bar_arrived.set()
+            writer.close()
+
+    async def close(self):
+        """
+        Stops receiving the bars.
+        """
+        if self._receiver is not None:
+            self._receiver.cancel()
+            try:
+                await self._receiver
+            except asyncio.CancelledError:
+                pass
 
-    def get_latest_bars(self, symbol, N=1):
+    def bars_pending(self):
         """
-        Returns the last N bars from the latest_symbol list,
-        or N-k if less available.
+        Returns True if bars have been received but not released yet.
         """
+        return bool(self._received)
 
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
-        else:
-            return bars_list[-N:]
+    async def wait_for_bars(self, timeout=None):
+        """
+        Waits until bars have been received but not released yet, or the
+        feed is closed, or the timeout (in seconds) has expired.
+        Returns True if bars are pending.
+        """
+        if not self._received and not self._feed_closed:
+            self._bar_arrived.clear()
+            try:
+                await asyncio.wait_for(self._bar_arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.bars_pending()
 
-    def get_latest_bar_datetime(self, symbol):
+    def update_bars(self):
         """
-        Returns a Python datetime object for the last bar.
+        Pushes the bars of the next timestamp received to the
+        latest_symbol_data structure. Nothing happens if no bar has
+        been received since the previous update, and the backtest
+        stops once the feed is closed and all its bars are released.
         """
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
-        else:
-            return bars_list[-1][0]
+        if self._received:
+            timestamp, bars = self._received.popleft()
+            self._release_bars(timestamp, bars)
+            self.events.put(MARKET_EVENT)
+        elif self._feed_closed:
+            self.continue_backtest = False
 
-    def get_latest_bar_value(self, symbol, value_type):
+
+class ParquetLakeDataHandler(ColumnarDataHandler):
+    """
+    ParquetLakeDataHandler reads the bars from a date-partitioned Parquet data
+    lake, laid out as 'symbol=AAPL/year=2020/month=1/*.parquet'. Only the
+    partitions of the requested symbols overlapping the backtest window are
+    opened, and within them only the row groups whose datetime statistics
+    overlap the window, and only the selected columns, are read (predicate
+    pushdown of pyarrow.dataset). A one-month test thus reads one month of data.
+    """
+
+    BAR_COLUMNS = ["open", "high", "low", "close", "adj_close", "volume"]
+
+    def __init__(self, events, lake_dir, symbol_list, start_date, end_date, columns=None):
         """
-        Returns one of the Open, High, Low, Close, Volume or OI
-        values from the pandas Bar series object.
+        Initialises the data lake handler.
+
+        Parameters:
+        events - The Event Queue.
+        lake_dir - Root directory of the Parquet data lake.
+        symbol_list - A list of symbol strings.
+        start_date - starting date of the bars (format: datetime)
+        end_date - final date of the bars (format: datetime), included
+        columns - The columns to read, all the bar columns by default
+                  ('adj_close' is needed by the Portfolio valuation).
         """
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-                print("That symbol is not available in the historical data set.")
-                raise
-        else:
-            return getattr(bars_list[-1][1], value_type)
+        # Imported here so that pyarrow is only needed by this handler
+        import pyarrow.dataset as ds
 
+        self.events = events
+        self.lake_dir = lake_dir
+        self.symbol_list = symbol_list
+        self.start_date = pd.Timestamp(start_date)
+        self.end_date = pd.Timestamp(end_date)
+        self.columns = list(columns) if columns is not None else list(self.BAR_COLUMNS)
+
+        self.symbol_data = {}
+        self.continue_backtest = True
+        self._load_data_from_lake(ds)
+
+    @classmethod
+    def from_settings(cls, events, data_dir, symbol_list, interval, start_date, end_date):
+        return cls(events, data_dir, symbol_list, start_date, end_date)
 
-    def get_latest_bars_values(self, symbol, value_type, N=1):
+    @classmethod
+    def write_partitions(cls, lake_dir, symbol, frame, row_group_size=50000):
         """
-        Returns the last N bar values from the
-        latest_symbol list, or N-k if less available.
+        Writes the bars of a symbol (DataFrame indexed on datetime) into
+        the lake, one file per month, replacing the existing ones.
         """
-        try:
-            bars_list = self.get_latest_bars(symbol, N) # bars_list = bars_list[-N:]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-            raise
-        else:
-            return np.array([getattr(bar[1], value_type) for bar in bars_list])
+        import pyarrow as pa
+        import pyarrow.parquet as pq
 
-    def update_bars(self):
+        frame = frame.sort_index()
+        for (year, month), month_frame in frame.groupby([frame.index.year, frame.index.month]):
+            partition = os.path.join(str(lake_dir), "symbol=%s" % symbol, "year=%d" % year, "month=%d" % month)
+            if not os.path.isdir(partition):
+                os.makedirs(partition)
+            table = pa.Table.from_pandas(month_frame.rename_axis("datetime").reset_index(), preserve_index=False)
+            pq.write_table(table, os.path.join(partition, "part-0.parquet"), row_group_size=row_group_size)
+
+    def _window_filter(self, ds):
         """
-        Pushes the latest bar to the latest_symbol_data structure
-        for all symbols in the symbol list.
+        Builds the filter of the symbols and the backtest window, on the
+        partition keys (pruning whole months) and on the datetime column
+        (pruning row groups from their statistics, then rows).
+        """
+        start, end = self.start_date, self.end_date
+        year, month = ds.field("year"), ds.field("month")
+        after_start = (year > start.year) | ((year == start.year) & (month >= start.month))
+        before_end = (year < end.year) | ((year == end.year) & (month <= end.month))
+        in_window = (ds.field("datetime") >= start.to_datetime64()) & (ds.field("datetime") <= end.to_datetime64())
+        return ds.field("symbol").isin(self.symbol_list) & after_start & before_end & in_window
+
+    def _load_data_from_lake(self, ds):
+        """
+        Reads the bars of the backtest window into (index, column arrays) pairs.
         """
+        dataset = ds.dataset(str(self.lake_dir), format="parquet", partitioning="hive")
+        table = dataset.to_table(columns=["symbol", "datetime"] + self.columns, filter=self._window_filter(ds))
+        frame = table.to_pandas()
+
         for symbol in self.symbol_list:
-            try:
-                bar = next(self._get_new_bar(symbol))
-            except StopIteration:
-                self.continue_backtest = False
-            else:
-                if bar is not None:
-                    self.latest_symbol_data[symbol].append(bar)
-        self.events.put(MarketEvent())
-'''
\ No newline at end of file
+            symbol_frame = frame[frame["symbol"] == symbol]
+            if symbol_frame.empty:
+                raise KeyError("No data in the lake for %s between %s and %s"
+                               % (symbol, self.start_date, self.end_date))
+            symbol_frame = symbol_frame.sort_values("datetime")
+            self.symbol_data[symbol] = (
+                pd.DatetimeIndex(symbol_frame["datetime"].values, name="datetime"),
+                {column: symbol_frame[column].values for column in self.columns}
+            )
+
+        # Align the columns on the combined index, padding forward values
+        self._create_bar_store()
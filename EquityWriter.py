@@ -0,0 +1,161 @@
+from __future__ import print_function
+
+import glob
+import os
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import pandas as pd
+
+from Performance import create_drawdowns, create_equity_curve
+
+# Name of the files of the chunks in the output directory
+PART_FORMAT = "part-%06d.parquet"
+
+
+class EquityWriter(object):
+    """
+    Writes the holdings history of a portfolio in chunks, from a background
+    thread, into a directory of Parquet files (one file per chunk, e.g.
+    'equity.parquet/part-000000.parquet'), so that a long run neither keeps its
+    whole history in memory nor serializes it at the end. Each file is written
+    next to its final name then renamed, so the output can be read at any time
+    during the run (read_equity_curve). The queue of chunks waiting to be
+    written is bounded, the portfolio waiting for the writer when it is full.
+    """
+
+    def __init__(self, path, first_chunk=0, max_pending=4):
+        """
+        Creates the output directory and starts the writer thread.
+
+        Parameters:
+        path - Directory of the chunk files.
+        first_chunk - Number of the first chunk written. The files of the following
+                      chunks (of a previous run, or written after a checkpoint) are removed.
+        max_pending - Number of chunks waiting to be written before the portfolio waits.
+        """
+        # Imported here so that pyarrow is only needed by the streaming output
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.path = path
+        self.n_chunks = first_chunk
+        self._pa = pa
+        self._pq = pq
+        self._error = None
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for part_path in _part_paths(path)[first_chunk:]:
+            os.remove(part_path)
+
+        self._chunks = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._write_chunks, name="EquityWriter")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _write_chunks(self):
+        """
+        Writes the chunks of the queue until the sentinel (None) is received.
+        """
+        while True:
+            item = self._chunks.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    number, frame = item
+                    part_path = os.path.join(self.path, PART_FORMAT % number)
+                    table = self._pa.Table.from_pandas(frame, preserve_index=False)
+                    self._pq.write_table(table, part_path + ".tmp")
+                    os.replace(part_path + ".tmp", part_path)
+            except Exception as error:
+                # Raised in the thread of the portfolio on the next call
+                self._error = error
+            finally:
+                self._chunks.task_done()
+
+    def _check_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, datetimes, holdings, columns):
+        """
+        Queues a chunk of the holdings history to be written.
+
+        Parameters:
+        datetimes - The datetimes of the rows.
+        holdings - (rows x columns) array of the holdings, copied before being queued.
+        columns - Names of the columns of the holdings.
+        """
+        self._check_error()
+        frame = pd.DataFrame(holdings, columns=columns, copy=True)
+        frame.insert(0, "datetime", pd.to_datetime(list(datetimes)))
+        self._chunks.put((self.n_chunks, frame))
+        self.n_chunks += 1
+
+    def wait(self):
+        """
+        Waits until all the queued chunks are written.
+        """
+        self._chunks.join()
+        self._check_error()
+
+    def close(self):
+        """
+        Writes the queued chunks and stops the writer thread.
+        """
+        if self._thread.is_alive():
+            self._chunks.put(None)
+            self._thread.join()
+        self._check_error()
+
+
+def _part_paths(path):
+    """
+    Returns the paths of the chunk files of an output directory, in order.
+    """
+    return sorted(glob.glob(os.path.join(str(path), PART_FORMAT.replace("%06d", "[0-9]" * 6))))
+
+
+def iter_equity_chunks(path, columns=None):
+    """
+    Iterates over the chunks of an output directory written by the EquityWriter,
+    as DataFrames indexed on datetime, to process long histories in bounded memory.
+
+    Parameters:
+    path - Directory of the chunk files.
+    columns - The holdings columns to read (e.g. ["total"]), all of them by default.
+    """
+    import pyarrow.parquet as pq
+
+    if columns is not None:
+        columns = ["datetime"] + [column for column in columns if column != "datetime"]
+    for part_path in _part_paths(path):
+        yield pq.read_table(part_path, columns=columns).to_pandas().set_index("datetime")
+
+
+def read_equity_curve(path, columns=None):
+    """
+    Reads the holdings history written by the EquityWriter into an equity curve
+    DataFrame with the columns of the 'equity.csv' files (returns, equity_curve
+    and drawdown), to be used by the performance statistics and plots.
+
+    Parameters:
+    path - Directory of the chunk files.
+    columns - The holdings columns to read, all of them by default ('total' is always read).
+    """
+    if columns is not None and "total" not in columns:
+        columns = list(columns) + ["total"]
+    chunks = list(iter_equity_chunks(path, columns))
+    if not chunks:
+        raise ValueError("No equity chunk has been written in %s." % path)
+    equity_curve = pd.concat(chunks)
+    equity_curve["returns"] = equity_curve["total"].pct_change()
+    equity_curve["equity_curve"] = (1.0 + equity_curve["returns"]).cumprod()
+    equity_curve["drawdown"] = create_drawdowns(create_equity_curve(equity_curve["returns"]))[0]
+    return equity_curve
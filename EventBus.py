@@ -0,0 +1,85 @@
+from __future__ import print_function
+
+from collections import deque
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class EventBus(object):
+    """
+    Single-threaded event bus, to be used instead of the queue.Queue of the
+    backtest loop. It keeps the put/get interface of the queue (so the data
+    handler, strategies, portfolio and execution handler are unchanged) but
+    uses a plain deque, without the lock and condition variable taken by the
+    thread-safe queue on every call. Events are dispatched through a registry
+    of handlers keyed by event class, instead of a chain of isinstance checks.
+    """
+
+    def __init__(self):
+        self._events = deque()
+        self._handlers = {}
+        self._resolved = {}
+        self.dispatched = 0
+
+    def put(self, event):
+        """
+        Adds an event at the end of the bus (None values, such as
+        the orders not generated by the portfolio, are dropped).
+        """
+        if event is not None:
+            self._events.append(event)
+
+    def get(self, block=False):
+        """
+        Removes and returns the first event, raising queue.Empty if
+        there is none (the bus never blocks as it is single-threaded).
+        """
+        try:
+            return self._events.popleft()
+        except IndexError:
+            raise queue.Empty
+
+    def empty(self):
+        return not self._events
+
+    def qsize(self):
+        return len(self._events)
+
+    def subscribe(self, event_cls, handler):
+        """
+        Registers a handler (function taking the event) called for
+        each event of the class, or of one of its subclasses.
+        Handlers are called in their order of subscription.
+        """
+        self._handlers.setdefault(event_cls, []).append(handler)
+        self._resolved = {}
+
+    def _handlers_for(self, event_cls):
+        """
+        Returns the handlers of an event class, looked up once along
+        its method resolution order, then cached.
+        """
+        handlers = []
+        for cls in event_cls.__mro__:
+            handlers.extend(self._handlers.get(cls, []))
+        self._resolved[event_cls] = tuple(handlers)
+        return self._resolved[event_cls]
+
+    def dispatch(self):
+        """
+        Dispatches the events to their handlers until the bus is empty,
+        including the events put by the handlers themselves.
+        """
+        events = self._events
+        resolved = self._resolved
+        while events:
+            event = events.popleft()
+            handlers = resolved.get(event.__class__)
+            if handlers is None:
+                handlers = self._handlers_for(event.__class__)
+            for handler in handlers:
+                handler(event)
+            self.dispatched += 1
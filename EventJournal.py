@@ -0,0 +1,257 @@
+from __future__ import print_function
+
+import json
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+from Events import FillEvent, MarketEvent, OrderEvent, SignalEvent
+from Strategy import Strategy
+
+# Fixed-width record of the journal, one per Signal, Order or Fill event
+RECORD_DTYPE = np.dtype([
+    ("bar", "<i8"),          # number of bars (MarketEvents) handled when the event occurred
+    ("datetime", "<i8"),     # datetime of the latest bar of the symbol, in ns since the epoch
+    ("kind", "u1"),          # SIGNAL, ORDER or FILL
+    ("direction", "i1"),     # LONG 1, SHORT -1, EXIT 0 (signals) / BUY 1, SELL -1 (orders and fills)
+    ("account", "<u2"),      # index of the strategy, when several strategies are run
+    ("symbol", "<u4"),       # index of the symbol in the symbol list of the header
+    ("quantity", "<f8"),     # quantity of the orders and fills, strength of the signals
+    ("price", "<f8"),        # fill cost, or latest adjusted close of the symbol for fills without one
+    ("commission", "<f8"),   # commission of the fills
+])
+
+SIGNAL, ORDER, FILL = 1, 2, 3
+SIGNAL_DIRECTIONS = {"LONG": 1, "SHORT": -1, "EXIT": 0}
+SIGNAL_TYPES = {direction: signal_type for signal_type, direction in SIGNAL_DIRECTIONS.items()}
+ORDER_DIRECTIONS = {"BUY": 1, "SELL": -1}
+
+JOURNAL_MAGIC = b"EVTJRNL1"
+_HEADER_PREFIX = struct.Struct("<8sI")
+
+
+class EventJournal(object):
+    """
+    Append-only journal of the Signal, Order and Fill events of a backtest, in a
+    binary file of fixed-width records (RECORD_DTYPE). The records are buffered
+    in a preallocated NumPy array and written in blocks, and the file can be read
+    back as a memory-mapped structured array (read_journal), to analyze millions
+    of fills with NumPy. The records are ordered by bar, so the events of a range
+    of bars are found with np.searchsorted on the 'bar' field.
+    """
+
+    def __init__(self, path, bars, symbol_list, append=False, buffer_size=4096):
+        """
+        Creates the journal, or opens it to append records.
+
+        Parameters:
+        path - Path of the journal file.
+        bars - The DataHandler object, giving the datetime and price of the events.
+        symbol_list - The list of symbol strings, stored in the header.
+        append - Whether to append to an existing journal (e.g. when resuming a backtest) instead of overwriting it.
+        buffer_size - Number of records buffered before being written.
+        """
+        self.path = path
+        self.bars = bars
+        self.symbol_list = list(symbol_list)
+        self.symbol_positions = {symbol: j for j, symbol in enumerate(self.symbol_list)}
+        self.bar = 0
+
+        self._buffer = np.zeros(buffer_size, dtype=RECORD_DTYPE)
+        self._n_buffered = 0
+
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            symbols, self._header_size = _read_header(path)
+            if symbols != self.symbol_list:
+                raise ValueError("The journal %s was written for other symbols." % path)
+            self._file = open(path, "r+b")
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(path, "wb")
+            self._header_size = _write_header(self._file, self.symbol_list)
+
+    def on_market_event(self, event):
+        """
+        Counts the bars, to stamp the following events.
+        """
+        self.bar += 1
+
+    def record(self, event, account=0):
+        """
+        Adds a record for a Signal, Order or Fill event (other events are ignored).
+        """
+        if isinstance(event, SignalEvent):
+            kind, direction, quantity = SIGNAL, SIGNAL_DIRECTIONS[event.signal_type], event.strength
+        elif isinstance(event, OrderEvent):
+            kind, direction, quantity = ORDER, ORDER_DIRECTIONS[event.direction], event.quantity
+        elif isinstance(event, FillEvent):
+            kind, direction, quantity = FILL, ORDER_DIRECTIONS[event.direction], event.quantity
+        else:
+            return
+
+        if self._n_buffered == len(self._buffer):
+            self.flush()
+        record = self._buffer[self._n_buffered]
+        record["bar"] = self.bar
+        record["datetime"] = pd.Timestamp(self.bars.get_latest_bar_datetime(event.symbol)).value
+        record["kind"] = kind
+        record["direction"] = direction
+        record["account"] = account
+        record["symbol"] = self.symbol_positions[event.symbol]
+        record["quantity"] = quantity
+        if kind == FILL:
+            record["price"] = event.fill_cost if event.fill_cost is not None \
+                else self.bars.get_latest_bar_value(event.symbol, "adj_close")
+            record["commission"] = event.commission
+        else:
+            record["price"] = np.nan
+            record["commission"] = 0.0
+        self._n_buffered += 1
+
+    def flush(self):
+        """
+        Writes the buffered records at the end of the file.
+        """
+        if self._n_buffered:
+            self._file.write(self._buffer[:self._n_buffered].tobytes())
+            self._file.flush()
+            self._n_buffered = 0
+
+    def truncate_after(self, bar):
+        """
+        Removes the records of the events after a bar, e.g. the ones written
+        after the checkpoint from which a backtest is resumed.
+        """
+        self.flush()
+        records = read_journal(self.path)[1]
+        n_kept = int(np.searchsorted(records["bar"], bar, side="right"))
+        del records
+        self._file.truncate(self._header_size + n_kept * RECORD_DTYPE.itemsize)
+        self._file.seek(0, os.SEEK_END)
+        self.bar = bar
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class ReplayStrategy(Strategy):
+    """
+    Replays the signals of a strategy recorded in an event journal, instead of
+    calculating them: on the k-th MarketEvent, the signals journaled at bar k
+    are put back on the events queue. The data handler still provides the bars
+    to the portfolio and the execution handler, so a backtest replaying the
+    journal on the same data and dates can evaluate other sizing or execution
+    logic without the cost of the strategy (model fits, regressions, etc.).
+    """
+
+    def __init__(self, bars, events, journal_path, account=0):
+        """
+        Loads the signals of the journal.
+
+        Parameters:
+        bars - The DataHandler object that provides bar information
+        events - The Event Queue object.
+        journal_path - Path of the journal written by the recorded backtest.
+        account - Index of the replayed strategy, when several strategies were recorded.
+        """
+        self.bars = bars
+        self.symbol_list = self.bars.symbol_list
+        self.events = events
+        self.journal_path = journal_path
+        self.account = account
+        self.max_lookback = 1
+        self.bar = 0
+
+        symbol_list, records = read_journal(journal_path)
+        if symbol_list != list(self.symbol_list):
+            raise ValueError("The journal %s was written for other symbols." % journal_path)
+        signals = records[(records["kind"] == SIGNAL) & (records["account"] == account)]
+        # Copied in memory, so the journal file can be overwritten by the replay
+        self._signal_bars = np.array(signals["bar"])
+        self._signal_datetimes = np.array(signals["datetime"])
+        self._signal_symbols = np.array(signals["symbol"])
+        self._signal_directions = np.array(signals["direction"])
+        self._signal_strengths = np.array(signals["quantity"])
+
+    def calculate_signals(self, event):
+        """
+        Puts the signals journaled at the current bar on the events queue.
+
+        Parameters
+        event - A MarketEvent object.
+        """
+        if isinstance(event, MarketEvent):
+            self.bar += 1
+            start = np.searchsorted(self._signal_bars, self.bar, side="left")
+            end = np.searchsorted(self._signal_bars, self.bar, side="right")
+            for i in range(start, end):
+                symbol = self.symbol_list[self._signal_symbols[i]]
+                bar_datetime = self.bars.get_latest_bar_datetime(symbol)
+                if pd.Timestamp(bar_datetime).value != self._signal_datetimes[i]:
+                    raise ValueError("The bars replayed differ from the ones of the journal %s (bar %d)."
+                                     % (self.journal_path, self.bar))
+                signal = SignalEvent(symbol, bar_datetime, SIGNAL_TYPES[self._signal_directions[i]],
+                                     float(self._signal_strengths[i]))
+                self.events.put(signal)
+
+    def get_state(self):
+        """
+        Returns the position of the replay (the signals are reloaded from the journal).
+        """
+        return {"bar": self.bar}
+
+
+def _write_header(journal_file, symbol_list):
+    """
+    Writes the header (magic, length, symbol list as JSON), padded to
+    8 bytes, and returns its size.
+    """
+    symbols = json.dumps(symbol_list).encode()
+    size = _HEADER_PREFIX.size + len(symbols)
+    padding = -size % 8
+    journal_file.write(_HEADER_PREFIX.pack(JOURNAL_MAGIC, len(symbols) + padding) + symbols + b" " * padding)
+    return size + padding
+
+
+def _read_header(path):
+    """
+    Returns the symbol list and the header size of a journal file.
+    """
+    with open(path, "rb") as journal_file:
+        magic, length = _HEADER_PREFIX.unpack(journal_file.read(_HEADER_PREFIX.size))
+        if magic != JOURNAL_MAGIC:
+            raise ValueError("%s is not an event journal." % path)
+        symbols = json.loads(journal_file.read(length).decode())
+    return symbols, _HEADER_PREFIX.size + length
+
+
+def read_journal(path):
+    """
+    Reads an event journal.
+
+    Returns:
+    symbol_list, records - The symbol list of the journal, and its records
+    as a read-only memory-mapped NumPy structured array (RECORD_DTYPE).
+    """
+    symbol_list, header_size = _read_header(path)
+    n_records = (os.path.getsize(path) - header_size) // RECORD_DTYPE.itemsize
+    if n_records == 0:
+        return symbol_list, np.zeros(0, dtype=RECORD_DTYPE)
+    return symbol_list, np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=header_size, shape=(n_records,))
+
+
+def journal_to_dataframe(path):
+    """
+    Reads an event journal into a DataFrame, with the datetimes,
+    symbols, kinds and directions decoded.
+    """
+    symbol_list, records = read_journal(path)
+    frame = pd.DataFrame(np.asarray(records))
+    frame["datetime"] = pd.to_datetime(frame["datetime"])
+    frame["symbol"] = np.asarray(symbol_list, dtype=object)[frame["symbol"].to_numpy()] \
+        if len(frame) else frame["symbol"]
+    frame["kind"] = frame["kind"].map({SIGNAL: "SIGNAL", ORDER: "ORDER", FILL: "FILL"})
+    return frame
@@ -1,22 +1,26 @@
 class Event(object):
     """
-    Event is base class providing an interface for all subsequent 
-    (inherited) events, that will trigger further events in the 
-    trading infrastructure.   
+    Event is base class providing an interface for all subsequent
+    (inherited) events, that will trigger further events in the
+    trading infrastructure.
+    The events declare __slots__, so they are compact objects without
+    an instance dictionary, and their type is a class attribute.
     """
-    pass
+    __slots__ = ()
 
 
 class MarketEvent(Event):
     """
     Handles the event of receiving a new market update with corresponding bars.
+    It holds no data (the bars are given by the data handler), so the
+    data handlers put the same MARKET_EVENT instance on every bar.
     """
+    __slots__ = ()
+    type = "MARKET"
 
-    def __init__(self):
-        """
-        Initialises the MarketEvent.
-        """
-        self.type = "MARKET"
+
+# Shared instance put on the events queue by the data handlers
+MARKET_EVENT = MarketEvent()
 
 
 class SignalEvent(Event):
@@ -29,9 +33,10 @@ class SignalEvent(Event):
     signal_type - The signal type ('LONG', 'SHORT', 'EXIT')
     strength - strength of the signal --> TODO: this should be given from a risk class when applying multiple strats
     """
+    __slots__ = ("symbol", "datetime", "signal_type", "strength")
+    type = "SIGNAL"
 
     def __init__(self, symbol, datetime, signal_type, strength):
-        self.type = "SIGNAL"
         self.symbol = symbol
         self.datetime = datetime
         self.signal_type = signal_type
@@ -48,21 +53,24 @@ class OrderEvent(Event):
     order_type - Whether is it a 'MARKET' or 'LIMIT' order
     quantity --> TODO: this should be implemented in a risk class (Kelly Criterion, etc)
     direction - 1 or -1 based on the type
+    datetime - A datetime at which the order is created (the one of its signal), if known.
     """
+    __slots__ = ("symbol", "order_type", "quantity", "direction", "datetime")
+    type = "ORDER"
 
-    def __init__(self, symbol, order_type, quantity, direction):
-        self.type = "ORDER"
+    def __init__(self, symbol, order_type, quantity, direction, datetime=None):
         self.symbol = symbol
         self.order_type = order_type
         self.quantity = quantity
         self.direction = direction
+        self.datetime = datetime
 
     def print_order(self):
         """
         Outputs the values within the Order.
         """
-        print("Order: Symbol=%s, Type=%s, Quantity=%s, Direction=%s") % \
-        (self.symbol, self.order_type, self.quantity, self.direction)
+        print("Order: Symbol=%s, Type=%s, Quantity=%s, Direction=%s"
+              % (self.symbol, self.order_type, self.quantity, self.direction))
 
 
 class FillEvent(Event):
@@ -78,10 +86,11 @@ class FillEvent(Event):
     fill_cost - can contain commission already
     commission - Defaulted to None if non specified
     """
+    __slots__ = ("datetime", "symbol", "exchange", "quantity", "direction", "fill_cost", "commission")
+    type = "FILL"
 
     def __init__(self, datetime, symbol, exchange, quantity, direction, fill_cost, commission=None):
 
-        self.type = "FILL"
         self.datetime = datetime
         self.symbol = symbol
         self.exchange = exchange
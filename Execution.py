@@ -1,7 +1,7 @@
+import asyncio
 from abc import ABCMeta, abstractmethod
 
 from Events import FillEvent, OrderEvent
-from datetime import datetime
 
 
 class ExecutionHandler(object):
@@ -50,6 +50,35 @@ class SimpleSimulatedExecutionHandler(ExecutionHandler):
         """
 
         if isinstance(event, OrderEvent):
-            fill_event = FillEvent(datetime.utcnow(), event.symbol, "FAKE_EXCHANGE", event.quantity, event.direction,
-                                   None)
+            # Filled at the time of the order (the datetime of the bar of its signal)
+            fill_event = FillEvent(event.datetime, event.symbol, "FAKE_EXCHANGE", event.quantity, event.direction, None)
             self.events.put(fill_event)
+
+
+class AsyncSimulatedExecutionHandler(SimpleSimulatedExecutionHandler):
+    """
+    Simulated broker for the paper trading of the LiveTradingLoop: the orders
+    are filled after a simulated round-trip latency, which is awaited without
+    blocking the loop (the next bars keep being processed meanwhile).
+    """
+
+    def __init__(self, events, latency=0.0):
+        """
+        Initialises the handler.
+
+        Parameters:
+        events - The Queue of Event objects.
+        latency - Delay in seconds between an order and its fill.
+        """
+        self.events = events
+        self.latency = latency
+
+    async def execute_order_async(self, event):
+        """
+        Waits for the latency of the broker, then adds the Fill event to the queue.
+
+        Parameters:
+        event - Contains an Event object with order information.
+        """
+        await asyncio.sleep(self.latency)
+        self.execute_order(event)
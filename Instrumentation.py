@@ -0,0 +1,130 @@
+from __future__ import print_function
+
+import json
+import math
+import time
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of the latencies of one stage of the backtest loop, with
+    log-spaced buckets (from 100ns to 100s, 20 buckets per decade), so that
+    the memory used does not grow with the number of calls. The percentiles
+    are given by the upper edge of their bucket (about 12% precision).
+    """
+
+    MIN_LATENCY = 1e-7
+    BUCKETS_PER_DECADE = 20
+    N_DECADES = 9
+
+    def __init__(self):
+        self.counts = [0] * (self.BUCKETS_PER_DECADE * self.N_DECADES + 1)
+        self.n_calls = 0
+        self.total_time = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency):
+        """
+        Adds the latency (in seconds) of one call.
+        """
+        self.n_calls += 1
+        self.total_time += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+        if latency <= self.MIN_LATENCY:
+            bucket = 0
+        else:
+            bucket = int(math.log10(latency / self.MIN_LATENCY) * self.BUCKETS_PER_DECADE) + 1
+        self.counts[min(bucket, len(self.counts) - 1)] += 1
+
+    def _bucket_upper_edge(self, bucket):
+        return self.MIN_LATENCY * 10 ** (float(bucket) / self.BUCKETS_PER_DECADE)
+
+    def percentile(self, q):
+        """
+        Returns the q-th percentile (0-100) of the latencies, in seconds.
+        """
+        if self.n_calls == 0:
+            return 0.0
+        rank = q / 100.0 * self.n_calls
+        cumulated = 0
+        for bucket, count in enumerate(self.counts):
+            cumulated += count
+            if count and cumulated >= rank:
+                return min(self._bucket_upper_edge(bucket), self.max_latency)
+        return self.max_latency
+
+    def summary(self):
+        """
+        Returns the statistics of the stage as a dictionary (times in seconds).
+        """
+        return {
+            "calls": self.n_calls,
+            "total_time": self.total_time,
+            "mean": self.total_time / self.n_calls if self.n_calls else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max_latency,
+        }
+
+
+class LoopProfiler(object):
+    """
+    Instrumentation of the hot path of the backtest loop. The functions of each
+    stage (update_bars, calculate_signals, update_timeindex, execute_order, etc.)
+    are wrapped to record their call count and latency histogram, and the whole
+    run is timed to give the bars/sec and events/sec throughput.
+    Nothing is wrapped when the instrumentation is disabled, so it costs nothing.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.start_time = None
+        self.elapsed = 0.0
+
+    def wrap(self, stage, func):
+        """
+        Returns a function calling func and recording its latency in the stage.
+        """
+        histogram = self.stages.setdefault(stage, LatencyHistogram())
+        clock = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.record(clock() - start)
+
+        return timed
+
+    def start(self):
+        self.start_time = time.perf_counter()
+
+    def stop(self):
+        self.elapsed += time.perf_counter() - self.start_time
+
+    def report(self, n_bars, n_events):
+        """
+        Returns the statistics of all the stages and the throughput.
+
+        Parameters:
+        n_bars - Number of market updates (bars) processed.
+        n_events - Number of events (market, signal, order, fill) handled.
+        """
+        return {
+            "elapsed": self.elapsed,
+            "bars": n_bars,
+            "events": n_events,
+            "bars_per_sec": n_bars / self.elapsed if self.elapsed else 0.0,
+            "events_per_sec": n_events / self.elapsed if self.elapsed else 0.0,
+            "stages": {stage: histogram.summary() for stage, histogram in self.stages.items()},
+        }
+
+    def export_json(self, path, n_bars, n_events):
+        """
+        Writes the report in a JSON file, to track the performance between runs.
+        """
+        with open(path, "w") as json_file:
+            json.dump(self.report(n_bars, n_events), json_file, indent=2, sort_keys=True)
@@ -0,0 +1,301 @@
+from __future__ import print_function
+
+import asyncio
+import json
+import os
+import pprint
+
+from DataCache import read_csv_columns
+from EventBus import EventBus
+from Events import FillEvent, MarketEvent, OrderEvent, SignalEvent
+from Instrumentation import LatencyHistogram
+
+
+class LiveTradingLoop(object):
+    """
+    asyncio-based loop for live and paper trading, using the same Strategy and
+    Portfolio classes as the Backtest. The bars are released at a heartbeat
+    scheduled on the monotonic clock of the event loop: each tick has a fixed
+    deadline (start + k * heartbeat), so the processing time does not shift the
+    schedule. The data source and the execution handler are awaited, so the
+    reception of the bars and the orders sent to the broker run while the
+    loop waits for the next tick. With a heartbeat of 0, the loop sleeps until
+    the data handler signals that bars have arrived, and releases them at once.
+    """
+
+    def __init__(self, address, symbol_list, initial_capital, heartbeat, start_date,
+                 data_handler, execution_handler, portfolio, strategy, strategy_params=None):
+        """
+        Initialises the live loop
+
+        Parameters:
+        address - (host, port) of the feed, given to the data handler.
+        symbol_list - The list of symbol strings.
+        initial_capital - The starting capital for the portfolio.
+        heartbeat - Period of the ticks in seconds (0 to process the bars as they arrive).
+        start_date - The start datetime of the portfolio.
+        data_handler - (Class) Receives the market data feed (e.g. TCPFeedDataHandler).
+        execution_handler - (Class) Handles the orders/fills, awaited if it implements
+                            execute_order_async (e.g. AsyncSimulatedExecutionHandler).
+        portfolio - (Class) Keeps track of portfolio current and prior positions.
+        strategy - (Class) Generates signals based on market data.
+        strategy_params - Dictionary of keyword arguments of the strategy (its defaults if None).
+        """
+        self.address = address
+        self.symbol_list = symbol_list
+        self.initial_capital = initial_capital
+        self.heartbeat = heartbeat
+        self.start_date = start_date
+
+        self.data_handler_cls = data_handler
+        self.execution_handler_cls = execution_handler
+        self.portfolio_cls = portfolio
+        self.strategy_cls = strategy
+        self.strategy_params = strategy_params if strategy_params is not None else {}
+
+        # The loop is single-threaded, the events need no lock
+        self.events = EventBus()
+        self.market_events = 0
+        self.signals = 0
+        self.orders = 0
+        self.fills = 0
+
+        self.ticks = 0
+        self.missed_deadlines = 0
+        self.lateness = LatencyHistogram()
+        self.processing = LatencyHistogram()
+        self._executions = set()
+
+        self._generate_trading_instances()
+
+    def _generate_trading_instances(self):
+        """
+        Generates the trading instance objects from
+        their class types.
+        """
+        print("Creating DataHandler, Strategy, Portfolio and ExecutionHandler")
+
+        self.data_handler = self.data_handler_cls.from_settings(self.events, self.address, self.symbol_list,
+                                                                None, self.start_date, None)
+        self.strategy = self.strategy_cls(self.data_handler, self.events, **self.strategy_params)
+        self.portfolio = self.portfolio_cls(self.data_handler, self.events, self.start_date, self.initial_capital)
+        self.execution_handler = self.execution_handler_cls(self.events)
+
+        self.events.subscribe(MarketEvent, self._count_market_event)
+        self.events.subscribe(MarketEvent, self.strategy.calculate_signals)
+        self.events.subscribe(MarketEvent, self.portfolio.update_timeindex)
+        self.events.subscribe(SignalEvent, self._count_signal)
+        self.events.subscribe(SignalEvent, self.portfolio.update_signal)
+        self.events.subscribe(OrderEvent, self._submit_order)
+        self.events.subscribe(FillEvent, self._count_fill)
+        self.events.subscribe(FillEvent, self.portfolio.update_fill)
+
+        lookbacks = [getattr(self.strategy, "max_lookback", None), getattr(self.portfolio, "max_lookback", None)]
+        if None not in lookbacks:
+            self.data_handler.set_max_lookback(max(lookbacks))
+
+    def _count_market_event(self, event):
+        self.market_events += 1
+
+    def _count_signal(self, event):
+        self.signals += 1
+
+    def _count_fill(self, event):
+        self.fills += 1
+
+    def _submit_order(self, event):
+        """
+        Sends an order to the execution handler. An asynchronous handler
+        runs in its own task, its fill being handled as soon as it arrives.
+        """
+        self.orders += 1
+        if hasattr(self.execution_handler, "execute_order_async"):
+            execution = asyncio.ensure_future(self._execute_order(event))
+            self._executions.add(execution)
+            execution.add_done_callback(self._executions.discard)
+        else:
+            self.execution_handler.execute_order(event)
+
+    async def _execute_order(self, event):
+        await self.execution_handler.execute_order_async(event)
+        self.events.dispatch()
+
+    def _process_tick(self):
+        """
+        Releases all the bars received since the previous tick, one
+        timestamp at a time, and handles the resulting events.
+        """
+        self.data_handler.update_bars()
+        self.events.dispatch()
+        while self.data_handler.bars_pending():
+            self.data_handler.update_bars()
+            self.events.dispatch()
+
+    async def run(self):
+        """
+        Runs the loop until the feed is closed and all its bars are processed.
+        A tick whose processing overruns the following deadlines skips them
+        (they are counted as missed) instead of running late ticks in a burst.
+        """
+        await self.data_handler.connect()
+        clock = asyncio.get_event_loop().time
+        start = clock()
+        tick = 0
+        try:
+            while self.data_handler.continue_backtest:
+                if self.heartbeat:
+                    deadline = start + tick * self.heartbeat
+                    # Yields to the other tasks (feed, executions) even when late
+                    await asyncio.sleep(max(0.0, deadline - clock()))
+                else:
+                    # Waits for the next bars instead of polling the feed
+                    await self.data_handler.wait_for_bars()
+                    deadline = clock()
+
+                woken = clock()
+                self.lateness.record(max(0.0, woken - deadline))
+                self._process_tick()
+                self.processing.record(clock() - woken)
+                self.ticks += 1
+
+                if self.heartbeat:
+                    due = int((clock() - start) / self.heartbeat)
+                    self.missed_deadlines += max(0, due - tick)
+                    tick = max(tick, due) + 1
+
+            # Waits for the fills of the last orders
+            if self._executions:
+                await asyncio.gather(*list(self._executions))
+            self.events.dispatch()
+        finally:
+            await self.data_handler.close()
+
+    def timing_report(self):
+        """
+        Returns the scheduling statistics of the loop: number of ticks and
+        missed deadlines, lateness of the wake-ups relative to their deadline,
+        and processing time of the ticks (times in seconds).
+        """
+        return {
+            "ticks": self.ticks,
+            "bars": self.market_events,
+            "missed_deadlines": self.missed_deadlines,
+            "lateness": self.lateness.summary(),
+            "processing": self.processing.summary(),
+        }
+
+    def _output_performance(self):
+        """
+        Outputs the strategy performance and the timing of the loop.
+        """
+        self.portfolio.create_equity_curve_dataframe()
+
+        print("Creating summary stats...")
+        stats = self.portfolio.output_summary_stats()
+
+        print("Creating equity curve...")
+        print(self.portfolio.equity_curve.tail(10))
+
+        pprint.pprint(stats)
+        print("Signals: %s" % self.signals)
+        print("Orders: %s" % self.orders)
+        print("Fills: %s" % self.fills)
+
+        report = self.timing_report()
+        print("Ticks: %s, Missed deadlines: %s" % (report["ticks"], report["missed_deadlines"]))
+        print("Lateness p50=%.1fus p99=%.1fus max=%.1fus"
+              % (report["lateness"]["p50"] * 1e6, report["lateness"]["p99"] * 1e6, report["lateness"]["max"] * 1e6))
+
+    def simulate_trading(self):
+        """
+        Runs the live loop and outputs portfolio performance.
+        """
+        asyncio.run(self.run())
+        self._output_performance()
+
+
+class ReplayFeedServer(object):
+    """
+    Local stand-in for a live feed, for the tests and paper trading: replays
+    the bars of CSV files (in the HistoricCSVDataHandler format) over TCP, in
+    the format of the TCPFeedDataHandler, one timestamp every period seconds
+    (on a fixed schedule). Each connection receives the whole replay.
+    """
+
+    BAR_COLUMNS = ["open", "high", "low", "close", "adj_close", "volume"]
+
+    def __init__(self, csv_dir, symbol_list, period=0.0, host="127.0.0.1", port=0, max_bars=None, dayfirst=True):
+        """
+        Parameters:
+        csv_dir - Absolute directory path to the CSV files.
+        symbol_list - A list of symbol strings.
+        period - Seconds between two timestamps sent.
+        host, port - Address of the server (port 0 picks a free port, see self.port once started).
+        max_bars - Number of timestamps replayed (all if None).
+        dayfirst - Whether the dates of the files are in the dd/mm/yyyy format.
+        """
+        self.period = period
+        self.host = host
+        self.port = port
+        self.messages = self._create_messages(csv_dir, symbol_list, dayfirst)[:max_bars]
+        self.server = None
+
+    def _create_messages(self, csv_dir, symbol_list, dayfirst):
+        """
+        Returns the JSON lines of the feed, one per timestamp.
+        """
+        bars = {}
+        for symbol in symbol_list:
+            index, columns = read_csv_columns(os.path.join(str(csv_dir), "%s.csv" % symbol),
+                                              ["datetime"] + self.BAR_COLUMNS, use_cache=False, dayfirst=dayfirst)
+            for i, timestamp in enumerate(index):
+                bars.setdefault(timestamp, {})[symbol] = {column: float(columns[column][i])
+                                                          for column in self.BAR_COLUMNS}
+        return [(json.dumps({"datetime": str(timestamp), "bars": bars[timestamp]}) + "\n").encode()
+                for timestamp in sorted(bars)]
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._replay, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def _replay(self, reader, writer):
+        clock = asyncio.get_event_loop().time
+        start = clock()
+        try:
+            for i, message in enumerate(self.messages):
+                await asyncio.sleep(max(0.0, start + i * self.period - clock()))
+                writer.write(message)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+if __name__ == "__main__":
+    # Paper trading on a replay of the sample data
+    from datetime import datetime
+    from pathlib import Path
+
+    from DataHandler import TCPFeedDataHandler
+    from Execution import AsyncSimulatedExecutionHandler
+    from Portfolio import Portfolio
+    from Strategies.MAC_Strat import MovingAverageCrossOverStrat
+
+    async def paper_trading(period, n_bars):
+        feed = ReplayFeedServer(Path(__file__).resolve().parent / 'DataDir', ['AAPL'], period=period,
+                                max_bars=n_bars)
+        await feed.start()
+        live = LiveTradingLoop((feed.host, feed.port), ['AAPL'], 100000.0, period, datetime(1990, 1, 1),
+                               TCPFeedDataHandler, AsyncSimulatedExecutionHandler, Portfolio,
+                               MovingAverageCrossOverStrat, {"short_window": 10, "long_window": 50})
+        try:
+            await live.run()
+        finally:
+            await feed.close()
+        return live
+
+    live = asyncio.run(paper_trading(0.002, 1000))
+    live._output_performance()
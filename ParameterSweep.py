@@ -0,0 +1,222 @@
+from __future__ import print_function
+
+import contextlib
+import itertools
+import multiprocessing
+import os
+
+import pandas as pd
+
+from BacktesterLoop import Backtest
+from DataHandler import ColumnarDataHandler
+from Performance import create_summary_stats, periods_per_year
+
+# Settings and preloaded bars of the sweep, set in each worker process
+# (inherited when the workers are forked, else given to their initializer)
+_worker_settings = None
+_worker_bars = None
+
+
+class _SharedBars(object):
+    """
+    Used as the data handler class of the backtests of a sweep: instead of
+    loading the data, it gives each backtest a copy of the preloaded handler
+    sharing its bar arrays (restricted to a date range if given).
+    """
+
+    def __init__(self, handler, start_date=None, end_date=None):
+        self.handler = handler
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def from_settings(self, events, data_dir, symbol_list, interval, start_date, end_date):
+        return self.handler.copy_for_events(events, self.start_date, self.end_date)
+
+
+def _init_worker(settings, bars):
+    global _worker_settings, _worker_bars
+    _worker_settings = settings
+    _worker_bars = bars
+
+
+def worker_state():
+    """
+    Returns the settings and the preloaded bars (None if the data handler
+    loads its own data) of the sweep, in a worker process.
+    """
+    return _worker_settings, _worker_bars
+
+
+def summary_stats(equity_curve, periods=252):
+    """
+    Returns the summary statistics of an equity curve as numbers, for
+    the results table (Portfolio.output_summary_stats formats them).
+    """
+    return create_summary_stats(equity_curve["returns"], periods)
+
+
+def run_shared_backtest(settings, bars, params, start_date=None, end_date=None):
+    """
+    Runs a backtest silently on the preloaded bars, and returns it with
+    its equity curve created.
+
+    Parameters:
+    settings - Dictionary of the arguments of the Backtest (see parameter_sweep).
+    bars - The preloaded ColumnarDataHandler, or None to let the data handler load the data.
+    params - Dictionary of keyword arguments of the strategy.
+    start_date - If given, the backtest trades from this date, the previous bars being
+                 only available to warm up the strategy (preloaded bars only).
+    end_date - If given, the bars from this date (excluded) are not used (preloaded bars only).
+    """
+    if bars is not None:
+        data_handler = _SharedBars(bars, start_date, end_date)
+    else:
+        data_handler = settings["data_handler"]
+
+    # The event bus gives the same results as the queue, without printing every bar
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        backtest = Backtest(settings["data_dir"], settings["symbol_list"], settings["initial_capital"], 0.0,
+                            start_date if start_date is not None else settings["start_date"],
+                            end_date if end_date is not None else settings["end_date"], settings["interval"],
+                            data_handler, settings["execution_handler"], settings["portfolio"],
+                            settings["strategy"], event_bus=True, strategy_params=params,
+                            stop_condition=settings.get("stop_condition"))
+        backtest._run_backtest()
+        backtest.portfolio.create_equity_curve_dataframe()
+    return backtest
+
+
+def _run_combination(task):
+    """
+    Runs the backtest of one combination of parameters in a worker,
+    returning its position in the grid, its parameters and its statistics.
+    """
+    position, params = task
+    settings, bars = worker_state()
+    backtest = run_shared_backtest(settings, bars, params)
+
+    stats = summary_stats(backtest.portfolio.equity_curve, periods_per_year(settings["interval"]))
+    stats.update(signals=backtest.signals, orders=backtest.orders, fills=backtest.fills,
+                 stopped_early=backtest.stopped_early)
+    return position, params, stats
+
+
+def map_with_shared_data(func, tasks, settings, bars, processes=None, chunksize=None):
+    """
+    Maps a function over the tasks on a pool of processes, returning the results
+    in no particular order. In the workers, the settings and the preloaded bars
+    are given by worker_state(): they are inherited when the workers are forked
+    (the memory of the bars being shared, copy-on-write), else they are sent
+    once to each worker, not with every task.
+
+    Parameters:
+    func - Module-level function taking one task.
+    tasks - List of the tasks (picklable).
+    settings, bars - Shared by all the tasks, see run_shared_backtest.
+    processes - Number of worker processes (all the cores if None).
+    chunksize - Number of tasks sent at once to a worker (chosen from the number of tasks if None).
+    """
+    processes = min(processes or os.cpu_count() or 1, len(tasks))
+    if chunksize is None:
+        # A few chunks per worker, to balance the load without too much overhead
+        chunksize = max(1, len(tasks) // (processes * 4))
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        _init_worker(settings, bars)
+        try:
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                return list(pool.imap_unordered(func, tasks, chunksize))
+        finally:
+            _init_worker(None, None)
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(settings, bars)) as pool:
+        return list(pool.imap_unordered(func, tasks, chunksize))
+
+
+def preload_bars(data_handler, data_dir, symbol_list, interval, start_date, end_date):
+    """
+    Loads the market data once for all the backtests, if the data handler has
+    a known history (ColumnarDataHandler), else returns None.
+    """
+    if issubclass(data_handler, ColumnarDataHandler):
+        return data_handler.from_settings(None, data_dir, symbol_list, interval, start_date, end_date)
+    return None
+
+
+def expand_grid(param_grid):
+    """
+    Returns the list of parameter dictionaries of a grid.
+
+    Parameters:
+    param_grid - Dictionary of parameter name: list of values (all the
+                 combinations are run), or list of parameter dictionaries.
+    """
+    if isinstance(param_grid, dict):
+        names = sorted(param_grid)
+        return [dict(zip(names, values)) for values in itertools.product(*[param_grid[name] for name in names])]
+    return [dict(params) for params in param_grid]
+
+
+def parameter_sweep(data_dir, symbol_list, initial_capital, start_date, end_date, interval,
+                    data_handler, execution_handler, portfolio, strategy, param_grid,
+                    processes=None, chunksize=None, stop_condition=None):
+    """
+    Runs one backtest per combination of strategy parameters across a pool of
+    processes, and collects their summary statistics into one results table.
+
+    The market data is loaded once by the parent process (for the handlers with
+    a known history, i.e. ColumnarDataHandler) and shared with the workers, see
+    map_with_shared_data. Other handlers load their data in each backtest.
+
+    Parameters:
+    data_dir, symbol_list, initial_capital, start_date, end_date, interval,
+    data_handler, execution_handler, portfolio, strategy - As for Backtest.
+    param_grid - Parameters of the strategy, see expand_grid.
+    processes - Number of worker processes (all the cores if None).
+    chunksize - Number of backtests sent at once to a worker (chosen from the size of the grid if None).
+    stop_condition - Early termination rule of the backtests (picklable, e.g. MaxDrawdownStop(0.2)),
+                     see Backtest. The statistics of a stopped backtest cover the bars run.
+
+    Returns:
+    A DataFrame with one row per combination, in the order of the grid: the
+    parameters, then the total return, Sharpe ratio, max drawdown and its
+    duration, the number of signals, orders and fills, and whether the
+    backtest was stopped early.
+    """
+    combinations = expand_grid(param_grid)
+    if not combinations:
+        raise ValueError("The parameter grid is empty.")
+
+    settings = {"data_dir": data_dir, "symbol_list": symbol_list, "initial_capital": initial_capital,
+                "start_date": start_date, "end_date": end_date, "interval": interval,
+                "data_handler": data_handler, "execution_handler": execution_handler,
+                "portfolio": portfolio, "strategy": strategy, "stop_condition": stop_condition}
+    bars = preload_bars(data_handler, data_dir, symbol_list, interval, start_date, end_date)
+    results = map_with_shared_data(_run_combination, list(enumerate(combinations)), settings, bars,
+                                   processes, chunksize)
+
+    results.sort(key=lambda result: result[0])
+    rows = [dict(params, **stats) for _, params, stats in results]
+    return pd.DataFrame(rows, columns=list(rows[0].keys()))
+
+
+if __name__ == "__main__":
+    import time
+    from datetime import datetime
+    from pathlib import Path
+
+    from DataHandler import HistoricCSVDataHandler
+    from Execution import SimpleSimulatedExecutionHandler
+    from Portfolio import Portfolio
+    from Strategies.MAC_Strat import MovingAverageCrossOverStrat
+
+    data_dir = Path(__file__).resolve().parent / 'DataDir'
+    grid = [{"short_window": short_window, "long_window": long_window}
+            for short_window, long_window in itertools.product([5, 10, 20, 50], [30, 100, 200, 400])
+            if short_window < long_window]
+
+    start = time.perf_counter()
+    results = parameter_sweep(data_dir, ['AAPL'], 100000.0, datetime(1990, 1, 1), datetime(2021, 1, 1), '1d',
+                              HistoricCSVDataHandler, SimpleSimulatedExecutionHandler, Portfolio,
+                              MovingAverageCrossOverStrat, grid)
+    print(results.sort_values("sharpe_ratio", ascending=False).to_string(index=False))
+    print("%d backtests in %.2fs" % (len(results), time.perf_counter() - start))
@@ -1,41 +1,389 @@
 from __future__ import print_function
+import re
+
 import numpy as np
 import pandas as pd
 
+# Performance measures of one equity curve, or of a batch of curves (e.g. the ones of a
+# parameter sweep) given as the columns of a DataFrame or 2D array: the measures are
+# computed along the time axis (axis 0), without Python loops over the bars. The
+# measures take the period returns (NaN returns, such as the first one, are ignored),
+# except create_drawdowns which takes the equity curve.
+
+# Trading periods per year of the units of the intervals ("1d", "1h", "5m", "1wk", etc.)
+PERIODS_PER_YEAR = {"m": 252 * 6.5 * 60, "h": 252 * 6.5, "d": 252, "wk": 52, "mo": 12}
+
+
+def periods_per_year(interval, default=252):
+    """
+    Returns the number of bars per year of a bar interval, to annualise the measures:
+    252 for "1d", 252*6.5 for "1h", 252*6.5*12 for "5m", 52 for "1wk", etc.
+
+    Parameters:
+    interval - The bar interval (as given to the Backtest), default is returned if None.
+    """
+    if interval is None:
+        return default
+    match = re.match(r"^(\d+)(m|h|d|wk|mo)$", str(interval).strip())
+    if match is None:
+        raise ValueError("Unknown bar interval: %s" % interval)
+    return PERIODS_PER_YEAR[match.group(2)] / int(match.group(1))
+
+
+def _as_2d(data):
+    """
+    Returns the values of a Series, DataFrame or array as a 2D (time x curves) float array.
+    """
+    values = np.asarray(data, dtype=np.float64)
+    return values.reshape(len(values), -1) if values.ndim == 1 else values
+
+
+def _wrap(result, data):
+    """
+    Returns a result computed on _as_2d(data) in the type of the data: the (curves,)
+    reductions as a float (one curve) or a Series/array (batch), and the (time x curves)
+    series as a Series, DataFrame or array with the index and columns of the data.
+    """
+    if result.ndim == 1:
+        if isinstance(data, pd.DataFrame):
+            return pd.Series(result, index=data.columns)
+        return result if np.ndim(data) == 2 else result[0]
+    if isinstance(data, pd.Series):
+        return pd.Series(result[:, 0], index=data.index, name=data.name)
+    if isinstance(data, pd.DataFrame):
+        return pd.DataFrame(result, index=data.index, columns=data.columns)
+    return result if np.ndim(data) == 2 else result[:, 0]
+
+
+def create_equity_curve(returns):
+    """
+    Compounds the period returns into an equity curve starting at 1.0 (NaN returns
+    being no change), e.g. the equity_curve column of the backtests.
+
+    Parameters:
+    returns - A pandas Series representing period percentage returns (or a batch).
+    """
+    return _wrap(np.cumprod(1.0 + np.nan_to_num(_as_2d(returns)), axis=0), returns)
+
+
+def create_total_return(returns):
+    """
+    Total return of the period returns.
+    """
+    return _wrap(np.prod(1.0 + np.nan_to_num(_as_2d(returns)), axis=0) - 1.0, returns)
+
+
+def create_annualised_return(returns, periods=252):
+    """
+    Compound annual growth rate of the period returns.
+
+    Parameters:
+    returns - A pandas Series representing period percentage returns (or a batch).
+    periods - Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc., see periods_per_year.
+    """
+    values = _as_2d(returns)
+    growth = np.prod(1.0 + np.nan_to_num(values), axis=0)
+    n_returns = np.sum(~np.isnan(values), axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return _wrap(np.where(n_returns > 0, growth ** (periods / np.maximum(n_returns, 1)) - 1.0, np.nan), returns)
+
+
+def create_annualised_volatility(returns, periods=252):
+    """
+    Annualised standard deviation of the period returns.
+    """
+    return _wrap(np.sqrt(periods) * np.nanstd(_as_2d(returns), axis=0), returns)
+
 
 def create_sharpe_ratio(returns, periods=252):
     """
     Create the Sharpe ratio for the strategy, based on a
     benchmark of zero (i.e. no risk-free rate information).
     Parameters:
-    returns - A pandas Series representing period percentage returns.
+    returns - A pandas Series representing period percentage returns (or a batch).
     periods - Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc.
     """
+    values = _as_2d(returns)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # NaN without volatility (e.g. no trade)
+        return _wrap(np.sqrt(periods) * np.nanmean(values, axis=0) / np.nanstd(values, axis=0), returns)
 
-    return np.sqrt(periods) * (np.mean(returns)) / np.std(returns)
+
+def create_sortino_ratio(returns, periods=252, target=0.0):
+    """
+    Create the Sortino ratio for the strategy: as the Sharpe ratio, but only
+    the returns below the target count as risk (downside deviation).
+    Parameters:
+    returns - A pandas Series representing period percentage returns (or a batch).
+    periods - Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc.
+    target - The minimum acceptable return per period.
+    """
+    values = _as_2d(returns)
+    downside = np.minimum(values - target, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        downside_deviation = np.sqrt(np.nanmean(downside ** 2, axis=0))
+        return _wrap(np.sqrt(periods) * (np.nanmean(values, axis=0) - target) / downside_deviation, returns)
+
+
+def _drawdowns(curve):
+    """
+    Drawdowns (relative to the high-water mark) and their durations in bars,
+    of a 2D (time x curves) array of equity curves.
+    """
+    # The NaN values (e.g. before the first return) are ignored by fmax
+    high_water_mark = np.fmax.accumulate(curve, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        drawdown = 1.0 - curve / high_water_mark
+
+    # Number of bars since the last high-water mark: count of the bars in drawdown,
+    # minus this count at the latest bar out of drawdown
+    in_drawdown = drawdown > 0
+    count = np.cumsum(in_drawdown, axis=0)
+    duration = count - np.maximum.accumulate(np.where(in_drawdown, 0, count), axis=0)
+    return drawdown, duration
 
 
 def create_drawdowns(equity_curve):
     """
     Calculate the largest peak-to-trough drawdown of the equity curve
-    as well as the duration of the drawdown. Requires that the
-    equity_returns is a pandas Series.
+    as well as the duration of the drawdown. The drawdowns are relative
+    to the high-water mark (0.1 for 10% below the peak).
 
     Parameters:
-    equity_curve - A pandas Series representing period percentage returns.
+    equity_curve - A pandas Series representing the equity curve (or a batch).
     Returns:
-    drawdown, duration - Highest peak-to-trough drawdown and duration.
-    """
-
-    # Calculate the cumulative returns curve and set up the High Water Mark
-    high_water_mark = [0]
-    # Create the drawdown and duration series
-    idx = equity_curve.index
-    drawdown = pd.Series(index=idx)
-    duration = pd.Series(index=idx)
-    # Loop over the index range
-    for i in range(1, len(idx)):
-        high_water_mark.append(max(high_water_mark[i - 1], equity_curve[i]))
-        drawdown[i] = high_water_mark[i] - equity_curve[i]
-        duration[i] = 0 if drawdown[i] == 0 else duration[i - 1] + 1
-    return drawdown, drawdown.max(), duration.max()
+    drawdown, max_drawdown, duration - The drawdown series, the highest peak-to-trough
+    drawdown and the longest duration in bars.
+    """
+    drawdown, duration = _drawdowns(_as_2d(equity_curve))
+    with np.errstate(invalid="ignore"):
+        max_drawdown = np.fmax.reduce(drawdown, axis=0)
+    return _wrap(drawdown, equity_curve), _wrap(max_drawdown, equity_curve), _wrap(duration.max(axis=0), equity_curve)
+
+
+def create_calmar_ratio(returns, periods=252):
+    """
+    Create the Calmar ratio for the strategy: annualised return over maximum drawdown.
+    Parameters:
+    returns - A pandas Series representing period percentage returns (or a batch).
+    periods - Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc.
+    """
+    values = _as_2d(returns)
+    drawdown, _ = _drawdowns(np.cumprod(1.0 + np.nan_to_num(values), axis=0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return _wrap(create_annualised_return(values, periods) / np.fmax.reduce(drawdown, axis=0), returns)
+
+
+def create_rolling_stats(returns, window, periods=252):
+    """
+    Rolling-window measures of the period returns, each one having the shape of the returns
+    (NaN until a window is full): the return, annualised volatility, Sharpe ratio and Sortino
+    ratio over the window, and the drawdown from the highest equity of the window.
+
+    Parameters:
+    returns - A pandas Series representing period percentage returns (or a batch).
+    window - Number of bars of the windows.
+    periods - Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc.
+    Returns:
+    A dictionary of measure name: rolling values.
+    """
+    values = pd.DataFrame(_as_2d(returns))
+    rolling = values.rolling(window, min_periods=window)
+    mean = rolling.mean()
+    std = rolling.std(ddof=0)
+    downside_deviation = np.sqrt((values.clip(upper=0.0) ** 2).rolling(window, min_periods=window).mean())
+    curve = (1.0 + values.fillna(0.0)).cumprod()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stats = {
+            "return": np.expm1(np.log1p(values).rolling(window, min_periods=window).sum()),
+            "volatility": np.sqrt(periods) * std,
+            "sharpe_ratio": np.sqrt(periods) * mean / std,
+            "sortino_ratio": np.sqrt(periods) * mean / downside_deviation,
+            "drawdown": 1.0 - curve / curve.rolling(window, min_periods=window).max(),
+        }
+    return {name: _wrap(stat.to_numpy(), returns) for name, stat in stats.items()}
+
+
+def create_summary_stats(returns, periods=252):
+    """
+    Summary statistics of the period returns of a backtest.
+
+    Parameters:
+    returns - A pandas Series representing period percentage returns, or a
+              batch of them (DataFrame or 2D array, one curve per column).
+    periods - Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc., see periods_per_year.
+    Returns:
+    A dictionary of the statistics (total return, annualised return and volatility,
+    Sharpe, Sortino and Calmar ratios, max drawdown and its duration), or for a
+    batch a DataFrame with one row per curve.
+    """
+    values = _as_2d(returns)
+    drawdown, duration = _drawdowns(np.cumprod(1.0 + np.nan_to_num(values), axis=0))
+    max_drawdown = np.fmax.reduce(drawdown, axis=0)
+    annualised_return = create_annualised_return(values, periods)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        calmar_ratio = annualised_return / max_drawdown
+
+    stats = {"total_return": create_total_return(values),
+             "annualised_return": annualised_return,
+             "volatility": create_annualised_volatility(values, periods),
+             "sharpe_ratio": create_sharpe_ratio(values, periods),
+             "sortino_ratio": create_sortino_ratio(values, periods),
+             "calmar_ratio": calmar_ratio,
+             "max_drawdown": max_drawdown,
+             "max_drawdown_duration": duration.max(axis=0)}
+    if np.ndim(returns) == 2:
+        index = returns.columns if isinstance(returns, pd.DataFrame) else None
+        return pd.DataFrame(stats, index=index)
+    return {name: value[0] for name, value in stats.items()}
+
+
+def format_summary_stats(stats):
+    """
+    Formats the summary statistics of one backtest (create_summary_stats)
+    as the list of (name, value) pairs printed by the backtests.
+    """
+    return [("Total Return", "%0.2f%%" % (stats["total_return"] * 100.0)),
+            ("Annualised Return", "%0.2f%%" % (stats["annualised_return"] * 100.0)),
+            ("Sharpe Ratio", "%0.2f" % stats["sharpe_ratio"]),
+            ("Sortino Ratio", "%0.2f" % stats["sortino_ratio"]),
+            ("Calmar Ratio", "%0.2f" % stats["calmar_ratio"]),
+            ("Max Drawdown", "%0.2f%%" % (stats["max_drawdown"] * 100.0)),
+            ("Max Drawdown Duration", "%d" % stats["max_drawdown_duration"])]
+
+
+class RunningPerformance(object):
+    """
+    Performance statistics of a portfolio updated incrementally on each bar, in
+    constant time, so that they can be queried while the backtest runs (e.g. to
+    stop a bad run early): Welford's running mean and variance of the returns for
+    the Sharpe ratio, the high-water mark and drawdowns (relative to the high-water
+    mark), the exposure (gross market value over total equity) and the turnover.
+    """
+
+    def __init__(self, initial_capital, periods=252):
+        """
+        Parameters:
+        initial_capital - The starting capital of the portfolio.
+        periods - Number of bars per year, to annualise the Sharpe ratio.
+        """
+        self.initial_capital = initial_capital
+        self.periods = periods
+        self.n_bars = 0
+        self.total = initial_capital
+
+        # Welford's algorithm on the returns
+        self.n_returns = 0
+        self.mean_return = 0.0
+        self.m2_returns = 0.0
+
+        self.high_water_mark = initial_capital
+        self.drawdown = 0.0
+        self.max_drawdown = 0.0
+        self.drawdown_duration = 0
+        self.max_drawdown_duration = 0
+
+        self.exposure = 0.0
+        self.sum_exposure = 0.0
+        self.traded_value = 0.0
+        self.sum_total = 0.0
+
+    def update(self, total, gross_exposure):
+        """
+        Updates the statistics with the valuation of the portfolio at a new bar.
+
+        Parameters:
+        total - Total equity of the portfolio.
+        gross_exposure - Sum of the absolute market values of the positions.
+        """
+        if np.isnan(total):
+            # Not valued (missing prices), the bar is skipped
+            return
+        self.n_bars += 1
+
+        if self.total:
+            ret = total / self.total - 1.0
+            self.n_returns += 1
+            delta = ret - self.mean_return
+            self.mean_return += delta / self.n_returns
+            self.m2_returns += delta * (ret - self.mean_return)
+        self.total = total
+        self.sum_total += total
+
+        if total >= self.high_water_mark:
+            self.high_water_mark = total
+            self.drawdown = 0.0
+            self.drawdown_duration = 0
+        else:
+            self.drawdown = 1.0 - total / self.high_water_mark
+            self.drawdown_duration += 1
+            self.max_drawdown = max(self.max_drawdown, self.drawdown)
+            self.max_drawdown_duration = max(self.max_drawdown_duration, self.drawdown_duration)
+
+        self.exposure = gross_exposure / total if total else 0.0
+        self.sum_exposure += self.exposure
+
+    def add_traded_value(self, traded_value):
+        """
+        Adds the absolute value of a fill to the turnover.
+        """
+        self.traded_value += traded_value
+
+    @property
+    def volatility(self):
+        """
+        Standard deviation of the returns (population, as np.std).
+        """
+        return np.sqrt(self.m2_returns / self.n_returns) if self.n_returns else np.nan
+
+    @property
+    def sharpe_ratio(self):
+        """
+        Annualised Sharpe ratio of the returns so far, as create_sharpe_ratio.
+        """
+        volatility = self.volatility
+        if not volatility:
+            return np.nan
+        return np.sqrt(self.periods) * self.mean_return / volatility
+
+    @property
+    def total_return(self):
+        return self.total / self.initial_capital - 1.0
+
+    @property
+    def average_exposure(self):
+        return self.sum_exposure / self.n_bars if self.n_bars else 0.0
+
+    @property
+    def turnover(self):
+        """
+        Value traded so far, relative to the average equity.
+        """
+        return self.traded_value * self.n_bars / self.sum_total if self.sum_total else 0.0
+
+    def summary(self):
+        """
+        Returns the current statistics as a dictionary.
+        """
+        return {"bars": self.n_bars, "total_return": self.total_return, "sharpe_ratio": self.sharpe_ratio,
+                "drawdown": self.drawdown, "max_drawdown": self.max_drawdown,
+                "drawdown_duration": self.drawdown_duration, "max_drawdown_duration": self.max_drawdown_duration,
+                "exposure": self.exposure, "average_exposure": self.average_exposure, "turnover": self.turnover}
+
+
+class MaxDrawdownStop(object):
+    """
+    Early termination rule of a backtest (see Backtest stop_condition): stops
+    once the maximum drawdown of the portfolio exceeds a limit.
+    """
+
+    def __init__(self, limit):
+        """
+        Parameters:
+        limit - Maximum drawdown allowed, as a fraction of the high-water mark (e.g. 0.2).
+        """
+        self.limit = limit
+
+    def __call__(self, performance):
+        return performance.max_drawdown > self.limit
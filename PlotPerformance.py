@@ -1,9 +1,19 @@
+import os
+import sys
+
 import matplotlib.pyplot as plt
 import pandas as pd
 
-# Function to plot performance from equity curve saved in csv format
+from EquityWriter import read_equity_curve
+
+# Function to plot performance from equity curve saved in csv format, or in the
+# directory of Parquet chunks of a StreamingPortfolio (python PlotPerformance.py equity.parquet)
 if __name__ == "__main__":
-    data = pd.io.parsers.read_csv("equity.csv", header=0, parse_dates=True, index_col=0)
+    path = sys.argv[1] if len(sys.argv) > 1 else "equity.csv"
+    if os.path.isdir(path):
+        data = read_equity_curve(path)
+    else:
+        data = pd.io.parsers.read_csv(path, header=0, parse_dates=True, index_col=0)
     # Plot three charts: Equity curve,
     # period returns, drawdowns
     fig, (ax1, ax2, ax3) = plt.subplots(nrows=3, sharex=True)
@@ -9,8 +9,10 @@ except ImportError:
 
 import numpy as np
 import pandas as pd
+from EquityWriter import EquityWriter, read_equity_curve
 from Events import FillEvent, OrderEvent, SignalEvent
-from Performance import create_sharpe_ratio, create_drawdowns
+from Performance import RunningPerformance, create_drawdowns, create_equity_curve, create_summary_stats, \
+    format_summary_stats
 from math import floor
 
 
@@ -29,11 +31,17 @@ class Portfolio(object):
         self.symbol_list = self.bars.symbol_list
         self.start_date = start_date
         self.initial_capital = initial_capital
+        self.max_lookback = 1  # only the latest prices are used for the valuation
 
         self.all_positions = self.define_all_positions()
         self.current_positions = {symbol: 0 for symbol in self.symbol_list}
+        # Positions in the order of symbol_list, updated by the fills, to value the book at each bar
+        self.current_quantities = np.zeros(len(self.symbol_list))
+        self.symbol_positions = {symbol: j for j, symbol in enumerate(self.symbol_list)}
         self.all_holdings = self.define_all_holdings()
         self.current_holdings = self.define_current_holdings()
+        # Statistics updated on each bar, which can be queried during the backtest
+        self.performance = RunningPerformance(initial_capital)
 
     def define_all_positions(self):
         """
@@ -89,25 +97,25 @@ class Portfolio(object):
         # Append the current positions
         self.all_positions.append(positions)
 
+        # Update market value and pnl for all symbols
+        # ==============
+        # Approximation to the real value --> market_value = adj close price * position_size
+        # TODO --> This needs to be better represented in real life, depending on the frequency of the strategy
+        prices = self.bars.get_latest_cross_section("adj_close")
+        market_values = self.current_quantities * prices
+
         # Update holdings
         # ===============
-        holdings = {symbol: 0.0 for symbol in self.symbol_list}
+        holdings = dict(zip(self.symbol_list, market_values.tolist()))
         holdings["datetime"] = latest_datetime
         holdings["cash"] = self.current_holdings["cash"]
         holdings["commission"] = self.current_holdings["commission"]
-        holdings["total"] = self.current_holdings["cash"]
-
-        # Update market value and pnl for all symbols
-        # ==============
-        for symbol in self.symbol_list:
-            # Approximation to the real value --> market_value = adj close price * position_size
-            # TODO --> This needs to be better represented in real life, depending on the frequency of the strategy
-            market_value = self.current_positions[symbol] * self.bars.get_latest_bar_value(symbol, "adj_close")
-            holdings[symbol] = market_value
-            holdings["total"] += market_value
+        # The symbols with no price yet (starting later) hold no position
+        holdings["total"] = self.current_holdings["cash"] + np.nansum(market_values)
 
         # Append the current holdings
         self.all_holdings.append(holdings)
+        self.performance.update(holdings["total"], np.nansum(np.abs(market_values)))
 
     """
     Check if a SignalEvent has been generated from the strategy to place an Order event in the queue
@@ -143,13 +151,13 @@ class Portfolio(object):
         order_type = "MKT"
 
         if direction == "LONG" and current_quantity == 0:
-            order = OrderEvent(symbol, order_type, mkt_quantity, "BUY")
+            order = OrderEvent(symbol, order_type, mkt_quantity, "BUY", signal.datetime)
         if direction == "SHORT" and current_quantity == 0:
-            order = OrderEvent(symbol, order_type, mkt_quantity, "SELL")
+            order = OrderEvent(symbol, order_type, mkt_quantity, "SELL", signal.datetime)
         if direction == "EXIT" and current_quantity > 0:
-            order = OrderEvent(symbol, order_type, abs(current_quantity), "SELL")
+            order = OrderEvent(symbol, order_type, abs(current_quantity), "SELL", signal.datetime)
         if direction == "EXIT" and current_quantity < 0:
-            order = OrderEvent(symbol, order_type, abs(current_quantity), "BUY")
+            order = OrderEvent(symbol, order_type, abs(current_quantity), "BUY", signal.datetime)
         return order
 
     """
@@ -180,6 +188,7 @@ class Portfolio(object):
             fill_dir = -1
         # Update positions list with new quantities
         self.current_positions[fill.symbol] += fill_dir * fill.quantity
+        self.current_quantities[self.symbol_positions[fill.symbol]] = self.current_positions[fill.symbol]
 
     def update_holdings_after_fill(self, fill):
         """
@@ -202,6 +211,21 @@ class Portfolio(object):
         self.current_holdings["commission"] += fill.commission
         self.current_holdings["cash"] -= (cost + fill.commission)
         self.current_holdings["total"] -= (cost + fill.commission)
+        self.performance.add_traded_value(abs(cost))
+
+    def get_state(self):
+        """
+        Returns the state of the portfolio (current positions and holdings,
+        and their history so far) to be saved in a checkpoint.
+        """
+        return {name: value for name, value in vars(self).items()
+                if name not in ("bars", "events") and not callable(value)}
+
+    def set_state(self, state):
+        """
+        Restores the state of the portfolio from a checkpoint.
+        """
+        self.__dict__.update(state)
 
     def create_equity_curve_dataframe(self):
         """
@@ -214,20 +238,361 @@ class Portfolio(object):
         equity_curve["equity_curve"] = (1.0 + equity_curve["returns"]).cumprod()
         self.equity_curve = equity_curve
 
-    def output_summary_stats(self):
+    def output_summary_stats(self, equity_path="equity.csv", periods=252):
         """
-        Creates a list of summary statistics for the portfolio.
+        Creates a list of summary statistics for the portfolio,
+        and saves the equity curve in a CSV file.
+
+        Parameters:
+        equity_path - Path of the CSV file.
+        periods - Number of bars per year, to annualise the statistics (see Performance.periods_per_year).
         """
-        total_return = self.equity_curve["equity_curve"][-1]
         returns = self.equity_curve["returns"]
-        pnl = self.equity_curve["equity_curve"]
-        sharpe_ratio = create_sharpe_ratio(returns, periods=252)
-        drawdown, max_dd, max_dd_duration = create_drawdowns(pnl)
-        self.equity_curve["drawdown"] = drawdown
-
-        stats = [("Total Return", "%0.2f%%" % ((total_return - 1.0) * 100.0)),
-                 ("Sharpe Ratio", "%0.2f" % sharpe_ratio),
-                 ("Max Drawdown", "%0.2f%%" % (max_dd * 100.0)),
-                 ("Max Drawdown Duration", "%d" % max_dd_duration)]
-        self.equity_curve.to_csv("equity.csv")
-        return stats
+        stats = create_summary_stats(returns, periods)
+        self.equity_curve["drawdown"] = create_drawdowns(create_equity_curve(returns))[0]
+        self.equity_curve.to_csv(equity_path)
+        return format_summary_stats(stats)
+
+
+class ArrayPortfolio(Portfolio):
+    """
+    Portfolio keeping the history of the positions and holdings in preallocated
+    2D (bars x symbols) NumPy arrays instead of lists of dictionaries, for wide
+    universes and long runs. The arrays grow geometrically when full, and the
+    equity curve DataFrame wraps the holdings array without copying it. The
+    orders and fills are handled as in the Portfolio.
+    """
+
+    # Capacity of the arrays when the number of bars is unknown (e.g. streaming data)
+    DEFAULT_CAPACITY = 1024
+
+    def __init__(self, bars, events, start_date, initial_capital=100000.0, capacity=None):
+        """
+        Parameters:
+        bars - The DataHandler object that provides bar information
+        events - The Event Queue object.
+        start_date - The start datetime of the portfolio.
+        initial_capital - The starting capital for the portfolio.
+        capacity - Number of bars preallocated (by default the number of bars left in the
+                   data handler when known, else DEFAULT_CAPACITY). The arrays grow if needed.
+        """
+        self.bars = bars
+        self.events = events
+        self.symbol_list = self.bars.symbol_list
+        self.start_date = start_date
+        self.initial_capital = initial_capital
+        self.max_lookback = 1
+
+        n_symbols = len(self.symbol_list)
+        if capacity is None:
+            capacity = self.DEFAULT_CAPACITY
+            if hasattr(self.bars, "bar_datetimes"):
+                # Initial row, the bars left, and the final MarketEvent of the data handler
+                capacity = len(self.bars.bar_datetimes) - self.bars.bar_cursor + 2
+        self.holdings_columns = list(self.symbol_list) + ["cash", "commission", "total"]
+        self.position_history = np.zeros((capacity, n_symbols))
+        # Market value of each symbol, then the cash, commission and total columns
+        self.holdings_history = np.zeros((capacity, n_symbols + 3))
+        self.datetime_history = np.empty(capacity, dtype=object)
+        self.n_bars = 0
+
+        self.current_positions = {symbol: 0 for symbol in self.symbol_list}
+        self.current_quantities = np.zeros(n_symbols)
+        self.symbol_positions = {symbol: j for j, symbol in enumerate(self.symbol_list)}
+        self.current_holdings = self.define_current_holdings()
+        self.performance = RunningPerformance(initial_capital)
+        self._append_row(self.start_date, np.zeros(n_symbols))
+
+    def _grow(self):
+        """
+        Doubles the capacity of the history arrays.
+        """
+        capacity = 2 * len(self.datetime_history)
+        for name in ("position_history", "holdings_history", "datetime_history"):
+            history = getattr(self, name)
+            grown = np.zeros((capacity,) + history.shape[1:], dtype=history.dtype)
+            grown[:self.n_bars] = history[:self.n_bars]
+            setattr(self, name, grown)
+
+    def _append_row(self, dt, market_values):
+        """
+        Appends the current positions and holdings to the history arrays.
+        """
+        if self.n_bars == len(self.datetime_history):
+            self._grow()
+        i = self.n_bars
+        n_symbols = len(self.symbol_list)
+        self.position_history[i] = self.current_quantities
+        row = self.holdings_history[i]
+        row[:n_symbols] = market_values
+        row[n_symbols] = self.current_holdings["cash"]
+        row[n_symbols + 1] = self.current_holdings["commission"]
+        row[n_symbols + 2] = self.current_holdings["cash"] + np.nansum(market_values)
+        self.datetime_history[i] = dt
+        self.n_bars += 1
+
+    def update_timeindex(self, event):
+        """
+        Appends a row to the positions and holdings arrays for the current
+        market data bar, valuing the positions at the latest adjusted close.
+        """
+        latest_datetime = self.bars.get_latest_bar_datetime(self.symbol_list[0])
+        prices = self.bars.get_latest_cross_section("adj_close")
+        market_values = self.current_quantities * prices
+        self._append_row(latest_datetime, market_values)
+        self.performance.update(self.holdings_history[self.n_bars - 1, -1], np.nansum(np.abs(market_values)))
+
+    def create_positions_dataframe(self):
+        """
+        Returns the history of the positions as a DataFrame (a view of the positions array).
+        """
+        index = pd.Index(self.datetime_history[:self.n_bars], name="datetime")
+        return pd.DataFrame(self.position_history[:self.n_bars], index=index, columns=self.symbol_list,
+                            copy=False)
+
+    def create_equity_curve_dataframe(self):
+        """
+        Creates the equity curve DataFrame, its holdings columns being
+        a view of the holdings array.
+        """
+        index = pd.Index(self.datetime_history[:self.n_bars], name="datetime")
+        equity_curve = pd.DataFrame(self.holdings_history[:self.n_bars], index=index,
+                                    columns=self.holdings_columns, copy=False)
+        equity_curve["returns"] = equity_curve["total"].pct_change()
+        equity_curve["equity_curve"] = (1.0 + equity_curve["returns"]).cumprod()
+        self.equity_curve = equity_curve
+
+
+class SparsePortfolio(Portfolio):
+    """
+    Portfolio for wide universes with a small book: only the symbols with an open
+    position are marked to market on each bar, so the cost of a bar depends on the
+    number of open positions rather than on the size of the universe. The history
+    is stored sparsely, as the position changes of the fills and the market values
+    of the open positions, and the dense (bars x symbols) history is rebuilt on
+    demand. The symbols without a position are valued at 0, even when their
+    price is missing.
+    """
+
+    def __init__(self, bars, events, start_date, initial_capital=100000.0):
+        Portfolio.__init__(self, bars, events, start_date, initial_capital)
+        # Quantity of the symbols with an open position
+        self.open_positions = {}
+
+        # One entry per bar (the first one at start_date)
+        self.datetime_history = [self.start_date]
+        self.cash_history = [self.initial_capital]
+        self.commission_history = [0.0]
+        self.total_history = [self.initial_capital]
+        # Position changes: (first bar with the new position, symbol index, quantity change)
+        self.position_changes = []
+        # Market values of the open positions: (bar, symbol index, market value)
+        self.market_value_entries = []
+
+    def define_all_positions(self):
+        """
+        The position history is kept as position changes.
+        """
+        return None
+
+    def define_all_holdings(self):
+        """
+        The holdings history is kept as market values of the open positions.
+        """
+        return None
+
+    def update_timeindex(self, event):
+        """
+        Marks the open positions to market at the latest adjusted close,
+        and records the holdings of the current market data bar.
+        """
+        bar = len(self.datetime_history)
+        market_value = 0.0
+        gross_exposure = 0.0
+        for symbol, quantity in self.open_positions.items():
+            value = quantity * self.bars.get_latest_bar_value(symbol, "adj_close")
+            self.market_value_entries.append((bar, self.symbol_positions[symbol], value))
+            market_value += value
+            gross_exposure += abs(value)
+
+        self.datetime_history.append(self.bars.get_latest_bar_datetime(self.symbol_list[0]))
+        self.cash_history.append(self.current_holdings["cash"])
+        self.commission_history.append(self.current_holdings["commission"])
+        self.total_history.append(self.current_holdings["cash"] + market_value)
+        self.performance.update(self.total_history[-1], gross_exposure)
+
+    def update_positions_after_fill(self, fill):
+        """
+        Takes a Fill object, updates the current positions and the set of
+        open positions, and records the position change.
+
+        Parameters:
+        fill - The Fill object to update the positions with.
+        """
+        previous_quantity = self.current_positions[fill.symbol]
+        Portfolio.update_positions_after_fill(self, fill)
+        quantity = self.current_positions[fill.symbol]
+
+        if quantity != 0:
+            self.open_positions[fill.symbol] = quantity
+        else:
+            self.open_positions.pop(fill.symbol, None)
+        # The new position is recorded from the next bar
+        self.position_changes.append((len(self.datetime_history), self.symbol_positions[fill.symbol],
+                                      quantity - previous_quantity))
+
+    def rebuild_history(self):
+        """
+        Rebuilds the dense history from the sparse one.
+
+        Returns:
+        positions, market_values - (bars x symbols) arrays of the positions
+        and market values recorded at each bar.
+        """
+        n_bars = len(self.datetime_history)
+        shape = (n_bars, len(self.symbol_list))
+
+        changes = np.zeros(shape)
+        if self.position_changes:
+            bars, symbols, quantities = (np.asarray(values) for values in zip(*self.position_changes))
+            recorded = bars < n_bars
+            np.add.at(changes, (bars[recorded], symbols[recorded]), quantities[recorded])
+        positions = np.cumsum(changes, axis=0)
+
+        market_values = np.zeros(shape)
+        if self.market_value_entries:
+            bars, symbols, values = (np.asarray(values) for values in zip(*self.market_value_entries))
+            market_values[bars, symbols] = values
+        return positions, market_values
+
+    def create_positions_dataframe(self):
+        """
+        Returns the dense history of the positions as a DataFrame.
+        """
+        positions, _ = self.rebuild_history()
+        index = pd.Index(self.datetime_history, name="datetime")
+        return pd.DataFrame(positions, index=index, columns=self.symbol_list)
+
+    def create_equity_curve_dataframe(self):
+        """
+        Creates the equity curve DataFrame from the dense history of the holdings.
+        """
+        _, market_values = self.rebuild_history()
+        index = pd.Index(self.datetime_history, name="datetime")
+        equity_curve = pd.DataFrame(market_values, index=index, columns=self.symbol_list)
+        equity_curve["cash"] = self.cash_history
+        equity_curve["commission"] = self.commission_history
+        equity_curve["total"] = self.total_history
+        equity_curve["returns"] = equity_curve["total"].pct_change()
+        equity_curve["equity_curve"] = (1.0 + equity_curve["returns"]).cumprod()
+        self.equity_curve = equity_curve
+
+
+class StreamingPortfolio(ArrayPortfolio):
+    """
+    Portfolio writing its holdings history in chunks while the backtest runs, for
+    long (e.g. intraday) runs: once chunk_size bars are recorded, they are handed
+    to a background EquityWriter, which appends them to a directory of Parquet
+    files, and only the latest tail_size bars are kept in the arrays. The equity
+    curve is read back from the files (read_equity_curve), without the columns
+    of the symbols unless requested. The positions of the latest bars only are
+    kept (create_positions_dataframe).
+    """
+
+    CHUNK_SIZE = 10000
+    TAIL_SIZE = 1000
+
+    def __init__(self, bars, events, start_date, initial_capital=100000.0, equity_path="equity.parquet",
+                 chunk_size=None, tail_size=None):
+        """
+        Parameters:
+        bars - The DataHandler object that provides bar information
+        events - The Event Queue object.
+        start_date - The start datetime of the portfolio.
+        initial_capital - The starting capital for the portfolio.
+        equity_path - Directory of the Parquet files of the holdings history.
+        chunk_size - Number of bars written at once (CHUNK_SIZE by default).
+        tail_size - Number of the latest bars kept in memory (TAIL_SIZE by default).
+        """
+        self.equity_path = equity_path
+        self.chunk_size = chunk_size if chunk_size is not None else self.CHUNK_SIZE
+        self.tail_size = tail_size if tail_size is not None else self.TAIL_SIZE
+        # Number of rows at the start of the arrays already written (the tail of the previous chunk)
+        self.n_written = 0
+        self.n_chunks = 0
+        self._writer = None
+        ArrayPortfolio.__init__(self, bars, events, start_date, initial_capital,
+                                capacity=self.chunk_size + self.tail_size)
+
+    def _get_writer(self):
+        """
+        Starts the writer on the first chunk, so that the output directory can
+        still be changed after the portfolio is created.
+        """
+        if self._writer is None:
+            self._writer = EquityWriter(self.equity_path, self.n_chunks)
+        return self._writer
+
+    def _write_pending_rows(self):
+        """
+        Hands the rows not written yet to the writer.
+        """
+        if self.n_bars > self.n_written:
+            self._get_writer().write(self.datetime_history[self.n_written:self.n_bars],
+                                     self.holdings_history[self.n_written:self.n_bars], self.holdings_columns)
+            self.n_chunks += 1
+            self.n_written = self.n_bars
+
+    def _grow(self):
+        """
+        Makes room in the full arrays by writing the pending rows,
+        then moving the tail to the start of the arrays.
+        """
+        self._write_pending_rows()
+        start = self.n_bars - self.tail_size
+        for history in (self.position_history, self.holdings_history, self.datetime_history):
+            history[:self.tail_size] = history[start:self.n_bars]
+        self.n_bars = self.n_written = self.tail_size
+
+    def finish_output(self):
+        """
+        Writes the remaining rows and waits for the writer to finish.
+        """
+        self._write_pending_rows()
+        self._get_writer().close()
+        self._writer = None
+
+    def get_state(self):
+        """
+        Returns the state of the portfolio once the chunks handed to the writer
+        are written (the files of the later chunks are removed when resuming).
+        """
+        if self._writer is not None:
+            self._writer.wait()
+        state = ArrayPortfolio.get_state(self)
+        state.pop("_writer", None)
+        return state
+
+    def set_state(self, state):
+        """
+        Restores the state of the portfolio from a checkpoint.
+        """
+        ArrayPortfolio.set_state(self, state)
+        self._writer = None
+
+    def create_equity_curve_dataframe(self, columns=("cash", "commission", "total")):
+        """
+        Completes the output files and reads the equity curve back from them.
+
+        Parameters:
+        columns - The holdings columns read, None for all of them (including the symbols).
+        """
+        self.finish_output()
+        self.equity_curve = read_equity_curve(self.equity_path, columns)
+
+    def output_summary_stats(self, equity_path=None, periods=252):
+        """
+        Creates a list of summary statistics for the portfolio, the
+        history being already saved in the directory of equity_path.
+        """
+        return format_summary_stats(create_summary_stats(self.equity_curve["returns"], periods))
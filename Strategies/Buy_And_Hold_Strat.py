@@ -2,7 +2,7 @@ from Strategy import Strategy
 from Events import MarketEvent
 from Events import SignalEvent
 
-import datetime
+import numpy as np
 
 
 class BuyAndHoldStrat(Strategy):
@@ -25,6 +25,7 @@ class BuyAndHoldStrat(Strategy):
         self.bars = bars
         self.symbol_list = self.bars.symbol_list
         self.events = events
+        self.max_lookback = 1
 
         # Once buy & hold signal is given, these are set to True
         self.bought = self._calculate_initial_bought()
@@ -48,15 +49,17 @@ class BuyAndHoldStrat(Strategy):
         event - A MarketEvent object. 
         """
         strength = 1.0
-        if isinstance(event, MarketEvent):
-            for symbol in self.symbol_list:
-                bars = self.bars.get_latest_bar(symbol)
-                if bars is not None and bars != []:
-
-                    dt = datetime.datetime.utcnow()
-
-                    if not self.bought[symbol]:
-                        # (Symbol, Datetime, Type = LONG, SHORT or EXIT, Signal strength)
-                        signal = SignalEvent(symbol, dt, "LONG", strength)
-                        self.events.put(signal)
-                        self.bought[symbol] = True
+        # Nothing to do once all the symbols are bought
+        if isinstance(event, MarketEvent) and not all(self.bought.values()):
+            # Symbols with a price in the latest cross-section of the universe
+            prices = self.bars.get_latest_cross_section("adj_close")
+            for j in np.flatnonzero(~np.isnan(prices)):
+                symbol = self.symbol_list[j]
+
+                dt = self.bars.get_latest_bar_datetime(symbol)
+
+                if not self.bought[symbol]:
+                    # (Symbol, Datetime, Type = LONG, SHORT or EXIT, Signal strength)
+                    signal = SignalEvent(symbol, dt, "LONG", strength)
+                    self.events.put(signal)
+                    self.bought[symbol] = True
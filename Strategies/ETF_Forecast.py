@@ -16,29 +16,29 @@ class ETFDailyForecastStrategy(Strategy):
     prediction.
     """
 
-    def __init__(self, bars, events):
+    def __init__(self, bars, events, train_start_date=datetime(2016, 1, 1), train_end_date=datetime(2020, 1, 1)):
         """
-        Initialises the buy and hold strategy.
+        Initialises the forecast strategy.
 
         Parameters:
         bars - The DataHandler object that provides bar information
         events - The Event Queue object.
+        train_start_date - Start of the training period of the model.
+        train_end_date - End (excluded) of the training period of the model, i.e. the start of
+                         the out-of-sample period. The walk-forward engine sets both for each window.
         """
         self.bars = bars
         self.symbol_list = self.bars.symbol_list
         self.events = events
 
-        # FIXME --> Here the models are fit on the training dataset only, especially here with the
-        # regime change in 1st quarter 2020
-        self.datetime_now = datetime.utcnow()
-        self.model_start_date = datetime(2016, 1, 1, 0, 0, 0)
-        self.model_end_date = datetime(2021, 1, 1, 0, 0, 0)
-        self.model_start_test_date = datetime(2020, 1, 1, 0, 0, 0)
+        self.model_start_date = train_start_date
+        self.model_end_date = train_end_date
         self.model_interval = '1d'
 
         self.long_market = False
         self.short_market = False
         self.bar_index = 0
+        self.max_lookback = 3  # returns of the current and two previous bars
 
         self.model = self.create_symbol_forecast_model()
 
@@ -48,23 +48,18 @@ class ETFDailyForecastStrategy(Strategy):
     """
 
     def create_symbol_forecast_model(self):
-        # Create a lagged series of the S&P500 US stock market index
+        # Create a lagged series of the S&P500 US stock market index, on the training period only.
+        # The downloader of the data handler (if any) serves it from its cache when the training
+        # period is within the backtest range (e.g. 2016-2020 for a 2016-2021 backtest)
         df_ret = create_lagged_series(self.symbol_list[0], self.model_start_date,
-                                      self.model_end_date, self.model_interval, lags=5)
+                                      self.model_end_date, self.model_interval, lags=5,
+                                      downloader=getattr(self.bars, "downloader", None))
 
         # Use the prior two days of returns as predictor
         # values, with direction as the response
-        X = df_ret[["Lag1", "Lag2"]]
-        Y = df_ret["Direction"]
-
-        # Create training and test sets
-        start_test = self.model_start_test_date
-        X_train = X[X.index < start_test]
-        X_train = X[X.index > X.index[2]]  # avoid 2 nan values TODO --> filter one is timestamp other datetime index
-        X_test = X[X.index >= start_test]
-        Y_train = Y[Y.index < start_test]
-        Y_train = Y[Y.index > Y.index[2]]
-        Y_test = Y[Y.index >= start_test]
+        df_ret = df_ret.dropna(subset=["Lag1", "Lag2"])
+        X_train = df_ret[["Lag1", "Lag2"]]
+        Y_train = df_ret["Direction"]
 
         """
         Here we choose QDA, but the strategy would be dependent on different parameters.
@@ -72,7 +67,7 @@ class ETFDailyForecastStrategy(Strategy):
         and also grid searching for parameters optimization
         """
         model = QDA()
-        model.fit(X_train, Y_train)  # TODO --> The model could be fit on the whole dataset, this is on model validation
+        model.fit(X_train, Y_train)
         return model
 
     def calculate_signals(self, event):
@@ -80,9 +75,9 @@ class ETFDailyForecastStrategy(Strategy):
         Calculate the SignalEvents based on market data.
         """
         symbol = self.symbol_list[0]
-        dt = self.datetime_now
 
         if isinstance(event, MarketEvent):
+            dt = self.bars.get_latest_bar_datetime(symbol)
             self.bar_index += 1
 
             # make sure we wait 5 days to get the latest "bar" values
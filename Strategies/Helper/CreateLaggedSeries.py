@@ -1,9 +1,10 @@
-import yfinance as yf
 import pandas as pd
 import numpy as np
 
+from DataCache import get_default_downloader
 
-def create_lagged_series(symbol, start_date, end_date, interval, lags=5):
+
+def create_lagged_series(symbol, start_date, end_date, interval, lags=5, downloader=None):
     """
     This creates a Pandas DataFrame that stores the
     percentage returns of the adjusted closing value of
@@ -11,9 +12,14 @@ def create_lagged_series(symbol, start_date, end_date, interval, lags=5):
     number of lagged returns from the prior trading days
     (lags defaults to 5 days). Trading volume, as well as
     the Direction from the previous day, are also included.
+    The data is obtained through the YahooDownloader (the shared one
+    by default), so a series already used by the data handler is
+    served from the cache.
     """
     # Obtain stock information from Yahoo Finance
-    df_data = yf.download(tickers=[symbol], start=start_date, end=end_date, interval=interval)
+    if downloader is None:
+        downloader = get_default_downloader()
+    df_data = downloader.download([symbol], start_date, end_date, interval)[symbol]
 
     # Create the new lagged DataFrame
     df_lag = pd.DataFrame(index=df_data.index)
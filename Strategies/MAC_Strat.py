@@ -2,8 +2,8 @@ from Strategy import Strategy
 from Events import MarketEvent
 from Events import SignalEvent
 
-import datetime
 import numpy as np
+import pandas as pd
 
 
 class MovingAverageCrossOverStrat(Strategy):
@@ -28,6 +28,7 @@ class MovingAverageCrossOverStrat(Strategy):
         self.events = events
         self.short_window = short_window
         self.long_window = long_window
+        self.max_lookback = long_window
 
         # Set to True if a symbol is in the market
         self.bought = self._calculate_initial_bought()
@@ -59,7 +60,8 @@ class MovingAverageCrossOverStrat(Strategy):
                     short_sma = np.mean(bars[-self.short_window:])
                     long_sma = np.mean(bars[-self.long_window:])
 
-                    dt = datetime.datetime.utcnow()
+                    # The signals are stamped with the bar, so the runs are reproducible
+                    dt = bar_datetime
                     strength = 1.0
 
                     if short_sma > long_sma and self.bought[symbol] == "OUT":
@@ -75,3 +77,37 @@ class MovingAverageCrossOverStrat(Strategy):
                         signal = SignalEvent(symbol, dt, signal_type, strength)
                         self.events.put(signal)
                         self.bought[symbol] = "OUT"
+
+    def _trailing_means(self, prices, window):
+        """
+        Means of the last window prices (or less at the start) at each bar,
+        NaN when a NaN is in the window (as np.mean in calculate_signals).
+        """
+        n_bars = np.arange(1, len(prices) + 1)[:, None]
+        sums = np.cumsum(np.nan_to_num(prices), axis=0)
+        nans = np.cumsum(np.isnan(prices), axis=0)
+        sums[window:] = sums[window:] - sums[:-window]
+        nans[window:] = nans[window:] - nans[:-window]
+        means = sums / np.minimum(n_bars, window)
+        means[nans > 0] = np.nan
+        return means
+
+    def calculate_signal_arrays(self, bars):
+        """
+        Generates the LONG and EXIT signals of the whole history at once,
+        following the same state (OUT/LONG) as calculate_signals.
+        """
+        prices = bars.get_history_values("adj_close")
+        short_sma = self._trailing_means(prices, self.short_window)
+        long_sma = self._trailing_means(prices, self.long_window)
+
+        # Last strict crossing direction (1 short above long, -1 below), starting OUT
+        crossing = np.where(short_sma > long_sma, 1.0, np.where(short_sma < long_sma, -1.0, np.nan))
+        crossing[0][np.isnan(crossing[0])] = -1.0
+        state = pd.DataFrame(crossing).ffill().values
+        previous_state = np.vstack([np.full((1, state.shape[1]), -1.0), state[:-1]])
+
+        signals = np.full(state.shape, np.nan)
+        signals[(state == 1) & (previous_state == -1)] = 1.0
+        signals[(state == -1) & (previous_state == 1)] = 0.0
+        return signals, np.ones(state.shape)
@@ -1,7 +1,5 @@
 from __future__ import print_function
 
-import datetime
-
 import statsmodels.api as sm
 
 from Events import SignalEvent, MarketEvent
@@ -30,10 +28,10 @@ class OLSMRStrategy(Strategy):
         self.symbol_list = self.bars.symbol_list
         self.events = events
         self.ols_window = ols_window
+        self.max_lookback = ols_window
         self.zscore_low = zscore_low
         self.zscore_high = zscore_high
         self.pair = tuple(self.symbol_list)
-        self.datetime = datetime.datetime.utcnow()
         self.long_market = False
         self.short_market = False
 
@@ -48,7 +46,7 @@ class OLSMRStrategy(Strategy):
         x_signal = None
         p0 = self.pair[0]
         p1 = self.pair[1]
-        dt = self.datetime
+        dt = self.bars.get_latest_bar_datetime(p0)
         hr = abs(self.hedge_ratio)
 
         # If we’re long the market and below the
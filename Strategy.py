@@ -10,9 +10,37 @@ class Strategy(object):
 
     __metaclass__ = ABCMeta
 
+    # Largest number of bars requested from the data handler at once,
+    # None if unknown (the data handler then keeps its default lookback)
+    max_lookback = None
+
     @abstractmethod
     def calculate_signals(self):
         """
         Provides the mechanisms to calculate the list of signals.
         """
         raise NotImplementedError("Should implement calculate_signals()")
+
+    def calculate_signal_arrays(self, bars):
+        """
+        Vectorized counterpart of calculate_signals, used by the VectorizedBacktest.
+        From the whole history of the data handler, returns two (time x symbol)
+        arrays: the signal directions (1 for LONG, -1 for SHORT, 0 for EXIT and
+        NaN for no signal) generated at each bar, and the signal strengths.
+        """
+        raise NotImplementedError("Should implement calculate_signal_arrays()")
+
+    def get_state(self):
+        """
+        Returns the state of the strategy (bought flags, counters, fitted models,
+        etc.) to be saved in a checkpoint: its attributes, except the data
+        handler, the events queue and the (instrumented) methods.
+        """
+        return {name: value for name, value in vars(self).items()
+                if name not in ("bars", "events") and not callable(value)}
+
+    def set_state(self, state):
+        """
+        Restores the state of the strategy from a checkpoint.
+        """
+        self.__dict__.update(state)
@@ -0,0 +1,204 @@
+from __future__ import print_function
+
+import contextlib
+import os
+import pprint
+from math import floor
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import numpy as np
+import pandas as pd
+
+from Events import FillEvent
+from Performance import create_drawdowns, create_equity_curve, create_summary_stats, format_summary_stats, \
+    periods_per_year
+
+
+class VectorizedBacktest(object):
+    """
+    Backtest engine for parameter research, without the bar-by-bar event
+    semantics. The strategy computes its signals for the whole history at once
+    (calculate_signal_arrays), then the positions, holdings, commissions and the
+    equity curve are computed with NumPy array operations, following the rules
+    of the event-driven loop: orders sized as Portfolio.generate_naive_order,
+    commissions of the FillEvent, fills at the adjusted close of the signal bar,
+    and holdings of a bar recorded before its fills.
+    """
+
+    def __init__(self, data_dir, symbol_list, initial_capital,
+                 start_date, end_date, interval,
+                 data_handler, strategy, strategy_params=None):
+        """
+        Initialises the vectorized backtest
+
+        Parameters:
+        data_dir - The hard root to the CSV data directory.
+        symbol_list - The list of symbol strings.
+        initial_capital - The starting capital for the portfolio.
+        start_date - The start datetime of the strategy.
+        end_date - The end datetime of the strategy
+        interval - Interval for the data
+        data_handler - (Class) Handles the market data feed, with the whole history (ColumnarDataHandler).
+        strategy - (Class) Generates signals based on market data, implementing calculate_signal_arrays.
+        strategy_params - Dictionary of keyword arguments of the strategy.
+        """
+        self.data_dir = data_dir
+        self.symbol_list = symbol_list
+        self.initial_capital = initial_capital
+        self.start_date = start_date
+        self.end_date = end_date
+        self.interval = interval
+        self.strategy_params = strategy_params if strategy_params is not None else {}
+
+        # The components put nothing on the queue, it is only needed by their constructors
+        events = queue.Queue()
+        self.data_handler = data_handler.from_settings(events, data_dir, symbol_list, interval,
+                                                       start_date, end_date)
+        self.strategy = strategy(self.data_handler, events, **self.strategy_params)
+        self.equity_curve = None
+
+    def _generate_fills(self, signals, strengths):
+        """
+        Runs the order logic of Portfolio.generate_naive_order on the signals only
+        (they are sparse), returning the (time x symbol) array of signed quantities
+        filled at each bar and the commissions paid at each bar.
+        """
+        fills = np.zeros(signals.shape)
+        commissions = np.zeros(signals.shape[0])
+        current_quantities = np.zeros(signals.shape[1])
+
+        for t, j in zip(*np.nonzero(~np.isnan(signals))):
+            direction = signals[t, j]
+            current_quantity = current_quantities[j]
+            quantity = 0
+            if direction == 1 and current_quantity == 0:
+                quantity = floor(100 * strengths[t, j])
+            elif direction == -1 and current_quantity == 0:
+                quantity = -floor(100 * strengths[t, j])
+            elif direction == 0 and current_quantity != 0:
+                quantity = -current_quantity
+            if quantity == 0:
+                continue
+
+            fill = FillEvent(None, self.symbol_list[j], "VECTORIZED", abs(quantity),
+                             "BUY" if quantity > 0 else "SELL", None)
+            fills[t, j] += quantity
+            commissions[t] += fill.commission
+            current_quantities[j] += quantity
+        return fills, commissions
+
+    def run(self):
+        """
+        Computes the equity curve, with the same rows and columns as the one of
+        Portfolio.create_equity_curve_dataframe: the starting row, one row per bar,
+        and the last bar repeated after its fills (the final MarketEvent of the loop).
+        """
+        prices = np.asarray(self.data_handler.get_history_values("adj_close"))
+        signals, strengths = self.strategy.calculate_signal_arrays(self.data_handler)
+        fills, commissions = self._generate_fills(signals, strengths)
+
+        # Positions and cash after the fills of each bar
+        positions_after = np.cumsum(fills, axis=0)
+        fill_costs = np.nansum(fills * prices, axis=1)
+        cash_after = self.initial_capital - np.cumsum(fill_costs + commissions)
+        commission_after = np.cumsum(commissions)
+
+        # The holdings of a bar are recorded before its fills, i.e. with the state after
+        # the previous bar, and the last bar is repeated with the state after its fills
+        n_symbols = len(self.symbol_list)
+        positions = np.vstack([np.zeros((1, n_symbols)), positions_after])
+        market_values = positions * np.vstack([prices, prices[-1:]])
+        cash = np.concatenate([[self.initial_capital], cash_after])
+        commission = np.concatenate([[0.0], commission_after])
+
+        # Starting row of the portfolio, before the first bar
+        market_values = np.vstack([np.zeros((1, n_symbols)), market_values])
+        cash = np.concatenate([[self.initial_capital], cash])
+        commission = np.concatenate([[0.0], commission])
+
+        datetimes = [self.start_date] + self.data_handler.bar_datetimes + self.data_handler.bar_datetimes[-1:]
+        equity_curve = pd.DataFrame(market_values, columns=self.symbol_list,
+                                    index=pd.Index(datetimes, name="datetime"))
+        equity_curve["cash"] = cash
+        equity_curve["commission"] = commission
+        equity_curve["total"] = cash + np.nansum(market_values, axis=1)
+        equity_curve["returns"] = equity_curve["total"].pct_change()
+        equity_curve["equity_curve"] = (1.0 + equity_curve["returns"]).cumprod()
+        self.equity_curve = equity_curve
+        return equity_curve
+
+    def output_summary_stats(self):
+        """
+        Creates a list of summary statistics, as Portfolio.output_summary_stats.
+        """
+        returns = self.equity_curve["returns"]
+        stats = create_summary_stats(returns, periods_per_year(self.interval))
+        self.equity_curve["drawdown"] = create_drawdowns(create_equity_curve(returns))[0]
+        return format_summary_stats(stats)
+
+
+def check_parity(backtest, vectorized_backtest, rtol=1e-9, atol=1e-6):
+    """
+    Parity test of the vectorized engine: compares its equity curve with the
+    one of an event-driven Backtest on the same data, strategy and capital.
+    The event-driven backtest is run (silently) if it has not been run yet.
+
+    Returns:
+    parity, max_difference - Whether the holdings, cash, commissions and totals
+    of both curves match, and the largest absolute difference between them.
+    """
+    if not hasattr(backtest.portfolio, "equity_curve"):
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            backtest._run_backtest()
+            backtest.portfolio.create_equity_curve_dataframe()
+    if vectorized_backtest.equity_curve is None:
+        vectorized_backtest.run()
+
+    columns = list(backtest.symbol_list) + ["cash", "commission", "total"]
+    event_values = backtest.portfolio.equity_curve[columns].values.astype(np.float64)
+    vectorized_values = vectorized_backtest.equity_curve[columns].values
+    if event_values.shape != vectorized_values.shape:
+        return False, np.inf
+
+    differences = np.abs(np.nan_to_num(event_values) - np.nan_to_num(vectorized_values))
+    same_nans = np.array_equal(np.isnan(event_values), np.isnan(vectorized_values))
+    parity = same_nans and np.allclose(np.nan_to_num(event_values), np.nan_to_num(vectorized_values),
+                                       rtol=rtol, atol=atol)
+    return parity, differences.max() if differences.size else 0.0
+
+
+if __name__ == "__main__":
+    # Parity test mode on the sample data
+    import time
+    from datetime import datetime
+    from pathlib import Path
+
+    from BacktesterLoop import Backtest
+    from DataHandler import HistoricCSVDataHandler
+    from Execution import SimpleSimulatedExecutionHandler
+    from Portfolio import Portfolio
+    from Strategies.MAC_Strat import MovingAverageCrossOverStrat
+
+    data_dir = Path(__file__).resolve().parent / 'DataDir'
+    settings = (data_dir, ['AAPL'], 100000.0)
+    start_date, end_date, interval = datetime(1990, 1, 1), datetime(2021, 1, 1), '1d'
+
+    for params in [{}, {"short_window": 20, "long_window": 50}, {"short_window": 5, "long_window": 30}]:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            backtest = Backtest(*settings + (0.0, start_date, end_date, interval, HistoricCSVDataHandler,
+                                             SimpleSimulatedExecutionHandler, Portfolio,
+                                             MovingAverageCrossOverStrat), strategy_params=params)
+        start = time.perf_counter()
+        vectorized = VectorizedBacktest(*settings + (start_date, end_date, interval, HistoricCSVDataHandler,
+                                                     MovingAverageCrossOverStrat), strategy_params=params)
+        vectorized.run()
+        elapsed = time.perf_counter() - start
+
+        parity, max_difference = check_parity(backtest, vectorized)
+        print("MAC %s: parity=%s (max difference %.2e), vectorized run in %.3fs"
+              % (params, parity, max_difference, elapsed))
+        pprint.pprint(vectorized.output_summary_stats())
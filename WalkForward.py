@@ -0,0 +1,185 @@
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+
+from ParameterSweep import expand_grid, map_with_shared_data, preload_bars, run_shared_backtest, summary_stats, \
+    worker_state
+from Performance import create_drawdowns, create_summary_stats, format_summary_stats, periods_per_year
+
+
+def walk_forward_windows(start_date, end_date, train_length, test_length, anchored=False):
+    """
+    Splits the backtest date range into successive train/test windows, the test
+    periods following each other without overlap up to the end date.
+
+    Parameters:
+    start_date - The start datetime of the first training period.
+    end_date - The end datetime of the last test period.
+    train_length - Length of the (first) training period, e.g. pd.DateOffset(years=2).
+    test_length - Length of each test period, by which the windows move forward.
+    anchored - If True, all the training periods start at the start date (expanding
+               windows), else they keep the same length (rolling windows).
+
+    Returns:
+    List of (train_start, train_end, test_start, test_end) tuples, the end dates being excluded.
+    """
+    start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    train_start = start_date
+    train_end = start_date + train_length
+    windows = []
+    while train_end < end_date:
+        windows.append((train_start, train_end, train_end, min(train_end + test_length, end_date)))
+        train_end = train_end + test_length
+        if not anchored:
+            train_start = train_start + test_length
+    return windows
+
+
+def _best_score(score):
+    return -np.inf if np.isnan(score) else score
+
+
+def _run_window(task):
+    """
+    Runs one walk-forward window in a worker: picks the parameters with the best
+    objective on the training period (if there are several), then runs the
+    test period with them. Returns the window results and its equity curve.
+    """
+    position, (train_start, train_end, test_start, test_end), combinations, refit, objective = task
+    settings, bars = worker_state()
+    periods = periods_per_year(settings["interval"])
+    if refit:
+        combinations = [dict(params, train_start_date=train_start, train_end_date=train_end)
+                        for params in combinations]
+
+    best_params, train_score = combinations[0], np.nan
+    if len(combinations) > 1:
+        scores = [summary_stats(run_shared_backtest(settings, bars, params, train_start, train_end)
+                                .portfolio.equity_curve, periods)[objective]
+                  for params in combinations]
+        best = max(range(len(scores)), key=lambda i: _best_score(scores[i]))
+        best_params, train_score = combinations[best], scores[best]
+
+    backtest = run_shared_backtest(settings, bars, best_params, test_start, test_end)
+    equity_curve = backtest.portfolio.equity_curve
+    result = {"train_start": train_start, "train_end": train_end, "test_start": test_start, "test_end": test_end,
+              "train_" + objective: train_score}
+    result.update({name: value for name, value in best_params.items()
+                   if name not in ("train_start_date", "train_end_date")})
+    result.update(summary_stats(equity_curve, periods))
+    result.update(signals=backtest.signals, orders=backtest.orders, fills=backtest.fills)
+    return position, result, equity_curve[["total"]]
+
+
+def stitch_equity_curves(equity_curves, initial_capital):
+    """
+    Stitches the out-of-sample equity curves of the windows into one, by chaining
+    their returns: each window starts with the capital at the end of the previous one.
+
+    Parameters:
+    equity_curves - List of the equity curves (DataFrames with a 'total' column) in window order.
+    initial_capital - The starting capital of the stitched curve.
+
+    Returns:
+    A DataFrame with the window number, total, returns, equity_curve and drawdown
+    columns, as the equity curve of a Portfolio.
+    """
+    segments = []
+    for window, equity_curve in enumerate(equity_curves):
+        # The first row of each window is its initial capital, and the last bar is
+        # repeated with its fills: the returns of a same datetime are compounded
+        returns = equity_curve["total"].pct_change().iloc[1:]
+        returns = (1.0 + returns).groupby(level=0, sort=False).prod() - 1.0
+        segments.append(pd.DataFrame({"window": window, "returns": returns}))
+
+    stitched = pd.concat(segments)
+    stitched["equity_curve"] = (1.0 + stitched["returns"]).cumprod()
+    stitched["total"] = initial_capital * stitched["equity_curve"]
+    stitched["drawdown"], _, _ = create_drawdowns(stitched["equity_curve"])
+    return stitched
+
+
+def walk_forward(data_dir, symbol_list, initial_capital, start_date, end_date, interval,
+                 data_handler, execution_handler, portfolio, strategy,
+                 train_length, test_length, param_grid=None, anchored=False,
+                 objective="sharpe_ratio", refit=False, processes=None):
+    """
+    Walk-forward optimization: in each train/test window, the strategy is re-optimized
+    (best parameters of the grid for the objective) and/or re-fitted (its model trained)
+    on the training period, then run out-of-sample on the test period. The windows run
+    in parallel worker processes, sharing the market data loaded once, and the
+    out-of-sample equity curves are stitched into one.
+
+    The test period of each window only trades on its own bars, the previous bars being
+    available to warm up the strategy, and no bar after the period is used.
+
+    Parameters:
+    data_dir, symbol_list, initial_capital, start_date, end_date, interval,
+    data_handler, execution_handler, portfolio, strategy - As for Backtest (the data handler
+                                                           must have a known history, i.e. ColumnarDataHandler).
+    train_length, test_length, anchored - The windows, see walk_forward_windows.
+    param_grid - Parameters of the strategy to optimize, see expand_grid (its defaults if None).
+    objective - Statistic maximized on the training periods (see ParameterSweep.summary_stats).
+    refit - If True, the training period is given to the strategy as its train_start_date and
+            train_end_date parameters, to fit its model (e.g. ETFDailyForecastStrategy).
+    processes - Number of worker processes (all the cores if None).
+
+    Returns:
+    windows, equity_curve - A DataFrame with one row per window (dates, chosen parameters,
+    training objective, out-of-sample statistics), and the stitched out-of-sample equity curve.
+    """
+    combinations = expand_grid(param_grid) if param_grid is not None else [{}]
+
+    settings = {"data_dir": data_dir, "symbol_list": symbol_list, "initial_capital": initial_capital,
+                "start_date": start_date, "end_date": end_date, "interval": interval,
+                "data_handler": data_handler, "execution_handler": execution_handler,
+                "portfolio": portfolio, "strategy": strategy}
+    bars = preload_bars(data_handler, data_dir, symbol_list, interval, start_date, end_date)
+    if bars is None:
+        raise TypeError("The walk-forward engine needs a data handler with a known history (ColumnarDataHandler).")
+
+    # The test periods after the last bar would be empty
+    last_bar = pd.Timestamp(bars.bar_datetimes[-1])
+    windows = [window for window in walk_forward_windows(start_date, end_date, train_length, test_length, anchored)
+               if window[2] <= last_bar.tz_localize(None)]
+    if not windows:
+        raise ValueError("The date range is too short for one training and test period.")
+
+    tasks = [(position, window, combinations, refit, objective) for position, window in enumerate(windows)]
+    results = map_with_shared_data(_run_window, tasks, settings, bars, processes, chunksize=1)
+    results.sort(key=lambda result: result[0])
+
+    windows_table = pd.DataFrame([result for _, result, _ in results])
+    equity_curve = stitch_equity_curves([curve for _, _, curve in results], initial_capital)
+    return windows_table, equity_curve
+
+
+def output_walk_forward_stats(equity_curve, periods=252):
+    """
+    Creates the list of summary statistics of the stitched
+    out-of-sample equity curve, as Portfolio.output_summary_stats.
+    """
+    return format_summary_stats(create_summary_stats(equity_curve["returns"], periods))
+
+
+if __name__ == "__main__":
+    import pprint
+    from datetime import datetime
+    from pathlib import Path
+
+    from DataHandler import HistoricCSVDataHandler
+    from Execution import SimpleSimulatedExecutionHandler
+    from Portfolio import Portfolio
+    from Strategies.MAC_Strat import MovingAverageCrossOverStrat
+
+    data_dir = Path(__file__).resolve().parent / 'DataDir'
+    windows, equity_curve = walk_forward(data_dir, ['AAPL'], 100000.0, datetime(1990, 1, 1), datetime(2002, 1, 1),
+                                         '1d', HistoricCSVDataHandler, SimpleSimulatedExecutionHandler, Portfolio,
+                                         MovingAverageCrossOverStrat,
+                                         train_length=pd.DateOffset(years=3), test_length=pd.DateOffset(years=1),
+                                         param_grid={"short_window": [10, 20, 50], "long_window": [100, 200, 400]})
+    print(windows.to_string(index=False))
+    pprint.pprint(output_walk_forward_stats(equity_curve))
+    # Saved as the equity curve of a backtest, to be plotted by PlotPerformance.py
+    equity_curve.to_csv("equity.csv")
@@ -0,0 +1,53 @@
+import contextlib
+import io
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules of the backtester are top-level modules of the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from BacktesterLoop import Backtest
+from DataHandler import HistoricCSVDataHandler
+from Execution import SimpleSimulatedExecutionHandler
+from Strategies.MAC_Strat import MovingAverageCrossOverStrat
+
+UNIVERSE = ["S%d" % i for i in range(6)]
+
+
+@pytest.fixture(scope="session")
+def universe_dir(tmp_path_factory):
+    """
+    Directory of CSV files (in the DataDir format) of a small universe of symbols
+    with random walks, starting on different dates and with gaps in their bars.
+    """
+    csv_dir = tmp_path_factory.mktemp("universe")
+    dates = pd.bdate_range("2015-01-01", periods=400)
+    rng = np.random.RandomState(1)
+    for i, symbol in enumerate(UNIVERSE):
+        index = dates[10 * i:]
+        index = index.delete(rng.choice(len(index), 5, replace=False))
+        close = 50.0 * np.exp(np.cumsum(rng.normal(0.0, 0.02, len(index))))
+        frame = pd.DataFrame({"Open": close, "High": close * 1.01, "Low": close * 0.99, "Close": close,
+                              "Adj Close": close, "Volume": 1000.0}, index=index.strftime("%d/%m/%Y"))
+        frame.index.name = "Date"
+        frame.to_csv(str(csv_dir / ("%s.csv" % symbol)))
+    return csv_dir
+
+
+def run_backtest(data_dir, portfolio_cls, data_handler=HistoricCSVDataHandler,
+                 strategy=MovingAverageCrossOverStrat, **kwargs):
+    """
+    Runs a strategy (MAC by default) on the universe, returning the Backtest.
+    """
+    kwargs.setdefault("strategy_params", {"short_window": 5, "long_window": 20})
+    with contextlib.redirect_stdout(io.StringIO()):
+        backtest = Backtest(str(data_dir), UNIVERSE, 100000.0, 0.0, datetime(2015, 1, 1), datetime(2017, 1, 1),
+                            "1d", data_handler, SimpleSimulatedExecutionHandler, portfolio_cls, strategy,
+                            **kwargs)
+        backtest._run_backtest()
+    return backtest
@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+
+from Portfolio import Portfolio
+from Strategies.Buy_And_Hold_Strat import BuyAndHoldStrat
+from Strategies.MAC_Strat import MovingAverageCrossOverStrat
+from conftest import run_backtest
+
+STRATEGIES = [MovingAverageCrossOverStrat, MovingAverageCrossOverStrat, BuyAndHoldStrat]
+PARAMS = [{"short_window": 5, "long_window": 20}, {"short_window": 10, "long_window": 40}, None]
+
+
+@pytest.mark.parametrize("event_bus", [False, True])
+def test_strategies_on_one_pass_match_single_runs(universe_dir, event_bus):
+    backtest = run_backtest(universe_dir, Portfolio, strategy=STRATEGIES, strategy_params=PARAMS,
+                            event_bus=event_bus)
+    assert [account.name for account in backtest.accounts] == ["MovingAverageCrossOverStrat_0",
+                                                               "MovingAverageCrossOverStrat_1", "BuyAndHoldStrat"]
+
+    fills = 0
+    for account, strategy, params in zip(backtest.accounts, STRATEGIES, PARAMS):
+        single = run_backtest(universe_dir, Portfolio, strategy=strategy, strategy_params=params,
+                              event_bus=event_bus)
+        # The data is iterated once for all the strategies
+        assert backtest.market_events == single.market_events
+        account.portfolio.create_equity_curve_dataframe()
+        single.portfolio.create_equity_curve_dataframe()
+        pd.testing.assert_frame_equal(account.portfolio.equity_curve, single.portfolio.equity_curve)
+        fills += single.fills
+    assert backtest.fills == fills
+
+
+def test_one_dictionary_of_parameters_per_strategy(universe_dir):
+    with pytest.raises(ValueError):
+        run_backtest(universe_dir, Portfolio, strategy=STRATEGIES, strategy_params=PARAMS[:2])
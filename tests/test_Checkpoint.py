@@ -0,0 +1,96 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import DataHandler
+from Checkpoint import load_checkpoint, save_checkpoint
+from DataHandler import HistoricCSVDataHandler, HistoricSQLiteDataHandler, StreamingCSVDataHandler
+from Portfolio import Portfolio
+from Strategies.MAC_Strat import MovingAverageCrossOverStrat
+from conftest import UNIVERSE, run_backtest
+
+
+class CrashingMACStrat(MovingAverageCrossOverStrat):
+    """
+    MAC strategy raising an error on the given bar, to simulate a crash.
+    """
+
+    crash_bar = 150
+
+    def __init__(self, bars, events, **params):
+        MovingAverageCrossOverStrat.__init__(self, bars, events, **params)
+        self.n_bars = 0
+
+    def calculate_signals(self, event):
+        self.n_bars += 1
+        if self.n_bars == self.crash_bar:
+            raise RuntimeError("Simulated crash")
+        MovingAverageCrossOverStrat.calculate_signals(self, event)
+
+
+def copy_universe(universe_dir, data_dir, data_handler, end_date=None):
+    """
+    Copies the universe files (their bars before end_date only, if given),
+    and imports them into the SQLite store for the SQLite handler.
+    """
+    for symbol in UNIVERSE:
+        frame = pd.read_csv(str(universe_dir / ("%s.csv" % symbol)), index_col=0)
+        if end_date is not None:
+            frame = frame[pd.to_datetime(frame.index, dayfirst=True) < end_date]
+        frame.to_csv(str(data_dir / ("%s.csv" % symbol)))
+    if data_handler is HistoricSQLiteDataHandler:
+        db_path = data_dir / HistoricSQLiteDataHandler.DEFAULT_DB_NAME
+        if db_path.exists():
+            DataHandler._sqlite_connections.clear()
+            db_path.unlink()
+        HistoricSQLiteDataHandler.import_csv_files(str(db_path), str(data_dir), UNIVERSE)
+
+
+def equity_curve(backtest):
+    backtest.portfolio.create_equity_curve_dataframe()
+    return backtest.portfolio.equity_curve
+
+
+@pytest.fixture(autouse=True)
+def close_sqlite_connections():
+    yield
+    DataHandler._sqlite_connections.clear()
+
+
+def test_checkpoint_file_round_trip(tmp_path):
+    path = str(tmp_path / "run.ckpt")
+    save_checkpoint(path, {"counters": (1, 2, 3, 4)})
+    assert load_checkpoint(path)["counters"] == (1, 2, 3, 4)
+    assert not (tmp_path / "run.ckpt.tmp").exists()
+
+
+@pytest.mark.parametrize("event_bus", [False, True])
+@pytest.mark.parametrize("data_handler", [HistoricCSVDataHandler, StreamingCSVDataHandler,
+                                          HistoricSQLiteDataHandler])
+def test_resume_after_a_crash(universe_dir, tmp_path, data_handler, event_bus):
+    copy_universe(universe_dir, tmp_path, data_handler)
+    expected = equity_curve(run_backtest(tmp_path, Portfolio, data_handler, event_bus=event_bus))
+
+    checkpoint_path = str(tmp_path / "run.ckpt")
+    with pytest.raises(RuntimeError):
+        run_backtest(tmp_path, Portfolio, data_handler, strategy=CrashingMACStrat, event_bus=event_bus,
+                     checkpoint_path=checkpoint_path, checkpoint_bars=40)
+    resumed = run_backtest(tmp_path, Portfolio, data_handler, event_bus=event_bus,
+                           checkpoint_path=checkpoint_path, checkpoint_bars=40, resume=True)
+    pd.testing.assert_frame_equal(equity_curve(resumed), expected)
+
+
+@pytest.mark.parametrize("data_handler", [HistoricCSVDataHandler, StreamingCSVDataHandler,
+                                          HistoricSQLiteDataHandler])
+def test_extend_a_finished_run(universe_dir, tmp_path, data_handler):
+    copy_universe(universe_dir, tmp_path, data_handler)
+    expected = equity_curve(run_backtest(tmp_path, Portfolio, data_handler))
+
+    # The run on the first bars is resumed once the new bars are added to the data
+    checkpoint_path = str(tmp_path / "run.ckpt")
+    copy_universe(universe_dir, tmp_path, data_handler, end_date=datetime(2015, 11, 2))
+    run_backtest(tmp_path, Portfolio, data_handler, checkpoint_path=checkpoint_path)
+    copy_universe(universe_dir, tmp_path, data_handler)
+    extended = run_backtest(tmp_path, Portfolio, data_handler, checkpoint_path=checkpoint_path, resume=True)
+    pd.testing.assert_frame_equal(equity_curve(extended), expected)
@@ -0,0 +1,88 @@
+import os
+from datetime import datetime
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from DataCache import YahooDownloader, read_csv_columns
+from DataHandler import YahooDataHandler
+from Strategies.Helper.CreateLaggedSeries import create_lagged_series
+
+
+class CountingFetcher(object):
+    """
+    Stand-in for the yfinance fetcher, returning daily bars for any
+    range and counting the requests.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, symbols, start_date, end_date, interval):
+        self.requests.append((list(symbols), start_date, end_date, interval))
+        index = pd.date_range(start_date, end_date, freq="D", inclusive="left", name="Date")
+        close = np.arange(len(index), dtype=np.float64) + 100.0
+        return {symbol: pd.DataFrame({"Open": close, "High": close, "Low": close, "Close": close,
+                                      "Adj Close": close, "Volume": 1000.0}, index=index)
+                for symbol in symbols}
+
+
+@pytest.mark.parametrize("persisted", [False, True])
+def test_sub_ranges_are_sliced_from_the_cache(tmp_path, persisted):
+    fetcher = CountingFetcher()
+    cache_dir = str(tmp_path) if persisted else ""
+    downloader = YahooDownloader(cache_dir=cache_dir, fetcher=fetcher)
+    full = downloader.download(["AAA", "BBB"], datetime(2016, 1, 1), datetime(2021, 1, 1), "1d")
+    assert len(fetcher.requests) == 1
+
+    if persisted:
+        # A later run reads the index of the cached ranges from the disk
+        downloader = YahooDownloader(cache_dir=cache_dir, fetcher=fetcher)
+    sub = downloader.download(["AAA", "BBB"], datetime(2016, 1, 1), datetime(2020, 1, 1), "1d")
+    assert len(fetcher.requests) == 1
+    for symbol in ["AAA", "BBB"]:
+        pd.testing.assert_frame_equal(sub[symbol], full[symbol].loc[:"2019-12-31"])
+
+    # Only the symbols or ranges not covered are fetched
+    downloader.download(["AAA", "CCC"], datetime(2017, 1, 1), datetime(2018, 1, 1), "1d")
+    assert fetcher.requests[-1][0] == ["CCC"]
+    downloader.download(["AAA"], datetime(2020, 1, 1), datetime(2022, 1, 1), "1d")
+    downloader.download(["AAA"], datetime(2017, 1, 1), datetime(2018, 1, 1), "1wk")
+    assert len(fetcher.requests) == 4
+
+
+def test_training_period_is_served_from_the_backtest_download():
+    fetcher = CountingFetcher()
+    downloader = YahooDownloader(cache_dir="", fetcher=fetcher)
+    YahooDataHandler(queue.Queue(), ["^OEX"], "1d", datetime(2016, 1, 1), datetime(2021, 1, 1),
+                     downloader=downloader)
+    # Default training period of the ETFDailyForecastStrategy for the backtest range of Main.py
+    lagged = create_lagged_series("^OEX", datetime(2016, 1, 1), datetime(2020, 1, 1), "1d", downloader=downloader)
+    assert len(fetcher.requests) == 1
+    assert lagged.index[-1] < datetime(2020, 1, 1)
+
+
+def test_csv_columns_are_cached_until_the_file_changes(tmp_path):
+    csv_path = tmp_path / "AAA.csv"
+    names = ["datetime", "close", "volume"]
+    csv_path.write_text("Date,Close,Volume\n02/01/2020,10.0,100\n03/01/2020,11.0,200\n")
+    index, columns = read_csv_columns(str(csv_path), names)
+    assert list(index) == [pd.Timestamp("2020-01-02"), pd.Timestamp("2020-01-03")]
+    assert os.path.isdir(str(csv_path) + ".cache")
+
+    # Served memory-mapped from the cache
+    index, columns = read_csv_columns(str(csv_path), names)
+    assert isinstance(columns["close"], np.memmap)
+    np.testing.assert_array_equal(columns["close"], [10.0, 11.0])
+
+    # A changed file invalidates the cache
+    csv_path.write_text("Date,Close,Volume\n02/01/2020,10.0,100\n03/01/2020,11.0,200\n06/01/2020,12.5,300\n")
+    index, columns = read_csv_columns(str(csv_path), names)
+    np.testing.assert_array_equal(columns["close"], [10.0, 11.0, 12.5])
+    assert index[-1] == pd.Timestamp("2020-01-06")
@@ -0,0 +1,281 @@
+import contextlib
+import io
+from datetime import datetime
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import DataHandler
+from BacktesterLoop import Backtest
+from DataHandler import HistoricCSVDataHandler, HistoricSQLiteDataHandler, StreamingCSVDataHandler, \
+    LookbackBuffer, ParquetLakeDataHandler, align_symbol_data
+from Execution import SimpleSimulatedExecutionHandler
+from Portfolio import Portfolio
+from Strategies.MAC_Strat import MovingAverageCrossOverStrat
+from conftest import UNIVERSE, run_backtest
+
+SYMBOLS = ["AAA", "BBB"]
+
+
+def write_staggered_csv_files(csv_dir):
+    """
+    Writes two symbols in the DataDir format: BBB starts 10 days after AAA (on a
+    Wednesday), and AAA has no bar for the first 3 days of a week.
+    """
+    dates = pd.bdate_range("2020-01-01", periods=60)
+    rng = np.random.RandomState(0)
+    symbol_dates = {"AAA": dates.delete([33, 34, 35]), "BBB": dates[10:]}
+    for symbol, index in symbol_dates.items():
+        close = 100.0 + np.cumsum(rng.normal(0.0, 1.0, len(index)))
+        frame = pd.DataFrame({"Open": close, "High": close + 1.0, "Low": close - 1.0, "Close": close,
+                              "Adj Close": close, "Volume": 1000.0}, index=index.strftime("%d/%m/%Y"))
+        frame.index.name = "Date"
+        frame.to_csv(str(csv_dir / ("%s.csv" % symbol)))
+    return dates, symbol_dates
+
+
+@pytest.fixture
+def staggered_dir(tmp_path):
+    dates, symbol_dates = write_staggered_csv_files(tmp_path)
+    HistoricSQLiteDataHandler.import_csv_files(str(tmp_path / "market_data.db"), str(tmp_path), SYMBOLS)
+    yield tmp_path, dates, symbol_dates
+    DataHandler._sqlite_connections.clear()
+
+
+def read_symbol_bars(data_dir, symbol):
+    frame = pd.read_csv(str(data_dir / ("%s.csv" % symbol)), index_col=0)
+    frame.index = pd.to_datetime(frame.index, dayfirst=True)
+    return frame.rename(columns={"Open": "open", "High": "high", "Low": "low"})
+
+
+def make_handler(handler_cls, data_dir):
+    return handler_cls.from_settings(queue.Queue(), str(data_dir), SYMBOLS, "1d", None, None)
+
+
+@pytest.mark.parametrize("handler_cls", [StreamingCSVDataHandler, HistoricSQLiteDataHandler])
+def test_buffered_handlers_release_staggered_symbols(staggered_dir, handler_cls):
+    data_dir, dates, symbol_dates = staggered_dir
+    bars = make_handler(handler_cls, data_dir)
+    columnar = HistoricCSVDataHandler(queue.Queue(), str(data_dir), SYMBOLS, use_cache=False)
+    expected = expected_aligned_bars(data_dir, SYMBOLS, "adj_close")
+    with pytest.raises(IndexError):
+        bars.get_latest_bar_datetime("AAA")
+
+    for i, dt in enumerate(dates):
+        bars.update_bars()
+        columnar.update_bars()
+        for symbol in SYMBOLS:
+            # The datetime is the one of the handler, whether the symbol has a bar or not
+            assert bars.get_latest_bar_datetime(symbol) == dt
+            assert bars.is_latest_bar_stale(symbol) == (dt not in symbol_dates[symbol])
+            if dt < symbol_dates[symbol][0]:
+                assert np.isnan(bars.get_latest_bar_value(symbol, "adj_close"))
+                assert bars.get_latest_bar(symbol)[1].isnull().all()
+            # The lookbacks are the padded rows of the timeline, as for the columnar handler
+            for field in ["open", "adj_close"]:
+                np.testing.assert_array_equal(bars.get_latest_bars_values(symbol, field, N=5),
+                                              columnar.get_latest_bars_values(symbol, field, N=5))
+            np.testing.assert_array_equal(bars.get_latest_bars_values(symbol, "adj_close", N=8),
+                                          expected[symbol].values[max(0, i - 7):i + 1])
+        assert np.isnan(bars.get_latest_cross_section("adj_close")[1]) == (dt < symbol_dates["BBB"][0])
+
+        if dt == dates[35]:
+            # AAA has no bar on the last 3 days, its latest bar being repeated
+            values = bars.get_latest_bars_values("AAA", "adj_close", N=4)
+            np.testing.assert_array_equal(values, [expected["AAA"][dates[32]]] * 4)
+
+
+@pytest.mark.parametrize("handler_cls", [StreamingCSVDataHandler, HistoricSQLiteDataHandler])
+def test_backtest_on_staggered_symbols(staggered_dir, handler_cls):
+    data_dir, dates, symbol_dates = staggered_dir
+    results = {}
+    for cls in [HistoricCSVDataHandler, handler_cls]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            backtest = Backtest(str(data_dir), SYMBOLS, 100000.0, 0.0, datetime(2020, 1, 1), datetime(2021, 1, 1),
+                                "1d", cls, SimpleSimulatedExecutionHandler, Portfolio,
+                                MovingAverageCrossOverStrat, strategy_params={"short_window": 3, "long_window": 8})
+            backtest._run_backtest()
+        results[cls] = backtest
+
+    # One record per datetime of the union of the symbol dates, with the same
+    # holdings as the columnar handler, through the gap of AAA
+    holdings = pd.DataFrame(results[handler_cls].portfolio.all_holdings[1:]).set_index("datetime")
+    expected = pd.DataFrame(results[HistoricCSVDataHandler].portfolio.all_holdings[1:]).set_index("datetime")
+    assert list(holdings.index.unique()) == list(dates)
+    pd.testing.assert_frame_equal(holdings, expected)
+    assert results[handler_cls].fills == results[HistoricCSVDataHandler].fills
+
+
+@pytest.mark.parametrize("handler_cls", [StreamingCSVDataHandler, HistoricSQLiteDataHandler])
+def test_buffered_handler_matches_the_columnar_handler_on_the_universe(universe_dir, tmp_path, handler_cls):
+    data_dir = universe_dir
+    if handler_cls is HistoricSQLiteDataHandler:
+        data_dir = tmp_path
+        HistoricSQLiteDataHandler.import_csv_files(str(tmp_path / HistoricSQLiteDataHandler.DEFAULT_DB_NAME),
+                                                   str(universe_dir), UNIVERSE)
+    expected = run_backtest(universe_dir, Portfolio)
+    try:
+        backtest = run_backtest(data_dir, Portfolio, data_handler=handler_cls)
+    finally:
+        DataHandler._sqlite_connections.clear()
+    assert backtest.fills == expected.fills
+    expected.portfolio.create_equity_curve_dataframe()
+    backtest.portfolio.create_equity_curve_dataframe()
+    pd.testing.assert_frame_equal(backtest.portfolio.equity_curve, expected.portfolio.equity_curve)
+
+
+@pytest.mark.parametrize("handler_cls", [StreamingCSVDataHandler, HistoricSQLiteDataHandler])
+def test_buffered_cross_sections_are_aligned_on_the_timeline(staggered_dir, handler_cls):
+    data_dir, dates, symbol_dates = staggered_dir
+    bars = make_handler(handler_cls, data_dir)
+    columnar = HistoricCSVDataHandler(queue.Queue(), str(data_dir), SYMBOLS, use_cache=False)
+    expected = expected_aligned_bars(data_dir, SYMBOLS, "adj_close")
+    for i, dt in enumerate(dates):
+        bars.update_bars()
+        columnar.update_bars()
+        # Each row holds the values of all the symbols at the same datetime, through the gap of AAA
+        cross_sections = bars.get_latest_cross_sections("adj_close", N=6)
+        np.testing.assert_array_equal(cross_sections, columnar.get_latest_cross_sections("adj_close", N=6))
+        np.testing.assert_array_equal(cross_sections, expected.values[max(0, i - 5):i + 1])
+
+
+@pytest.mark.parametrize("resolution, frequency", [("1wk", "W"), ("1mo", "M")])
+def test_resampled_values_match_pandas(staggered_dir, resolution, frequency):
+    data_dir, dates, symbol_dates = staggered_dir
+    bars = HistoricCSVDataHandler(queue.Queue(), str(data_dir), SYMBOLS, use_cache=False)
+    aggregations = {"open": "first", "high": "max", "low": "min"}
+    symbol_bars = {symbol: read_symbol_bars(data_dir, symbol) for symbol in SYMBOLS}
+
+    for dt in dates:
+        bars.update_bars()
+        periods = pd.DatetimeIndex(dates[dates <= dt]).to_period(frequency).unique()
+        for symbol in SYMBOLS:
+            # Aggregates of the bars of the symbol released so far, ignoring the padded bars
+            released = symbol_bars[symbol].loc[:dt]
+            expected = released.resample(frequency).agg(aggregations)
+            expected.index = expected.index.to_period(frequency)
+            expected = expected.reindex(periods)
+            for field in aggregations:
+                values = bars.get_latest_bars_values(symbol, field, N=len(periods), resolution=resolution)
+                np.testing.assert_allclose(values, expected[field].values)
+
+
+def expected_aligned_bars(data_dir, symbols, field):
+    """
+    Bars of a field aligned on the union of the symbol dates with pandas,
+    padding forward the values of the symbols with no bar at a date.
+    """
+    frames = {symbol: read_symbol_bars(data_dir, symbol) for symbol in symbols}
+    column = {"open": "open", "adj_close": "Adj Close"}[field]
+    return pd.DataFrame({symbol: frame[column] for symbol, frame in frames.items()}).sort_index().ffill()
+
+
+def test_columnar_handler_releases_the_aligned_bars(universe_dir):
+    bars = HistoricCSVDataHandler(queue.Queue(), str(universe_dir), UNIVERSE, use_cache=False)
+    expected = expected_aligned_bars(universe_dir, UNIVERSE, "adj_close")
+    assert bars.bar_datetimes == list(expected.index)
+
+    for i, dt in enumerate(expected.index[:100]):
+        bars.update_bars()
+        assert bars.get_latest_bar_datetime("S0") == dt
+        np.testing.assert_array_equal(bars.get_latest_cross_section("adj_close"), expected.values[i])
+        values = bars.get_latest_bars_values("S1", "adj_close", N=20)
+        np.testing.assert_array_equal(values, expected["S1"].values[max(0, i - 19):i + 1])
+        assert not values.flags.writeable
+        # The bars after the cursor are not visible
+        assert len(bars.get_latest_bars("S0", N=1000)) == i + 1
+    assert bars.get_latest_bar("S2")[1]["adj_close"] == bars.get_latest_bar_value("S2", "adj_close")
+
+
+def test_align_symbol_data_matches_pandas():
+    rng = np.random.RandomState(2)
+    dates = pd.date_range("2020-01-01", periods=50, freq="D")
+    symbol_data = {}
+    for symbol in ["AAA", "BBB", "CCC"]:
+        # Unsorted subsets of the dates, starting at different times
+        index = dates[rng.choice(len(dates), 30, replace=False)]
+        symbol_data[symbol] = (index, {"close": rng.normal(size=30), "volume": rng.rand(30)})
+
+    timeline, fields, padded = align_symbol_data(symbol_data, ["AAA", "BBB", "CCC"])
+    for field in ["close", "volume"]:
+        expected = pd.DataFrame({symbol: pd.Series(columns[field], index=index)
+                                 for symbol, (index, columns) in symbol_data.items()}).sort_index()
+        assert list(timeline) == list(expected.index)
+        np.testing.assert_array_equal(fields[field], expected.ffill().values)
+        np.testing.assert_array_equal(padded, expected.isnull().values)
+    assert fields["close"].flags.f_contiguous
+
+
+def test_lookback_buffer_keeps_the_latest_bars_contiguous():
+    buffer = LookbackBuffer(4, 2)
+    for i in range(11):
+        buffer.append(i, [i, 10.0 * i])
+        latest = buffer.values[buffer.latest_slice(3)]
+        np.testing.assert_array_equal(latest[:, 0], np.arange(max(0, i - 2), i + 1))
+        assert list(buffer.datetimes[buffer.latest_slice(10)]) == list(range(max(0, i - 3), i + 1))
+    assert len(buffer) == 4
+
+
+def test_buffered_handler_memory_follows_the_declared_lookback(staggered_dir):
+    data_dir, dates, symbol_dates = staggered_dir
+    bars = make_handler(StreamingCSVDataHandler, data_dir)
+    bars.set_max_lookback(5)
+    for _ in dates:
+        bars.update_bars()
+    assert all(buffer.values.shape[0] == 10 for buffer in bars.latest_symbol_data.values())
+    np.testing.assert_array_equal(bars.get_latest_bars_values("BBB", "adj_close", N=50),
+                                  read_symbol_bars(data_dir, "BBB")["Adj Close"].values[-5:])
+    with pytest.raises(ValueError):
+        bars.set_max_lookback(10)
+
+
+@pytest.mark.parametrize("max_query_parameters", [900, 2])
+def test_sqlite_handler_matches_the_streaming_csv_handler(universe_dir, tmp_path, monkeypatch,
+                                                          max_query_parameters):
+    # With 2 parameters at most, the symbols are joined from a temporary table
+    monkeypatch.setattr(HistoricSQLiteDataHandler, "MAX_QUERY_PARAMETERS", max_query_parameters)
+    db_path = str(tmp_path / "bars.db")
+    HistoricSQLiteDataHandler.import_csv_files(db_path, str(universe_dir), UNIVERSE)
+    try:
+        streaming = StreamingCSVDataHandler(queue.Queue(), str(universe_dir), UNIVERSE, chunk_size=64)
+        sqlite = HistoricSQLiteDataHandler(queue.Queue(), db_path, UNIVERSE, start_date=datetime(2015, 3, 2),
+                                           fetch_size=50)
+        while streaming.continue_backtest:
+            streaming.update_bars()
+            if streaming.latest_datetime < datetime(2015, 3, 2):
+                continue
+            sqlite.update_bars()
+            assert sqlite.latest_datetime == streaming.latest_datetime
+            for symbol in UNIVERSE:
+                # The bars before the start date are not fetched
+                values = sqlite.get_latest_bars_values(symbol, "close", N=3)
+                expected = streaming.get_latest_bars_values(symbol, "close", N=3)
+                np.testing.assert_array_equal(values, expected[len(expected) - len(values):])
+                assert sqlite.is_latest_bar_stale(symbol) == streaming.is_latest_bar_stale(symbol)
+        sqlite.update_bars()
+        assert not sqlite.continue_backtest
+    finally:
+        DataHandler._sqlite_connections.clear()
+
+
+def test_parquet_lake_handler_reads_the_backtest_window(universe_dir, tmp_path):
+    lake_dir = tmp_path / "lake"
+    for symbol in UNIVERSE:
+        frame = read_symbol_bars(universe_dir, symbol)
+        frame.columns = ["open", "high", "low", "close", "adj_close", "volume"]
+        ParquetLakeDataHandler.write_partitions(str(lake_dir), symbol, frame)
+
+    start, end = datetime(2015, 3, 10), datetime(2015, 6, 20)
+    lake = ParquetLakeDataHandler(queue.Queue(), str(lake_dir), UNIVERSE, start, end, columns=["close", "adj_close"])
+    # The symbols start from their first bar in the window (a pandas outer join of the window)
+    window = pd.DataFrame({symbol: read_symbol_bars(universe_dir, symbol)["Adj Close"].loc[start:end]
+                           for symbol in UNIVERSE}).sort_index().ffill()
+    assert lake.bar_datetimes == list(window.index)
+    np.testing.assert_array_equal(lake.get_history_values("adj_close"), window.values)
+    assert set(lake.bar_fields) == {"close", "adj_close"}
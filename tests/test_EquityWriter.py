@@ -0,0 +1,63 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from EquityWriter import EquityWriter, iter_equity_chunks, read_equity_curve
+from Portfolio import ArrayPortfolio, StreamingPortfolio
+from conftest import UNIVERSE, run_backtest
+
+
+def write_chunks(path, n_chunks, first_chunk=0):
+    writer = EquityWriter(path, first_chunk)
+    for i in range(first_chunk, first_chunk + n_chunks):
+        datetimes = pd.date_range(datetime(2015, 1, 1) + pd.Timedelta(days=3 * i), periods=3)
+        writer.write(datetimes, np.full((3, 2), float(i)), ["S0", "total"])
+    writer.close()
+
+
+def test_writer_chunks(tmp_path):
+    path = str(tmp_path / "equity.parquet")
+    write_chunks(path, 3)
+    assert sorted(os.listdir(path)) == ["part-000000.parquet", "part-000001.parquet", "part-000002.parquet"]
+    chunks = list(iter_equity_chunks(path, ["total"]))
+    assert [list(chunk.columns) for chunk in chunks] == [["total"]] * 3
+    assert [chunk["total"].iloc[0] for chunk in chunks] == [0.0, 1.0, 2.0]
+
+    # Writing again from a chunk removes the files of the following ones
+    write_chunks(path, 1, first_chunk=1)
+    assert sorted(os.listdir(path)) == ["part-000000.parquet", "part-000001.parquet"]
+
+    equity_curve = read_equity_curve(path, ["S0"])
+    assert list(equity_curve.columns) == ["S0", "total", "returns", "equity_curve", "drawdown"]
+    assert equity_curve.index.equals(pd.date_range("2015-01-01", periods=6, name="datetime"))
+
+
+def test_reading_an_empty_output(tmp_path):
+    with pytest.raises(ValueError):
+        read_equity_curve(str(tmp_path))
+
+
+@pytest.mark.parametrize("event_bus", [False, True])
+def test_streaming_portfolio_matches_the_array_portfolio(universe_dir, tmp_path, monkeypatch, event_bus):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(StreamingPortfolio, "CHUNK_SIZE", 50)
+    monkeypatch.setattr(StreamingPortfolio, "TAIL_SIZE", 10)
+    expected = run_backtest(universe_dir, ArrayPortfolio, event_bus=event_bus).portfolio
+    portfolio = run_backtest(universe_dir, StreamingPortfolio, event_bus=event_bus).portfolio
+    # Only the chunk being filled and the tail are kept in memory
+    assert len(portfolio.datetime_history) == 60
+
+    expected.create_equity_curve_dataframe()
+    portfolio.create_equity_curve_dataframe(columns=None)
+    assert len(os.listdir("equity.parquet")) == portfolio.n_chunks > 1
+    columns = UNIVERSE + ["cash", "commission", "total", "returns", "equity_curve"]
+    pd.testing.assert_frame_equal(portfolio.equity_curve[columns], expected.equity_curve, check_index_type=False)
+    assert portfolio.equity_curve.index.equals(pd.DatetimeIndex(expected.equity_curve.index))
+
+    # By default, the equity curve is read without the columns of the symbols
+    portfolio.create_equity_curve_dataframe()
+    assert list(portfolio.equity_curve.columns) == ["cash", "commission", "total", "returns", "equity_curve",
+                                                    "drawdown"]
@@ -0,0 +1,43 @@
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from EventBus import EventBus
+from Events import FillEvent, MarketEvent, OrderEvent, SignalEvent
+from Portfolio import Portfolio
+from conftest import run_backtest
+
+
+def test_event_bus_dispatches_in_order_of_subscription():
+    bus = EventBus()
+    calls = []
+    bus.subscribe(MarketEvent, lambda event: calls.append("strategy"))
+    bus.subscribe(MarketEvent, lambda event: calls.append("portfolio"))
+    bus.subscribe(SignalEvent, lambda event: bus.put(OrderEvent(event.symbol, "MKT", 100, "BUY")))
+    bus.subscribe(OrderEvent, lambda event: calls.append(event.direction))
+
+    bus.put(MarketEvent())
+    bus.put(None)
+    bus.put(SignalEvent("AAA", None, "LONG", 1.0))
+    bus.dispatch()
+    # The events put by the handlers are dispatched too, and the events without handlers are dropped
+    bus.put(FillEvent(None, "AAA", "FAKE_EXCHANGE", 100, "BUY", None))
+    bus.dispatch()
+    assert calls == ["strategy", "portfolio", "BUY"]
+    assert bus.dispatched == 4 and bus.empty()
+    with pytest.raises(queue.Empty):
+        bus.get()
+
+
+def test_event_bus_backtest_matches_the_queue(universe_dir):
+    results = []
+    for event_bus in [False, True]:
+        backtest = run_backtest(universe_dir, Portfolio, event_bus=event_bus)
+        results.append(pd.DataFrame(backtest.portfolio.all_holdings).set_index("datetime"))
+    pd.testing.assert_frame_equal(results[0], results[1])
+    assert np.isfinite(results[1]["total"]).all()
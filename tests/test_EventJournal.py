@@ -0,0 +1,98 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from EventJournal import FILL, ORDER, SIGNAL, EventJournal, journal_to_dataframe, read_journal
+from Events import MARKET_EVENT, FillEvent, OrderEvent, SignalEvent
+from Portfolio import Portfolio
+from conftest import UNIVERSE, run_backtest
+
+
+class LatestBars(object):
+    """
+    Stand-in of the data handler, giving the datetime and price of the events.
+    """
+
+    def __init__(self):
+        self.latest_datetime = datetime(2015, 1, 1)
+
+    def get_latest_bar_datetime(self, symbol):
+        return self.latest_datetime
+
+    def get_latest_bar_value(self, symbol, val_type):
+        return 10.0
+
+
+def test_events_have_no_instance_dictionary():
+    events = [MARKET_EVENT, SignalEvent("S0", datetime(2015, 1, 1), "LONG", 1.0),
+              OrderEvent("S0", "MKT", 10, "BUY"), FillEvent(datetime(2015, 1, 1), "S0", "ARCA", 10, "BUY", None)]
+    for event in events:
+        assert not hasattr(event, "__dict__")
+    assert events[3].datetime == datetime(2015, 1, 1)
+
+
+def test_journal_records_round_trip(tmp_path):
+    path = str(tmp_path / "events.journal")
+    bars = LatestBars()
+    # A buffer smaller than the records, to write them in several blocks
+    journal = EventJournal(path, bars, UNIVERSE, buffer_size=2)
+    for i in range(5):
+        journal.on_market_event(MARKET_EVENT)
+        bars.latest_datetime = datetime(2015, 1, 1 + i)
+        journal.record(SignalEvent("S1", bars.latest_datetime, "LONG", 1.0), account=1)
+        journal.record(OrderEvent("S1", "MKT", 100, "BUY"), account=1)
+        journal.record(FillEvent(bars.latest_datetime, "S1", "ARCA", 100, "SELL", 12.5 if i % 2 else None))
+        journal.record(MARKET_EVENT)
+    journal.close()
+
+    symbol_list, records = read_journal(path)
+    assert symbol_list == UNIVERSE
+    assert list(records["kind"]) == [SIGNAL, ORDER, FILL] * 5
+    assert list(records["bar"]) == [bar for bar in range(1, 6) for _ in range(3)]
+    assert list(records["symbol"]) == [1] * 15
+    assert list(records["account"]) == [1, 1, 0] * 5
+    assert list(records["direction"]) == [1, 1, -1] * 5
+    assert list(records["price"][2::3]) == [10.0, 12.5, 10.0, 12.5, 10.0]
+    assert np.isnan(records["price"][0::3]).all()
+
+    frame = journal_to_dataframe(path)
+    assert list(frame["kind"][:3]) == ["SIGNAL", "ORDER", "FILL"]
+    assert (frame["symbol"] == "S1").all()
+    assert list(frame["datetime"][::3]) == list(pd.date_range("2015-01-01", periods=5))
+
+
+def test_journal_appends_and_truncates(tmp_path):
+    path = str(tmp_path / "events.journal")
+    bars = LatestBars()
+    journal = EventJournal(path, bars, UNIVERSE)
+    for _ in range(4):
+        journal.on_market_event(MARKET_EVENT)
+        journal.record(SignalEvent("S0", bars.latest_datetime, "EXIT", 1.0))
+    journal.truncate_after(2)
+    journal.on_market_event(MARKET_EVENT)
+    journal.record(SignalEvent("S0", bars.latest_datetime, "LONG", 1.0))
+    journal.close()
+    assert list(read_journal(path)[1]["bar"]) == [1, 2, 3]
+
+    journal = EventJournal(path, bars, UNIVERSE, append=True)
+    journal.close()
+    assert len(read_journal(path)[1]) == 3
+    with pytest.raises(ValueError):
+        EventJournal(path, bars, UNIVERSE[::-1], append=True)
+
+
+def test_backtest_journal(universe_dir, tmp_path):
+    path = str(tmp_path / "events.journal")
+    backtest = run_backtest(universe_dir, Portfolio, journal_path=path)
+    frame = journal_to_dataframe(path)
+    counts = frame["kind"].value_counts()
+    assert (counts["SIGNAL"], counts["ORDER"], counts["FILL"]) == (backtest.signals, backtest.orders, backtest.fills)
+    assert frame["bar"].is_monotonic_increasing
+    assert frame["bar"].max() <= backtest.market_events
+
+    # The fills of the journal give the positions of the portfolio
+    fills = frame[frame["kind"] == "FILL"]
+    quantities = (fills["direction"] * fills["quantity"]).groupby(fills["symbol"]).sum()
+    assert quantities.reindex(UNIVERSE, fill_value=0.0).to_dict() == backtest.portfolio.current_positions
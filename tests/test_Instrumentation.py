@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+from Instrumentation import LatencyHistogram, LoopProfiler
+from Portfolio import Portfolio
+from conftest import run_backtest
+
+
+def test_latency_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for i in range(1, 1001):
+        histogram.record(i * 1e-6)
+    summary = histogram.summary()
+    assert summary["calls"] == 1000
+    assert summary["max"] == pytest.approx(1e-3)
+    assert summary["mean"] == pytest.approx(500.5e-6)
+    # The percentiles are the upper edge of their bucket, about 12% above at most
+    for q, expected in [(50, 500e-6), (90, 900e-6), (99, 990e-6)]:
+        assert expected <= summary["p%d" % q] <= expected * 1.13
+    assert LatencyHistogram().percentile(50) == 0.0
+
+
+def test_profiler_records_the_stages_of_the_loop(universe_dir, tmp_path):
+    backtest = run_backtest(universe_dir, Portfolio, instrument=True)
+    report = backtest.profiler.report(backtest.market_events, backtest.market_events)
+    stages = report["stages"]
+    assert stages["update_bars"]["calls"] == backtest.market_events
+    assert stages["calculate_signals"]["calls"] == backtest.market_events
+    assert stages["execute_order"]["calls"] == backtest.orders
+
+    profiler = LoopProfiler()
+    profiler.wrap("stage", lambda: None)()
+    profiler.export_json(str(tmp_path / "instrumentation.json"), 1, 1)
+    with open(str(tmp_path / "instrumentation.json")) as json_file:
+        assert json.load(json_file)["stages"]["stage"]["calls"] == 1
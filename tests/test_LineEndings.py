@@ -0,0 +1,23 @@
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def source_files():
+    for directory, directories, files in os.walk(ROOT):
+        directories[:] = [name for name in directories if not name.startswith(".") and name != "__pycache__"]
+        for name in files:
+            if name.endswith(".py"):
+                yield os.path.relpath(os.path.join(directory, name), ROOT)
+
+
+@pytest.mark.parametrize("path", sorted(source_files()))
+def test_line_endings_are_not_mixed(path):
+    with open(os.path.join(ROOT, path), "rb") as source:
+        lines = source.read().splitlines(True)
+    crlf = sum(line.endswith(b"\r\n") for line in lines)
+    # The last line may have no line ending
+    lf = sum(line.endswith(b"\n") for line in lines) - crlf
+    assert crlf == 0 or lf == 0, "%s mixes CRLF (%d lines) and LF (%d lines)" % (path, crlf, lf)
@@ -0,0 +1,45 @@
+import asyncio
+import contextlib
+import io
+import os
+from datetime import datetime
+
+import pytest
+
+from DataHandler import TCPFeedDataHandler
+from Execution import AsyncSimulatedExecutionHandler
+from LiveLoop import LiveTradingLoop, ReplayFeedServer
+from Portfolio import Portfolio
+from Strategies.MAC_Strat import MovingAverageCrossOverStrat
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "DataDir")
+
+
+async def paper_trading(heartbeat, period, n_bars):
+    feed = ReplayFeedServer(DATA_DIR, ["AAPL"], period=period, max_bars=n_bars)
+    await feed.start()
+    live = LiveTradingLoop((feed.host, feed.port), ["AAPL"], 100000.0, heartbeat, datetime(1990, 1, 1),
+                           TCPFeedDataHandler, AsyncSimulatedExecutionHandler, Portfolio,
+                           MovingAverageCrossOverStrat, {"short_window": 5, "long_window": 20})
+    try:
+        await live.run()
+    finally:
+        await feed.close()
+    return live
+
+
+@pytest.mark.parametrize("heartbeat", [0.0, 0.001])
+def test_live_loop_releases_every_bar(heartbeat):
+    with contextlib.redirect_stdout(io.StringIO()):
+        live = asyncio.run(paper_trading(heartbeat, 0.002, 100))
+    assert live.market_events == 100
+    assert live.data_handler.bars_received == 100
+    assert live.orders == live.fills > 0
+
+
+def test_live_loop_without_heartbeat_waits_for_the_bars():
+    with contextlib.redirect_stdout(io.StringIO()):
+        live = asyncio.run(paper_trading(0.0, 0.002, 100))
+    # One tick per bar (or batch of bars) received, and one when the feed closes,
+    # instead of spinning on an empty feed between the bars
+    assert live.ticks <= 101
@@ -0,0 +1,42 @@
+from datetime import datetime
+
+import pytest
+
+from DataHandler import HistoricCSVDataHandler
+from Execution import SimpleSimulatedExecutionHandler
+from ParameterSweep import expand_grid, parameter_sweep, summary_stats
+from Performance import MaxDrawdownStop
+from Portfolio import Portfolio
+from Strategies.MAC_Strat import MovingAverageCrossOverStrat
+from conftest import UNIVERSE, run_backtest
+
+
+def test_expand_grid():
+    assert expand_grid({"b": [1, 2], "a": [3]}) == [{"a": 3, "b": 1}, {"a": 3, "b": 2}]
+    assert expand_grid([{"a": 1}]) == [{"a": 1}]
+
+
+def test_sweep_matches_single_backtests(universe_dir):
+    grid = [{"short_window": 5, "long_window": 20}, {"short_window": 10, "long_window": 40},
+            {"short_window": 3, "long_window": 10}]
+    results = parameter_sweep(str(universe_dir), UNIVERSE, 100000.0, datetime(2015, 1, 1), datetime(2017, 1, 1),
+                              "1d", HistoricCSVDataHandler, SimpleSimulatedExecutionHandler, Portfolio,
+                              MovingAverageCrossOverStrat, grid, processes=2)
+    assert list(results[["short_window", "long_window"]].to_dict("records")) == grid
+
+    # The first combination is the one of the single backtest helper
+    backtest = run_backtest(universe_dir, Portfolio)
+    backtest.portfolio.create_equity_curve_dataframe()
+    stats = summary_stats(backtest.portfolio.equity_curve)
+    assert results.loc[0, "total_return"] == pytest.approx(stats["total_return"])
+    assert results.loc[0, "sharpe_ratio"] == pytest.approx(stats["sharpe_ratio"])
+    assert results.loc[0, "fills"] == backtest.fills
+    assert not results["stopped_early"].any()
+
+
+def test_sweep_stops_the_backtests_early(universe_dir):
+    results = parameter_sweep(str(universe_dir), UNIVERSE, 100000.0, datetime(2015, 1, 1), datetime(2017, 1, 1),
+                              "1d", HistoricCSVDataHandler, SimpleSimulatedExecutionHandler, Portfolio,
+                              MovingAverageCrossOverStrat, {"short_window": [3], "long_window": [10]},
+                              processes=1, stop_condition=MaxDrawdownStop(0.0))
+    assert results.loc[0, "stopped_early"]
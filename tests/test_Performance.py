@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from Performance import (MaxDrawdownStop, RunningPerformance, create_annualised_return, create_calmar_ratio,
+                         create_drawdowns, create_equity_curve, create_rolling_stats, create_sharpe_ratio,
+                         create_sortino_ratio, create_summary_stats, periods_per_year)
+from Portfolio import Portfolio
+from conftest import UNIVERSE, run_backtest
+
+
+@pytest.fixture
+def returns():
+    rng = np.random.default_rng(1)
+    returns = pd.Series(rng.normal(0.0003, 0.01, 2000))
+    returns.iloc[0] = np.nan
+    return returns
+
+
+def brute_force_drawdowns(curve):
+    """
+    Drawdowns of an equity curve, their maximum and longest duration, bar by bar.
+    """
+    high_water_mark = -np.inf
+    drawdowns, duration, max_duration = [], 0, 0
+    for value in curve:
+        high_water_mark = max(high_water_mark, value)
+        drawdowns.append(1.0 - value / high_water_mark)
+        duration = duration + 1 if drawdowns[-1] > 0 else 0
+        max_duration = max(max_duration, duration)
+    return np.array(drawdowns), max(drawdowns), max_duration
+
+
+def test_measures_match_brute_force(returns):
+    values = returns.dropna().values
+    curve = create_equity_curve(returns)
+    np.testing.assert_allclose(curve.values, np.cumprod(1.0 + returns.fillna(0.0).values))
+
+    drawdown, max_drawdown, duration = create_drawdowns(curve)
+    expected_drawdown, expected_max_drawdown, expected_duration = brute_force_drawdowns(curve.values)
+    np.testing.assert_allclose(drawdown.values, expected_drawdown)
+    assert max_drawdown == pytest.approx(expected_max_drawdown)
+    assert duration == expected_duration
+
+    growth = np.prod(1.0 + values) ** (252.0 / len(values)) - 1.0
+    assert create_annualised_return(returns) == pytest.approx(growth)
+    assert create_sharpe_ratio(returns) == pytest.approx(np.sqrt(252) * values.mean() / values.std())
+    downside_deviation = np.sqrt(np.mean(np.minimum(values, 0.0) ** 2))
+    assert create_sortino_ratio(returns) == pytest.approx(np.sqrt(252) * values.mean() / downside_deviation)
+    assert create_calmar_ratio(returns) == pytest.approx(growth / expected_max_drawdown)
+
+
+def test_batch_measures_match_each_curve():
+    rng = np.random.default_rng(2)
+    batch = pd.DataFrame({k: rng.normal(0.0002 * k, 0.01, 500) for k in range(4)})
+    stats = create_summary_stats(batch)
+    expected = pd.DataFrame([create_summary_stats(batch[k]) for k in batch], index=batch.columns)
+    pd.testing.assert_frame_equal(stats, expected, check_dtype=False)
+    np.testing.assert_allclose(create_sharpe_ratio(batch.values), create_sharpe_ratio(batch).values)
+
+
+def test_rolling_stats_match_the_windows(returns):
+    rolling = create_rolling_stats(returns, 50)
+    window = returns.iloc[100:150].values
+    curve = create_equity_curve(returns).values[100:150]
+    assert rolling["sharpe_ratio"].iloc[:50].isna().all()
+    assert rolling["sharpe_ratio"].iloc[149] == pytest.approx(np.sqrt(252) * window.mean() / window.std())
+    assert rolling["volatility"].iloc[149] == pytest.approx(np.sqrt(252) * window.std())
+    assert rolling["return"].iloc[149] == pytest.approx(np.prod(1.0 + window) - 1.0)
+    assert rolling["drawdown"].iloc[149] == pytest.approx(1.0 - curve[-1] / curve.max())
+
+
+def test_flat_returns():
+    stats = create_summary_stats(pd.Series([np.nan, 0.0, 0.0]))
+    assert stats["total_return"] == 0.0 and stats["max_drawdown"] == 0.0
+    assert np.isnan(stats["sharpe_ratio"])
+
+
+def test_periods_per_year():
+    assert periods_per_year("1d") == 252
+    assert periods_per_year("1h") == 252 * 6.5
+    assert periods_per_year("5m") == 252 * 6.5 * 12
+    assert periods_per_year("1wk") == 52
+    assert periods_per_year(None) == 252
+    with pytest.raises(ValueError):
+        periods_per_year("1x")
+
+
+def test_running_performance_matches_the_batch_statistics():
+    rng = np.random.default_rng(1)
+    totals = 100000.0 * np.cumprod(1.0 + rng.normal(0.0003, 0.01, 1000))
+    exposures = rng.uniform(0.0, 50000.0, 1000)
+    performance = RunningPerformance(100000.0, periods=52)
+    for total, exposure in zip(totals, exposures):
+        performance.update(total, exposure)
+    # A bar without valuation is skipped
+    performance.update(np.nan, 0.0)
+
+    curve = pd.Series(np.concatenate([[100000.0], totals]))
+    returns = curve.pct_change()
+    _, max_drawdown, duration = create_drawdowns(curve)
+    assert performance.n_bars == 1000
+    assert performance.total_return == pytest.approx(totals[-1] / 100000.0 - 1.0)
+    assert performance.sharpe_ratio == pytest.approx(create_sharpe_ratio(returns, 52))
+    assert performance.volatility == pytest.approx(np.nanstd(returns))
+    assert performance.max_drawdown == pytest.approx(max_drawdown)
+    assert performance.max_drawdown_duration == duration
+    assert performance.drawdown == pytest.approx(1.0 - totals[-1] / curve.max())
+    assert performance.average_exposure == pytest.approx(np.mean(exposures / totals))
+
+
+def test_running_performance_without_returns():
+    performance = RunningPerformance(100000.0)
+    assert np.isnan(performance.sharpe_ratio) and np.isnan(performance.volatility)
+    performance.update(100000.0, 0.0)
+    performance.update(100000.0, 0.0)
+    assert np.isnan(performance.sharpe_ratio)
+    assert performance.summary()["max_drawdown"] == 0.0
+
+
+def test_backtest_running_performance(universe_dir):
+    backtest = run_backtest(universe_dir, Portfolio)
+    portfolio = backtest.portfolio
+    portfolio.create_equity_curve_dataframe()
+    equity_curve = portfolio.equity_curve
+    performance = portfolio.performance
+
+    assert performance.n_bars == len(equity_curve) - 1
+    assert performance.total_return == pytest.approx(equity_curve["equity_curve"].iloc[-1] - 1.0)
+    assert performance.sharpe_ratio == pytest.approx(create_sharpe_ratio(equity_curve["returns"]))
+    assert performance.max_drawdown == pytest.approx(create_drawdowns(equity_curve["total"])[1])
+    exposures = np.nansum(np.abs(equity_curve[UNIVERSE].values), axis=1) / equity_curve["total"].values
+    assert performance.average_exposure == pytest.approx(exposures[1:].mean())
+    assert performance.turnover > 0
+
+
+def test_max_drawdown_stop():
+    performance = RunningPerformance(100.0)
+    stop = MaxDrawdownStop(0.1)
+    for total in [110.0, 100.0]:
+        performance.update(total, 0.0)
+    assert not stop(performance)
+    performance.update(98.0, 0.0)
+    assert stop(performance)
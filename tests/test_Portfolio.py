@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from DataHandler import HistoricCSVDataHandler, StreamingCSVDataHandler
+from Portfolio import ArrayPortfolio, Portfolio, SparsePortfolio
+from conftest import UNIVERSE, run_backtest
+
+
+def test_portfolio_values_the_current_quantities(universe_dir):
+    backtest = run_backtest(universe_dir, Portfolio)
+    portfolio = backtest.portfolio
+    assert backtest.fills > 0
+    np.testing.assert_array_equal(portfolio.current_quantities,
+                                  [portfolio.current_positions[symbol] for symbol in UNIVERSE])
+
+    # Each market value is the position held at the bar times its latest adjusted close
+    positions = pd.DataFrame(portfolio.all_positions[1:]).set_index("datetime")[UNIVERSE]
+    holdings = pd.DataFrame(portfolio.all_holdings[1:]).set_index("datetime")
+    prices = pd.DataFrame(backtest.data_handler.get_history_values("adj_close"), columns=UNIVERSE,
+                          index=backtest.data_handler.bar_datetimes)
+    prices = prices.reindex(positions.index)
+    np.testing.assert_allclose(holdings[UNIVERSE].values, (positions * prices).values)
+    np.testing.assert_allclose(holdings["total"], holdings["cash"] + np.nansum(holdings[UNIVERSE].values, axis=1))
+
+
+def positions_dataframe(portfolio):
+    return pd.DataFrame(portfolio.all_positions).set_index("datetime")[UNIVERSE]
+
+
+@pytest.mark.parametrize("data_handler", [HistoricCSVDataHandler, StreamingCSVDataHandler])
+def test_array_portfolio_matches_the_portfolio(universe_dir, monkeypatch, data_handler):
+    # A small capacity, for the arrays to grow during the run
+    monkeypatch.setattr(ArrayPortfolio, "DEFAULT_CAPACITY", 16)
+    expected = run_backtest(universe_dir, Portfolio, data_handler=data_handler).portfolio
+    portfolio = run_backtest(universe_dir, ArrayPortfolio, data_handler=data_handler).portfolio
+    expected.create_equity_curve_dataframe()
+    portfolio.create_equity_curve_dataframe()
+    pd.testing.assert_frame_equal(portfolio.equity_curve, expected.equity_curve, check_dtype=False)
+    pd.testing.assert_frame_equal(portfolio.create_positions_dataframe(), positions_dataframe(expected),
+                                  check_dtype=False)
+    assert portfolio.current_positions == expected.current_positions
+
+
+def test_array_portfolio_wraps_its_arrays(universe_dir):
+    portfolio = run_backtest(universe_dir, ArrayPortfolio).portfolio
+    # The arrays are preallocated for all the bars of the data handler
+    assert portfolio.n_bars == len(portfolio.datetime_history)
+    portfolio.create_equity_curve_dataframe()
+    assert np.shares_memory(portfolio.equity_curve["total"].values, portfolio.holdings_history)
+    assert np.shares_memory(portfolio.create_positions_dataframe().values, portfolio.position_history)
+
+
+@pytest.mark.parametrize("event_bus", [False, True])
+def test_sparse_portfolio_matches_the_portfolio(universe_dir, event_bus):
+    expected = run_backtest(universe_dir, Portfolio, event_bus=event_bus).portfolio
+    portfolio = run_backtest(universe_dir, SparsePortfolio, event_bus=event_bus).portfolio
+    expected.create_equity_curve_dataframe()
+    portfolio.create_equity_curve_dataframe()
+    # The symbols without a position are valued at 0 even without a price
+    expected_curve = expected.equity_curve.fillna({symbol: 0.0 for symbol in UNIVERSE})
+    pd.testing.assert_frame_equal(portfolio.equity_curve, expected_curve, check_dtype=False)
+    positions = portfolio.create_positions_dataframe()
+    pd.testing.assert_frame_equal(positions, positions_dataframe(expected), check_dtype=False)
+
+    # Only the open positions are marked to market, and the history is kept sparse
+    assert portfolio.open_positions == {symbol: quantity for symbol, quantity in expected.current_positions.items()
+                                        if quantity != 0}
+    assert len(portfolio.market_value_entries) == int((positions.values[1:] != 0).sum())
+    assert portfolio.all_positions is None and portfolio.all_holdings is None
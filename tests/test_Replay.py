@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+from EventJournal import EventJournal
+from Portfolio import ArrayPortfolio, Portfolio
+from Strategies.Buy_And_Hold_Strat import BuyAndHoldStrat
+from Strategies.MAC_Strat import MovingAverageCrossOverStrat
+from conftest import UNIVERSE, run_backtest
+
+
+def equity_curve(portfolio):
+    portfolio.create_equity_curve_dataframe()
+    return portfolio.equity_curve
+
+
+@pytest.mark.parametrize("event_bus", [False, True])
+def test_replay_matches_the_recorded_run(universe_dir, tmp_path, event_bus):
+    path = str(tmp_path / "events.journal")
+    recorded = run_backtest(universe_dir, Portfolio, journal_path=path, event_bus=event_bus)
+    replayed = run_backtest(universe_dir, Portfolio, replay_journal=path, event_bus=event_bus)
+    assert recorded.fills > 0
+    assert (replayed.signals, replayed.orders, replayed.fills) == (recorded.signals, recorded.orders, recorded.fills)
+    pd.testing.assert_frame_equal(equity_curve(replayed.portfolio), equity_curve(recorded.portfolio))
+
+
+def test_replay_with_another_portfolio(universe_dir, tmp_path):
+    path = str(tmp_path / "events.journal")
+    recorded = run_backtest(universe_dir, Portfolio, journal_path=path)
+    replayed = run_backtest(universe_dir, ArrayPortfolio, replay_journal=path)
+    pd.testing.assert_frame_equal(equity_curve(replayed.portfolio), equity_curve(recorded.portfolio),
+                                  check_dtype=False)
+
+
+def test_replay_of_several_strategies(universe_dir, tmp_path):
+    path = str(tmp_path / "events.journal")
+    strategies = [MovingAverageCrossOverStrat, BuyAndHoldStrat]
+    params = [{"short_window": 5, "long_window": 20}, None]
+    recorded = run_backtest(universe_dir, Portfolio, strategy=strategies, strategy_params=params, journal_path=path)
+    replayed = run_backtest(universe_dir, Portfolio, strategy=strategies, strategy_params=params,
+                            replay_journal=path)
+    for replayed_account, recorded_account in zip(replayed.accounts, recorded.accounts):
+        pd.testing.assert_frame_equal(equity_curve(replayed_account.portfolio),
+                                      equity_curve(recorded_account.portfolio))
+
+
+def test_replay_of_a_journal_of_other_symbols(universe_dir, tmp_path):
+    path = str(tmp_path / "events.journal")
+    EventJournal(path, None, UNIVERSE[::-1]).close()
+    with pytest.raises(ValueError):
+        run_backtest(universe_dir, Portfolio, replay_journal=path)
@@ -0,0 +1,40 @@
+import contextlib
+import io
+import os
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import pytest
+
+from DataHandler import HistoricCSVDataHandler
+from Events import MarketEvent, SignalEvent
+from Strategies.Buy_And_Hold_Strat import BuyAndHoldStrat
+from Strategies.MAC_Strat import MovingAverageCrossOverStrat
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "DataDir")
+
+
+@pytest.mark.parametrize("strategy_cls, params", [
+    (MovingAverageCrossOverStrat, {"short_window": 10, "long_window": 50}),
+    (BuyAndHoldStrat, {}),
+])
+def test_signals_are_stamped_with_the_bar_datetime(strategy_cls, params):
+    events = queue.Queue()
+    bars = HistoricCSVDataHandler(events, DATA_DIR, ["AAPL"], use_cache=False)
+    strategy = strategy_cls(bars, events, **params)
+
+    signals = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(500):
+            bars.update_bars()
+            while not events.empty():
+                event = events.get(False)
+                if isinstance(event, MarketEvent):
+                    strategy.calculate_signals(event)
+                elif isinstance(event, SignalEvent):
+                    signals.append(event)
+                    assert event.datetime == bars.get_latest_bar_datetime(event.symbol)
+    assert signals
@@ -0,0 +1,36 @@
+import contextlib
+import io
+import os
+from datetime import datetime
+
+import pytest
+
+from BacktesterLoop import Backtest
+from DataHandler import HistoricCSVDataHandler
+from Execution import SimpleSimulatedExecutionHandler
+from Portfolio import Portfolio
+from Strategies.MAC_Strat import MovingAverageCrossOverStrat
+from VectorizedBacktest import VectorizedBacktest, check_parity
+from conftest import UNIVERSE
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "DataDir")
+
+
+@pytest.mark.parametrize("universe, params", [
+    (False, {"short_window": 20, "long_window": 50}),
+    (False, {"short_window": 5, "long_window": 30}),
+    (True, {"short_window": 5, "long_window": 20}),
+])
+def test_vectorized_backtest_matches_the_event_driven_loop(universe_dir, universe, params):
+    data_dir, symbol_list = (str(universe_dir), UNIVERSE) if universe else (DATA_DIR, ["AAPL"])
+    settings = (data_dir, symbol_list, 100000.0)
+    start_date, end_date = datetime(1990, 1, 1), datetime(2021, 1, 1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        backtest = Backtest(*settings + (0.0, start_date, end_date, "1d", HistoricCSVDataHandler,
+                                         SimpleSimulatedExecutionHandler, Portfolio, MovingAverageCrossOverStrat),
+                            strategy_params=params)
+    vectorized = VectorizedBacktest(*settings + (start_date, end_date, "1d", HistoricCSVDataHandler,
+                                                 MovingAverageCrossOverStrat), strategy_params=params)
+    parity, max_difference = check_parity(backtest, vectorized)
+    assert parity, max_difference
+    assert backtest.fills > 0
@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from DataHandler import HistoricCSVDataHandler
+from Execution import SimpleSimulatedExecutionHandler
+from Portfolio import Portfolio
+from Strategies.MAC_Strat import MovingAverageCrossOverStrat
+from WalkForward import stitch_equity_curves, walk_forward, walk_forward_windows
+from conftest import UNIVERSE
+
+
+class TrainedMACStrat(MovingAverageCrossOverStrat):
+    """
+    MAC strategy taking the training period of the window: the bars traded
+    are either all within it (training run) or all after it (test run).
+    """
+
+    def __init__(self, bars, events, short_window=100, long_window=400, train_start_date=None, train_end_date=None):
+        MovingAverageCrossOverStrat.__init__(self, bars, events, short_window, long_window)
+        traded = bars.bar_datetimes[bars.bar_cursor:]
+        assert traded[-1] < train_end_date or traded[0] >= train_end_date
+
+
+def test_walk_forward_windows():
+    rolling = walk_forward_windows(datetime(2015, 1, 1), datetime(2015, 12, 1), pd.DateOffset(months=6),
+                                   pd.DateOffset(months=2))
+    assert [window[2].month for window in rolling] == [7, 9, 11]
+    assert rolling[-1][3] == pd.Timestamp(2015, 12, 1)
+    assert [window[0].month for window in rolling] == [1, 3, 5]
+    anchored = walk_forward_windows(datetime(2015, 1, 1), datetime(2015, 12, 1), pd.DateOffset(months=6),
+                                    pd.DateOffset(months=2), anchored=True)
+    assert all(window[0] == pd.Timestamp(2015, 1, 1) for window in anchored)
+
+
+def test_walk_forward_trades_out_of_sample(universe_dir):
+    windows, equity_curve = walk_forward(str(universe_dir), UNIVERSE, 100000.0, datetime(2015, 1, 1),
+                                         datetime(2016, 7, 1), "1d", HistoricCSVDataHandler,
+                                         SimpleSimulatedExecutionHandler, Portfolio, TrainedMACStrat,
+                                         train_length=pd.DateOffset(months=6), test_length=pd.DateOffset(months=3),
+                                         param_grid={"short_window": [3, 5], "long_window": [10, 20]},
+                                         refit=True, processes=2)
+    assert len(windows) == 4
+    assert set(windows["short_window"]) <= {3, 5}
+    # The stitched curve only covers the test periods, each one once
+    assert equity_curve.index.is_unique
+    assert equity_curve.index[0] >= windows["test_start"].iloc[0]
+    for window in range(len(windows)):
+        dates = equity_curve.index[equity_curve["window"] == window]
+        assert windows["test_start"].iloc[window] <= dates.min() and dates.max() < windows["test_end"].iloc[window]
+    np.testing.assert_allclose(equity_curve["total"].iloc[-1] / 100000.0,
+                               np.prod(1.0 + equity_curve["returns"].values))
+
+
+def test_stitched_curve_chains_the_windows():
+    index = pd.to_datetime(["2020-01-01", "2020-01-02", "2020-01-03"])
+    first = pd.DataFrame({"total": [100.0, 110.0, 121.0]}, index=index)
+    second = pd.DataFrame({"total": [100.0, 90.0]}, index=pd.to_datetime(["2020-01-03", "2020-01-06"]))
+    stitched = stitch_equity_curves([first, second], 1000.0)
+    np.testing.assert_allclose(stitched["total"].values, [1100.0, 1210.0, 1089.0])